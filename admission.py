@@ -0,0 +1,211 @@
+"""Per-client rate limiting and load shedding for the generation endpoints.
+
+Every client IP has a token bucket that refills at ``rate`` tokens per second
+up to ``burst`` tokens. A request costs tokens according to its endpoint and
+size; when its client's bucket cannot pay, it is refused with 429 and a
+``Retry-After`` of the time until it could. The buckets live in a
+memory-mapped file under ``RATE_LIMIT_DIR`` (``gunicorn.conf.py`` creates
+one) that every worker on the host maps and locks with ``fcntl``, so a client
+gets one allowance however its requests are spread over the workers. Without
+the directory, each process keeps its own buckets.
+
+Separately, each worker serves a bounded number of generation requests at
+once. A request that does not get a slot within ``wait`` seconds is shed with
+503 instead of queueing behind the others.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+from hashlib import blake2b
+
+try:
+    import fcntl
+except ImportError:  # Not on POSIX: buckets are kept per process
+    fcntl = None
+
+# One bucket: client key (0 marks a free slot), tokens left and when they were counted
+_SLOT = struct.Struct('<Qdd')
+# Slots looked at for a key before a new client is refused
+_PROBES = 8
+
+def client_key(client):
+    """64-bit bucket key of a client identifier, never 0"""
+    return int.from_bytes(blake2b(client.encode('utf-8'), digest_size=8).digest(), 'big') or 1
+
+class TokenBuckets:
+    """Fixed-size open-addressing table of token buckets in shared memory.
+
+    A bucket that has refilled completely is no different from a missing one,
+    so its slot is free for another client. A slot whose client is still
+    paying back is never taken over, as that would hand the client a full
+    bucket again: when all probed slots are in use, a new client is refused
+    until the first of them has refilled.
+    """
+
+    def __init__(self, rate, burst, directory=None, slots=4096):
+        self.rate = rate
+        self.burst = burst
+        self.directory = directory
+        self.slots = slots
+
+        self.admitted = 0
+        self.throttled = 0
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    @property
+    def shared(self):
+        return bool(self.directory) and fcntl is not None
+
+    def _open(self):
+        # Mapped per process; the file, not the mapping, is what workers share
+        size = self.slots * _SLOT.size
+        if self.shared:
+            os.makedirs(self.directory, exist_ok=True)
+            self._fd = os.open(os.path.join(self.directory, 'rate_limit.buckets'), os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, size)
+        else:
+            self._map = mmap.mmap(-1, size)
+        self._pid = os.getpid()
+
+    def take(self, client, cost, now=None):
+        """Charge ``cost`` tokens to a client.
+
+        Returns 0 when the request is admitted, otherwise the seconds until the
+        bucket holds enough tokens. Costs above ``burst`` are charged as ``burst``
+        so that any request can get through from a full bucket.
+        """
+        if not self.enabled:
+            return 0
+        key = client_key(client)
+        cost = min(cost, self.burst)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            if self.shared:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time() if now is None else now
+                offset, tokens = self._find(key, now)
+                if offset is None:
+                    wait = (self.burst - tokens) / self.rate
+                elif tokens >= cost:
+                    tokens -= cost
+                    wait = 0
+                else:
+                    wait = (cost - tokens) / self.rate
+                if offset is not None:
+                    _SLOT.pack_into(self._map, offset, key, tokens, now)
+            finally:
+                if self.shared:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if wait:
+            self.throttled += 1
+        else:
+            self.admitted += 1
+        return wait
+
+    def _find(self, key, now):
+        """Offset of a key's slot and its tokens at ``now``, claiming a free slot for a new key.
+
+        The offset is None when no probed slot is free; the tokens are then
+        those of the probed bucket closest to full.
+        """
+        start = key % self.slots
+        free = None
+        fullest = 0.0
+        for probe in range(_PROBES):
+            offset = (start + probe) % self.slots * _SLOT.size
+            slot_key, tokens, updated = _SLOT.unpack_from(self._map, offset)
+            # The clock may step back; never refill for negative time
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            if slot_key == key:
+                return offset, tokens
+            if free is None and (slot_key == 0 or tokens >= self.burst):
+                free = offset
+            fullest = max(fullest, tokens)
+        if free is None:
+            return None, fullest
+        return free, float(self.burst)
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'shared': self.shared,
+            'slots': self.slots,
+            'admitted': self.admitted,
+            'throttled': self.throttled
+        }
+
+class ConcurrencyGate:
+    """Bounds the requests a worker serves at once, shedding the ones that wait too long"""
+
+    def __init__(self, limit, wait=0.25):
+        self.limit = limit
+        self.wait = wait
+
+        self.in_flight = 0
+        self.shed = 0
+
+        self._slots = threading.BoundedSemaphore(max(1, limit))
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    def acquire(self):
+        """Take a slot, waiting at most ``wait`` seconds; False when the request should be shed"""
+        if not self.enabled:
+            return True
+        if not self._slots.acquire(timeout=self.wait):
+            with self._lock:
+                self.shed += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'wait': self.wait,
+            'in_flight': self.in_flight,
+            'shed': self.shed
+        }
+
+rate_limiter = TokenBuckets(
+    rate=float(os.environ.get('RATE_LIMIT_RATE', 10.0)),
+    burst=float(os.environ.get('RATE_LIMIT_BURST', 100.0)),
+    directory=os.environ.get('RATE_LIMIT_DIR'),
+    slots=int(os.environ.get('RATE_LIMIT_SLOTS', 4096))
+)
+
+request_gate = ConcurrencyGate(
+    limit=int(os.environ.get('MAX_IN_FLIGHT', 6)),
+    wait=float(os.environ.get('MAX_IN_FLIGHT_WAIT', 0.25))
+)
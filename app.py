@@ -1,17 +1,80 @@
-from flask import Flask, render_template, request, send_file
-import barcode
-from barcode.writer import ImageWriter
-import qrcode
+import time
+STARTUP_BEGAN = time.perf_counter()  # Taken before any other import so cold starts are measured in full
+
+from flask import Flask, render_template, request, send_file, jsonify, stream_with_context, url_for, g, redirect
 import io
 import base64
-from PIL import Image
+import hashlib
+import math
 import os
-from datetime import datetime
+import json
+import atexit
+import shutil
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, unquote
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
+from render_cache import render_cache, make_cache_key
+from validation import (ParameterError, parse_barcode_params, parse_qr_params, qr_log_options, barcode_form_data,
+                        SPEC_PARSERS, parse_sheet_layout, parse_stats_params, file_extension, mimetype_for,
+                        wants_negotiation, barcode_url_data, qr_url_data, url_query, encode_url_text,
+                        QR_BOX_SIZE_RANGE, parse_qr_matrix_params, QR_MATRIX_OUTPUTS, QR_MATRIX_FORMAT,
+                        qr_form_data)
+from archive_stream import iter_zip, iter_parallel
+from generation_log import GenerationLogWriter
+from render_engine import render_engine, RenderQueueFull, RenderTimeout
+import stage_timing
+import metrics
+from usage_stats import RollupCompactor, query_stats
+from storage_policy import LookupResolver, StoragePolicy, VOLATILE_HEADERS
+from admission import rate_limiter, request_gate
+from bulk_jobs import JOB_FORMATS, detect_format, count_specs, job_dir, upload_path, chunk_path
 
 app = Flask(__name__)
 
+# Reverse proxies in front of the app. The client address is taken from this
+# many X-Forwarded-For entries set by them; with none, X-Forwarded-For is the
+# client's own claim and the connecting address is used instead
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+# Batch rendering limits
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 1000))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+
+# Warm-up: how many of the most requested recent values to pre-render
+WARMUP_HOT_VALUES = int(os.environ.get('WARMUP_HOT_VALUES', 50))
+WARMUP_HOT_WINDOW_HOURS = int(os.environ.get('WARMUP_HOT_WINDOW_HOURS', 24))
+
+# GET endpoints: how long HTTP caches and CDNs may keep an image, and a redirect to its canonical URL
+URL_CACHE_MAX_AGE = int(os.environ.get('URL_CACHE_MAX_AGE', 365 * 24 * 3600))
+URL_REDIRECT_MAX_AGE = int(os.environ.get('URL_REDIRECT_MAX_AGE', 24 * 3600))
+
+# Label sheets
+SHEET_MAX_LABELS = int(os.environ.get('SHEET_MAX_LABELS', 5000))
+
+# Bulk jobs: uploads and rendered chunks are shared with jobs_worker.py through JOBS_DIR
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(app.instance_path, 'jobs'))
+JOBS_MAX_ITEMS = int(os.environ.get('JOBS_MAX_ITEMS', 1000000))
+JOBS_CHUNK_SIZE = int(os.environ.get('JOBS_CHUNK_SIZE', 1000))
+
+# Admission control: rate limit tokens per request by endpoint (endpoints not
+# listed are never limited), and the QR code endpoints whose cost also grows
+# with the pixel area of a module, through the named box size field
+ENDPOINT_COSTS = {
+    'generate_barcode': 1, 'download_barcode': 1, 'generate_qr': 1, 'download_qr': 1,
+    'api_generate_barcode': 1, 'api_generate_qr': 1, 'api_barcode_url': 1, 'api_qrcode_url': 1,
+    'api_qrcode_matrix': 1, 'api_generate_batch': 10, 'api_generate_sheet': 10, 'api_create_job': 5
+}
+QR_BOX_SIZE_FIELDS = {
+    'generate_qr': 'qr_box_size', 'download_qr': 'qr_box_size',
+    'api_generate_qr': 'box_size', 'api_qrcode_url': 'box_size'
+}
+
 def get_real_ip():
     """Get the real client IP address, accounting for proxies and load balancers."""
     # Check common proxy headers in order of preference
@@ -37,54 +100,160 @@ def get_real_ip():
 
 def get_debug_headers():
     """Get all request headers for debugging purposes."""
-    return str(dict(request.headers)) + f" | remote_addr: {request.remote_addr}"
+    headers = {name: value for name, value in request.headers.items() if name not in VOLATILE_HEADERS}
+    return str(headers) + f" | remote_addr: {request.remote_addr}"
 
 def log_generation_attempt(code_type, code_value, barcode_symbology=None, image_format=None, qr_options=None, success=True, error_message=None):
-    """Log all generation attempts (successful and failed) to database"""
+    """Log all generation attempts (successful and failed) to database.
+
+    The row is queued for the write-behind logger, so the request never waits
+    on a database round trip.
+    """
+    # Label the request's metrics with what it generated
+    labels = metrics.code_labels(code_type, barcode_symbology, image_format)
+    g.metric_labels = metrics.merge_labels(g.get('metric_labels'), labels)
     try:
-        record = GenerationRecord(
-            ip_address=get_real_ip(),
-            code_type=code_type,
-            barcode_symbology=barcode_symbology,
-            code_value=code_value,
-            image_format=image_format or 'PNG',
-            qr_options=qr_options,
-            user_agent=request.headers.get('User-Agent', ''),
-            debug_headers=get_debug_headers(),
-            success=success,
-            error_message=error_message
-        )
-        db.session.add(record)
-        db.session.commit()
-        print(f"✅ Logged {'successful' if success else 'failed'} {code_type} generation attempt")
-    except Exception as db_error:
-        print(f"❌ Database logging error: {db_error}")
+        with stage_timing.stage('log'):
+            generation_log.enqueue({
+                'ip_address': get_real_ip(),
+                'code_type': code_type,
+                'barcode_symbology': barcode_symbology,
+                'code_value': code_value,
+                'image_format': image_format or 'PNG',
+                'qr_options': qr_options,
+                'created_at': datetime.utcnow(),
+                'user_agent': request.headers.get('User-Agent', ''),
+                'debug_headers': get_debug_headers(),
+                'success': success,
+                'error_message': error_message
+            })
+    except Exception as log_error:
+        print(f"❌ Database logging error: {log_error}")
+
+def log_validation_failure(code_type, error):
+    """Log a generation attempt rejected by parameter validation and count it by reason"""
+    metrics.VALIDATION_FAILURES.labels(code_type, error.error).inc()
+    log_generation_attempt(code_type, **error.context, success=False, error_message=error.log_message)
+
+def render_function(code_type):
+    """Rendering entry point for a code type.
+
+    The rendering stack (python-barcode, qrcode, Pillow, NumPy) is imported on
+    first use rather than with the app, so a cold worker can serve pages that
+    do not render anything without paying for it.
+    """
+    from rendering import render_barcode, render_qr, render_qr_matrix
+    return {'barcode': render_barcode, 'qrcode': render_qr, 'qrmatrix': render_qr_matrix}[code_type]
 
-# Database configuration with PostgreSQL priority and SQLite fallback
+# (cache key, image bytes, exception) of a request's image that asgi.py found
+# in the render cache, or could not schedule a render for, before dispatching
+# the request to its view on the event loop
+prerendered = ContextVar('prerendered', default=None)
+
+def render_uncached(code_type, params, wait=None):
+    """Render through the render engine, bypassing the cache"""
+    with stage_timing.stage('render'), metrics.RENDERS_IN_FLIGHT.track_inprogress():
+        return render_engine.render(render_function(code_type), params, wait=wait)
+
+def cached_render(code_type, params, wait=None):
+    """Render through the in-process cache, returning (image bytes, 'HIT' or 'MISS')"""
+    cache_key = make_cache_key(code_type, params)
+    rendered = prerendered.get()
+    if rendered is not None and rendered[0] == cache_key:
+        # Looked up before the view ran, so an eviction since cannot make it render
+        prerendered.set(None)
+        data, error = rendered[1], rendered[2]
+        if error is not None:
+            raise error
+    else:
+        data = render_cache.get(cache_key)
+    if data is not None:
+        metrics.RENDER_CACHE_LOOKUPS.labels('hit').inc()
+        return data, 'HIT'
+    metrics.RENDER_CACHE_LOOKUPS.labels('miss').inc()
+    data = render_uncached(code_type, params, wait)
+    render_cache.put(cache_key, data)
+    metrics.set_cache_occupancy(render_cache.stats())
+    return data, 'MISS'
+
+def image_response(data, image_format, download_name, etag, cache_status, negotiated=False):
+    """Build an inline image response carrying a strong ETag"""
+    response = send_file(
+        io.BytesIO(data),
+        as_attachment=False,
+        download_name=download_name,
+        mimetype=mimetype_for(image_format)
+    )
+    response.set_etag(etag)
+    if negotiated:
+        # image_format=auto: the format depends on the Accept header
+        response.vary.add('Accept')
+    response.headers['X-Cache'] = cache_status
+    timings = stage_timing.current()
+    if timings:
+        response.headers['Server-Timing'] = stage_timing.server_timing_header(timings)
+    return response
+
+def render_unavailable_response(error):
+    """Map render engine back-pressure and timeouts to API error responses"""
+    if isinstance(error, RenderQueueFull):
+        return {
+            'error': 'Service busy',
+            'message': 'Too many images are being generated right now, please retry shortly'
+        }, 503, {'Retry-After': '1'}
+    return {
+        'error': 'Generation timed out',
+        'message': f'Rendering took longer than {render_engine.timeout:g} seconds'
+    }, 504
+
+def not_modified_response(etag, negotiated=False):
+    """Answer a matching If-None-Match without rendering or sending a body"""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    if negotiated:
+        response.vary.add('Accept')
+    return response
+
+# Database configuration with PostgreSQL priority and SQLite fallback.
+# Nothing connects here: the engine opens connections on first use, so a
+# worker starts even while the database is slow or unreachable.
 def configure_database():
     database_url = os.environ.get('DATABASE_URL')
     
     if database_url and database_url.startswith('postgresql://'):
-        try:
-            # Test PostgreSQL connection
-            import psycopg2
-            conn = psycopg2.connect(database_url)
-            conn.close()
-            print(f"✅ Connected to PostgreSQL: {database_url.split('@')[1] if '@' in database_url else 'remote'}")
-            return database_url
-        except Exception as e:
-            print(f"❌ PostgreSQL connection failed: {e}")
-            print("🔄 Falling back to SQLite...")
+        print(f"🐘 Using PostgreSQL database: {database_url.split('@')[1] if '@' in database_url else 'remote'}")
+        return database_url
+    
+    if database_url and database_url.startswith('sqlite:'):
+        print(f"📁 Using SQLite database: {database_url}")
+        return database_url
     
     sqlite_url = 'sqlite:///barcode_records.db'
     print(f"📁 Using SQLite database: {sqlite_url}")
     return sqlite_url
 
+def engine_options(database_url):
+    """Connection pool settings for PostgreSQL; SQLite keeps SQLAlchemy's defaults"""
+    if not database_url.startswith('postgresql://'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,  # Replace connections dropped by the server or a proxy before using them
+        'connect_args': {'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5))}
+    }
+
 app.config['SQLALCHEMY_DATABASE_URI'] = configure_database()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# Flask-Migrate (and Alembic) is only needed by the `flask db` commands; init_db.py registers it itself
+if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
 
 # Database model
 class GenerationRecord(db.Model):
@@ -97,17 +266,116 @@ class GenerationRecord(db.Model):
     code_value = db.Column(db.Text, nullable=False)
     image_format = db.Column(db.String(10), nullable=False)  # 'PNG', 'JPEG', 'WEBP'
     qr_options = db.Column(db.JSON)  # For QR codes: {fill_color, back_color, box_size, border, error_correction}
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_agent = db.Column(db.Text)
-    debug_headers = db.Column(db.Text)  # Temporary field for debugging
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)  # Partition key on PostgreSQL
+    user_agent = db.Column(db.Text)  # Rows written before the lookup tables; see user_agent_id
+    debug_headers = db.Column(db.Text)  # Temporary field for debugging; see headers_id
+    user_agent_id = db.Column(db.Integer)  # user_agents.id
+    headers_id = db.Column(db.Integer)  # header_sets.id
     success = db.Column(db.Boolean, nullable=False, default=True)  # True for successful generations, False for failed attempts
     error_message = db.Column(db.Text)  # Error details for failed attempts
+
+    __table_args__ = (
+        db.Index('ix_generation_records_code_type_symbology', 'code_type', 'barcode_symbology'),
+        # Failures are rare, so (success, created_at) finds recent failures without scanning successes
+        db.Index('ix_generation_records_success_created_at', 'success', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<GenerationRecord {self.code_type}: {self.code_value[:50]}>'
 
-# Initialize database - this will be handled by migrations in production
-# For development, we'll use create_all() as a fallback
+class UserAgent(db.Model):
+    """Distinct User-Agent values referenced by generation_records.user_agent_id"""
+    __tablename__ = 'user_agents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value_hash = db.Column(db.String(32), nullable=False, unique=True)  # BLAKE2b-128 of value, hex
+    value = db.Column(db.Text, nullable=False)
+
+class HeaderSet(db.Model):
+    """Distinct request header sets referenced by generation_records.headers_id"""
+    __tablename__ = 'header_sets'
+
+    id = db.Column(db.Integer, primary_key=True)
+    value_hash = db.Column(db.String(32), nullable=False, unique=True)  # BLAKE2b-128 of value, hex
+    value = db.Column(db.Text, nullable=False)
+
+class GenerationRollup(db.Model):
+    """Hourly usage per code type, symbology and image format, folded from generation_records"""
+    __tablename__ = 'generation_rollups_hourly'
+
+    hour = db.Column(db.DateTime, primary_key=True)  # Start of the hour, UTC
+    code_type = db.Column(db.String(20), primary_key=True)
+    barcode_symbology = db.Column(db.String(50), primary_key=True)  # '' for QR codes
+    image_format = db.Column(db.String(10), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    ip_sketch = db.Column(db.LargeBinary, nullable=False)  # HyperLogLog registers of the client IPs
+    updated_at = db.Column(db.DateTime)
+
+class GenerationRollupState(db.Model):
+    """Single row: how far generation_records have been folded into the rollups"""
+    __tablename__ = 'generation_rollup_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)  # Records up to this id are folded
+    seen_id = db.Column(db.Integer, nullable=False, default=0)  # Highest id seen by the previous run
+    updated_at = db.Column(db.DateTime)
+
+class BulkJob(db.Model):
+    __tablename__ = 'bulk_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex, also the JOBS_DIR subdirectory
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'completed', 'failed'
+    source_format = db.Column(db.String(10), nullable=False)  # 'csv' or 'ndjson'
+    total_items = db.Column(db.Integer, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    completed_items = db.Column(db.Integer, nullable=False, default=0)  # Checkpoint: items before this are in finished chunks
+    failed_items = db.Column(db.Integer, nullable=False, default=0)
+    processing_seconds = db.Column(db.Float, nullable=False, default=0.0)  # Rendering time across all runs
+    ip_address = db.Column(db.String(45))
+    worker_id = db.Column(db.String(100))
+    heartbeat_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)
+
+    def __repr__(self):
+        return f'<BulkJob {self.id}: {self.status} {self.completed_items}/{self.total_items}>'
+
+# User agents and headers are stored once and referenced by id
+lookup_resolver = LookupResolver(db, {
+    'user_agent': (UserAgent.__table__, 'user_agent_id'),
+    'debug_headers': (HeaderSet.__table__, 'headers_id')
+})
+
+# Generation attempts are written in bulk from a background thread
+generation_log = GenerationLogWriter(
+    app, db, GenerationRecord.__table__, prepare=lookup_resolver,
+    max_queue=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+    batch_size=int(os.environ.get('LOG_BATCH_SIZE', 500)),
+    flush_interval=float(os.environ.get('LOG_FLUSH_INTERVAL', 2.0)),
+    breaker_threshold=int(os.environ.get('LOG_BREAKER_THRESHOLD', 3)),
+    breaker_cooldown=float(os.environ.get('LOG_BREAKER_COOLDOWN', 30.0))
+)
+atexit.register(generation_log.close)
+
+# Keeps the hourly rollups behind /api/stats current
+rollup_compactor = RollupCompactor(
+    app, db, GenerationRecord, GenerationRollup, GenerationRollupState,
+    interval=float(os.environ.get('STATS_COMPACT_INTERVAL', 60.0)),
+    batch_size=int(os.environ.get('STATS_COMPACT_BATCH_SIZE', 20000))
+)
+
+# Monthly partitions or dated tables, and archival of old months (python storage_policy.py maintain)
+storage_policy = StoragePolicy(
+    db, GenerationRecord.__table__, lookup_resolver,
+    archive_dir=os.environ.get('LOG_ARCHIVE_DIR', os.path.join(app.instance_path, 'archive')),
+    retention_days=int(os.environ.get('LOG_RETENTION_DAYS', 365))
+)
+
+# Initialize database - run once per deployment by init_db.py (and by the
+# development server below), not by every worker on import
 def init_db():
     """Initialize database tables"""
     try:
@@ -118,7 +386,9 @@ def init_db():
         columns_to_add = [
             ('debug_headers', 'TEXT', None),
             ('success', 'BOOLEAN', True),
-            ('error_message', 'TEXT', None)
+            ('error_message', 'TEXT', None),
+            ('user_agent_id', 'INTEGER', None),
+            ('headers_id', 'INTEGER', None)
         ]
 
         # Check if we're using PostgreSQL or SQLite
@@ -172,13 +442,110 @@ def init_db():
                     print(f"⚠️  Schema check warning for {column_name}: {schema_error}")
                     db.session.rollback()  # Rollback after warning
 
+        # Partitioning rewrites the table under locks, so it is left to
+        # python storage_policy.py maintain rather than every start
+        ensure_indexes(is_postgresql)
+
         print("✅ Schema migration complete")
 
     except Exception as e:
         print(f"❌ Error creating database tables: {e}")
 
-with app.app_context():
-    init_db()
+def ensure_indexes(is_postgresql):
+    """Create the generation_records indexes on tables created before they were declared"""
+    # CONCURRENTLY keeps PostgreSQL accepting inserts while a large table is indexed;
+    # it cannot run inside a transaction, nor on a partitioned table
+    concurrently = 'CONCURRENTLY ' if is_postgresql and not storage_policy.is_partitioned() else ''
+    for index in GenerationRecord.__table__.indexes:
+        columns = ', '.join(column.name for column in index.columns)
+        try:
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                connection.execute(db.text(
+                    f"CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"))
+            print(f"✅ Index {index.name} ready")
+        except Exception as index_error:
+            print(f"❌ Failed to create index {index.name}: {index_error}")
+
+@app.before_request
+def reset_stage_timings():
+    """Start each request with empty render stage timings"""
+    stage_timing.collect()
+    g.request_started = time.perf_counter()
+
+def request_cost(endpoint):
+    """Rate limit tokens a request costs, or None when its endpoint is not limited"""
+    cost = ENDPOINT_COSTS.get(endpoint)
+    if cost is None or endpoint not in QR_BOX_SIZE_FIELDS:
+        return cost
+    data = request.get_json(silent=True) if request.is_json else request.values
+    try:
+        box_size = float(data.get(QR_BOX_SIZE_FIELDS[endpoint], 10))
+    except (AttributeError, ValueError, TypeError):
+        box_size = 10
+    # A module of box_size 50 has 25 times the pixels of the default 10
+    return cost * max(1.0, min(box_size, QR_BOX_SIZE_RANGE[1]) / 10) ** 2
+
+# (rate limit wait, concurrency slot taken) of a request that asgi.py admitted
+# off the event loop, since both checks may block
+preadmitted = ContextVar('preadmitted', default=None)
+
+def check_admission(cost):
+    """Charge a request to its client and take a concurrency slot; returns (rate limit wait, slot taken)"""
+    # Not get_real_ip: a client could pick its own bucket through X-Forwarded-For
+    wait = rate_limiter.take(request.remote_addr or 'unknown', cost)
+    return wait, not wait and request_gate.acquire()
+
+@app.before_request
+def admit_request():
+    """Refuse generation requests from clients over their rate limit, and shed them when the worker is full"""
+    cost = request_cost(request.endpoint)
+    if cost is None:
+        return None
+    admitted = preadmitted.get()
+    wait, acquired = admitted if admitted is not None else check_admission(cost)
+    if wait:
+        metrics.THROTTLED_REQUESTS.labels(request.url_rule.rule).inc()
+        return {
+            'error': 'Rate limit exceeded',
+            'message': f'Too many requests from this client, please retry in {math.ceil(wait)} seconds'
+        }, 429, {'Retry-After': str(math.ceil(wait))}
+    if not acquired:
+        metrics.SHED_REQUESTS.labels(request.url_rule.rule).inc()
+        return {
+            'error': 'Service busy',
+            'message': 'Too many requests are being served right now, please retry shortly'
+        }, 503, {'Retry-After': '1'}
+    g.admitted = True
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+@app.teardown_request
+def release_admission(error=None):
+    """Free the concurrency slot of an admitted request once its response, streamed or not, is done"""
+    if g.pop('admitted', False):
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        request_gate.release()
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    """Time generation requests by route and stage once the response, streamed or not, is done"""
+    labels = g.get('metric_labels')
+    timings = stage_timing.collect()
+    if labels is None or request.url_rule is None:
+        return
+    metrics.observe_request(request.url_rule.rule, labels, time.perf_counter() - g.request_started, timings)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for all workers"""
+    metrics.set_cache_occupancy(render_cache.stats())
+    body, content_type = metrics.exposition()
+    return app.response_class(body, content_type=content_type)
+
+@app.route('/_ah/warmup')
+def warmup():
+    """App Engine warmup request: get this instance ready before live traffic arrives"""
+    warm_up()
+    return '', 200
 
 @app.route('/')
 def index():
@@ -190,10 +557,12 @@ def debug():
     try:
         records = GenerationRecord.query.order_by(GenerationRecord.created_at.desc()).limit(10).all()
         debug_info = []
+        header_sets = {header_set.id: header_set.value for header_set in HeaderSet.query.filter(
+            HeaderSet.id.in_([record.headers_id for record in records if record.headers_id]))}
         for record in records:
             debug_info.append({
                 'ip_address': record.ip_address,
-                'debug_headers': getattr(record, 'debug_headers', 'column not available'),
+                'debug_headers': record.debug_headers or header_sets.get(record.headers_id),
                 'created_at': record.created_at
             })
         return str(debug_info)
@@ -216,7 +585,7 @@ def db_status():
         
         # Check if all required columns exist
         columns_status = []
-        required_columns = ['debug_headers', 'success', 'error_message']
+        required_columns = ['debug_headers', 'success', 'error_message', 'user_agent_id', 'headers_id']
         for col in required_columns:
             try:
                 db.session.execute(db.text(f"SELECT {col} FROM generation_records LIMIT 1")).fetchone()
@@ -224,6 +593,8 @@ def db_status():
             except Exception as e:
                 columns_status.append(f"❌ {col} column missing: {str(e)}")
         
+        log_stats = generation_log.stats()
+        
         return f"""
 Database Status Report:
 =====================
@@ -232,10 +603,43 @@ App Database URI: {db_url[:50]}...
 Connection Test: {db_test}
 Schema Status:
 {chr(10).join(columns_status)}
+Write-behind Log:
+Queued: {log_stats['queued']} / {log_stats['max_queue']}
+Flushed: {log_stats['flushed']} rows in {log_stats['batches']} batches
+Dropped: {log_stats['dropped']}
+Failed flushes: {log_stats['failed_flushes']}
+Circuit breaker: {log_stats['breaker']}
 """
     except Exception as e:
         return f"Status check error: {str(e)}"
 
+@app.route('/cache-status')
+def cache_status():
+    """Debug endpoint to inspect the render and symbol caches"""
+    from rendering import render_process_stats
+    stats = render_cache.stats()
+    try:
+        # Symbol caches live in the render processes; this samples whichever one takes the job
+        stats.update(render_engine.render(render_process_stats, {}))
+    except (RenderQueueFull, RenderTimeout) as e:
+        stats['symbols'] = {'error': str(e)}
+    return jsonify(stats)
+
+@app.route('/startup-status')
+def startup_status():
+    """Debug endpoint to inspect how long this worker took to start"""
+    return jsonify(startup_report)
+
+@app.route('/engine-status')
+def engine_status():
+    """Debug endpoint to inspect the render process pool"""
+    return jsonify(render_engine.stats())
+
+@app.route('/admission-status')
+def admission_status():
+    """Debug endpoint to inspect the rate limiter and the concurrency gate of this worker"""
+    return jsonify({'rate_limit': rate_limiter.stats(), 'concurrency': request_gate.stats()})
+
 @app.route('/migrate-schema')
 def migrate_schema():
     """Manual schema migration endpoint"""
@@ -251,40 +655,22 @@ def generate_barcode():
     barcode_type = request.form.get('barcode_type', 'code128')
     image_format = request.form.get('image_format', 'PNG')
     
-    if not text:
-        return render_template('index.html', error='Please enter text to generate barcode', 
+    try:
+        params = parse_barcode_params(barcode_form_data(request.form))
+    except ParameterError as e:
+        log_validation_failure('barcode', e)
+        return render_template('index.html', error=e.message, text=text,
                              barcode_type=barcode_type, image_format=image_format)
     
     try:
-        # Get the selected barcode class with specified format
-        writer = ImageWriter(format=image_format)
-        barcode_class = barcode.get_barcode_class(barcode_type)
-        barcode_instance = barcode_class(text, writer=writer)
-        
-        # Save to BytesIO buffer
-        buffer = io.BytesIO()
-        barcode_instance.write(buffer)
-        buffer.seek(0)
+        # Render the selected barcode type in the specified format
+        image_data, _ = cached_render('barcode', params)
         
         # Convert to base64 for display in HTML
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
+        img_base64 = base64.b64encode(image_data).decode()
         
         # Log generation to database
-        try:
-            record = GenerationRecord(
-                ip_address=get_real_ip(),
-                code_type='barcode',
-                barcode_symbology=barcode_type,
-                code_value=text,
-                image_format=image_format,
-                user_agent=request.headers.get('User-Agent', ''),
-                debug_headers=get_debug_headers()
-            )
-            db.session.add(record)
-            db.session.commit()
-        except Exception as db_error:
-            # Don't fail the request if database logging fails
-            print(f"Database logging error: {db_error}")
+        log_generation_attempt('barcode', params['text'], barcode_type, params['image_format'], success=True)
         
         return render_template('index.html', 
                              barcode_image=img_base64, 
@@ -305,31 +691,25 @@ def download_barcode():
     barcode_type = request.form.get('barcode_type', 'code128')
     image_format = request.form.get('image_format', 'PNG')
     
-    if not text:
-        return render_template('index.html', error='Please enter text to generate barcode', 
+    try:
+        params = parse_barcode_params(barcode_form_data(request.form))
+    except ParameterError as e:
+        log_validation_failure('barcode', e)
+        return render_template('index.html', error=e.message, text=text,
                              barcode_type=barcode_type, image_format=image_format)
     
     try:
-        # Get the selected barcode class with specified format
-        writer = ImageWriter(format=image_format)
-        barcode_class = barcode.get_barcode_class(barcode_type)
-        barcode_instance = barcode_class(text, writer=writer)
-        
-        # Save to BytesIO buffer
-        buffer = io.BytesIO()
-        barcode_instance.write(buffer)
-        buffer.seek(0)
+        # Render the selected barcode type in the specified format
+        image_data, _ = cached_render('barcode', params)
         
         # Set the appropriate file extension and mimetype
-        file_ext = image_format.lower()
-        if file_ext == 'jpeg':
-            file_ext = 'jpg'
-        mimetype = f'image/{file_ext}'
+        file_ext = file_extension(params['image_format'])
+        mimetype = mimetype_for(params['image_format'])
         
         return send_file(
-            buffer,
+            io.BytesIO(image_data),
             as_attachment=True,
-            download_name=f'{barcode_type}_barcode_{text}.{file_ext}',
+            download_name=f'{barcode_type}_barcode_{params["text"]}.{file_ext}',
             mimetype=mimetype
         )
     
@@ -340,159 +720,72 @@ def download_barcode():
                              barcode_type=barcode_type,
                              image_format=image_format)
 
+def qr_form_values():
+    """The QR code form's fields as submitted, to fill the form in again"""
+    return {
+        'qr_text': request.form.get('qr_text', ''),
+        'qr_error_correction': request.form.get('qr_error_correction', 'M'),
+        'qr_image_format': request.form.get('qr_image_format', 'PNG'),
+        'qr_fill_color': request.form.get('qr_fill_color', '#000000'),
+        'qr_back_color': request.form.get('qr_back_color', '#ffffff'),
+        'qr_box_size': request.form.get('qr_box_size', '10'),
+        'qr_border': request.form.get('qr_border', '4')
+    }
+
 @app.route('/generate_qr', methods=['POST'])
 def generate_qr():
-    text = request.form.get('qr_text', '')
-    error_correction = request.form.get('qr_error_correction', 'M')
-    image_format = request.form.get('qr_image_format', 'PNG')
-    fill_color = request.form.get('qr_fill_color', '#000000')
-    back_color = request.form.get('qr_back_color', '#ffffff')
-    box_size = int(request.form.get('qr_box_size', '10'))
-    border = int(request.form.get('qr_border', '4'))
-    
-    if not text:
-        return render_template('index.html', error='Please enter text to generate QR code', 
-                             qr_error_correction=error_correction, qr_image_format=image_format,
-                             qr_fill_color=fill_color, qr_back_color=back_color,
-                             qr_box_size=box_size, qr_border=border)
+    form_values = qr_form_values()
     
     try:
-        # Map error correction levels
-        error_correction_map = {
-            'L': qrcode.constants.ERROR_CORRECT_L,
-            'M': qrcode.constants.ERROR_CORRECT_M,
-            'Q': qrcode.constants.ERROR_CORRECT_Q,
-            'H': qrcode.constants.ERROR_CORRECT_H
-        }
-        
-        # Create QR code instance with advanced options
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=error_correction_map.get(error_correction, qrcode.constants.ERROR_CORRECT_M),
-            box_size=box_size,
-            border=border,
-        )
-        qr.add_data(text)
-        qr.make(fit=True)
-
-        # Create image with custom colors
-        img = qr.make_image(fill_color=fill_color, back_color=back_color)
-        
-        # Convert to desired format
-        buffer = io.BytesIO()
-        if image_format == 'JPEG':
-            # Convert to RGB for JPEG (remove alpha channel)
-            img = img.convert('RGB')
-        img.save(buffer, format=image_format)
-        buffer.seek(0)
+        params = parse_qr_params(qr_form_data(request.form))
+    except ParameterError as e:
+        log_validation_failure('qrcode', e)
+        return render_template('index.html', error=e.message, **form_values)
+    
+    try:
+        # Render the QR code with the requested options
+        image_data, _ = cached_render('qrcode', params)
         
         # Convert to base64 for display in HTML
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
+        img_base64 = base64.b64encode(image_data).decode()
         
         # Log generation to database
-        try:
-            qr_opts = {
-                'fill_color': fill_color,
-                'back_color': back_color,
-                'box_size': box_size,
-                'border': border,
-                'error_correction': error_correction
-            }
-            record = GenerationRecord(
-                ip_address=get_real_ip(),
-                code_type='qrcode',
-                code_value=text,
-                image_format=image_format,
-                qr_options=qr_opts,
-                user_agent=request.headers.get('User-Agent', ''),
-                debug_headers=get_debug_headers()
-            )
-            db.session.add(record)
-            db.session.commit()
-        except Exception as db_error:
-            # Don't fail the request if database logging fails
-            print(f"Database logging error: {db_error}")
+        log_generation_attempt('qrcode', params['text'], None, params['image_format'], qr_log_options(params),
+                               success=True)
         
-        return render_template('index.html', 
-                             qr_image=img_base64, 
-                             qr_text=text,
-                             qr_error_correction=error_correction,
-                             qr_image_format=image_format,
-                             qr_fill_color=fill_color,
-                             qr_back_color=back_color,
-                             qr_box_size=box_size,
-                             qr_border=border)
+        return render_template('index.html', qr_image=img_base64, **form_values)
     
     except Exception as e:
         return render_template('index.html', 
-                             error=f'Error generating QR code in {image_format} format: {str(e)}', 
-                             qr_text=text,
-                             qr_error_correction=error_correction,
-                             qr_image_format=image_format,
-                             qr_fill_color=fill_color,
-                             qr_back_color=back_color,
-                             qr_box_size=box_size,
-                             qr_border=border)
+                             error=f'Error generating QR code in {params["image_format"]} format: {str(e)}', 
+                             **form_values)
 
 @app.route('/download_qr', methods=['POST'])
 def download_qr():
-    text = request.form.get('qr_text', '')
-    error_correction = request.form.get('qr_error_correction', 'M')
-    image_format = request.form.get('qr_image_format', 'PNG')
-    fill_color = request.form.get('qr_fill_color', '#000000')
-    back_color = request.form.get('qr_back_color', '#ffffff')
-    box_size = int(request.form.get('qr_box_size', '10'))
-    border = int(request.form.get('qr_border', '4'))
-    
-    if not text:
-        return render_template('index.html', error='Please enter text to generate QR code', 
-                             qr_error_correction=error_correction, qr_image_format=image_format,
-                             qr_fill_color=fill_color, qr_back_color=back_color,
-                             qr_box_size=box_size, qr_border=border)
+    form_values = qr_form_values()
     
     try:
-        # Map error correction levels
-        error_correction_map = {
-            'L': qrcode.constants.ERROR_CORRECT_L,
-            'M': qrcode.constants.ERROR_CORRECT_M,
-            'Q': qrcode.constants.ERROR_CORRECT_Q,
-            'H': qrcode.constants.ERROR_CORRECT_H
-        }
-        
-        # Create QR code instance with advanced options
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=error_correction_map.get(error_correction, qrcode.constants.ERROR_CORRECT_M),
-            box_size=box_size,
-            border=border,
-        )
-        qr.add_data(text)
-        qr.make(fit=True)
-
-        # Create image with custom colors
-        img = qr.make_image(fill_color=fill_color, back_color=back_color)
-        
-        # Convert to desired format
-        buffer = io.BytesIO()
-        if image_format == 'JPEG':
-            # Convert to RGB for JPEG (remove alpha channel)
-            img = img.convert('RGB')
-        img.save(buffer, format=image_format)
-        buffer.seek(0)
+        params = parse_qr_params(qr_form_data(request.form))
+    except ParameterError as e:
+        log_validation_failure('qrcode', e)
+        return render_template('index.html', error=e.message, **form_values)
+    
+    try:
+        # Render the QR code with the requested options
+        image_data, _ = cached_render('qrcode', params)
         
         # Set the appropriate file extension and mimetype
-        file_ext = image_format.lower()
-        if file_ext == 'jpeg':
-            file_ext = 'jpg'
-        mimetype = f'image/{file_ext}'
+        file_ext = file_extension(params['image_format'])
+        mimetype = mimetype_for(params['image_format'])
         
         # Create safe filename from text (limit length and remove special chars)
+        text = params['text']
         safe_text = ''.join(c for c in text[:30] if c.isalnum() or c in (' ', '-', '_')).rstrip()
         if not safe_text:
             safe_text = 'qrcode'
         
         return send_file(
-            buffer,
+            io.BytesIO(image_data),
             as_attachment=True,
             download_name=f'qrcode_{safe_text}.{file_ext}',
             mimetype=mimetype
@@ -500,14 +793,8 @@ def download_qr():
     
     except Exception as e:
         return render_template('index.html', 
-                             error=f'Error generating QR code in {image_format} format: {str(e)}',
-                             qr_text=text,
-                             qr_error_correction=error_correction,
-                             qr_image_format=image_format,
-                             qr_fill_color=fill_color,
-                             qr_back_color=back_color,
-                             qr_box_size=box_size,
-                             qr_border=border)
+                             error=f'Error generating QR code in {params["image_format"]} format: {str(e)}',
+                             **form_values)
 
 # API Endpoints for headless access
 @app.route('/api/barcode', methods=['POST'])
@@ -519,72 +806,34 @@ def api_generate_barcode():
     else:
         data = request.form.to_dict()
     
-    # Extract parameters
-    text = data.get('text', '').strip()
-    barcode_type = data.get('barcode_type', 'code128')
-    image_format = data.get('image_format', 'PNG')
-    
-    # Validate required parameters
-    if not text:
-        error_msg = 'Missing required parameter: text'
-        log_generation_attempt('barcode', text or '[empty]', barcode_type, image_format, success=False, error_message=error_msg)
-        return {
-            'error': error_msg,
-            'message': 'The text parameter is required and cannot be empty'
-        }, 400
+    try:
+        with stage_timing.stage('parse'):
+            params = parse_barcode_params(data, request.accept_mimetypes)
+    except ParameterError as e:
+        log_validation_failure('barcode', e)
+        return e.to_dict(), 400
     
-    # Validate barcode type
-    valid_barcode_types = [
-        'code128', 'code39', 'ean', 'ean13', 'ean8', 'upc', 'upca', 
-        'isbn', 'isbn10', 'isbn13', 'issn', 'itf', 'gs1', 'gs1_128', 
-        'codabar', 'pzn', 'jan', 'ean14', 'gtin'
-    ]
-    if barcode_type not in valid_barcode_types:
-        error_msg = 'Invalid barcode_type'
-        log_generation_attempt('barcode', text, barcode_type, image_format, success=False, error_message=f'{error_msg}: {barcode_type}')
-        return {
-            'error': error_msg,
-            'message': f'barcode_type must be one of: {", ".join(valid_barcode_types)}',
-            'provided': barcode_type
-        }, 400
-    
-    # Validate image format
-    valid_image_formats = ['PNG', 'JPEG', 'WEBP']
-    if image_format.upper() not in valid_image_formats:
-        error_msg = 'Invalid image_format'
-        log_generation_attempt('barcode', text, barcode_type, image_format, success=False, error_message=f'{error_msg}: {image_format}')
-        return {
-            'error': error_msg,
-            'message': f'image_format must be one of: {", ".join(valid_image_formats)}',
-            'provided': image_format
-        }, 400
+    text, barcode_type, image_format = params['text'], params['barcode_type'], params['image_format']
+    negotiated = wants_negotiation(data)
+    etag = make_cache_key('barcode', params)
+    if request.if_none_match.contains(etag):
+        log_generation_attempt('barcode', text, barcode_type, image_format, success=True)
+        return not_modified_response(etag, negotiated)
     
     try:
-        # Generate barcode
-        writer = ImageWriter(format=image_format.upper())
-        barcode_class = barcode.get_barcode_class(barcode_type)
-        barcode_instance = barcode_class(text, writer=writer)
-        
-        # Save to BytesIO buffer
-        buffer = io.BytesIO()
-        barcode_instance.write(buffer)
-        buffer.seek(0)
+        # Generate barcode (or reuse a cached rendering)
+        image_data, cache_status = cached_render('barcode', params)
         
         # Log successful generation to database
-        log_generation_attempt('barcode', text, barcode_type, image_format.upper(), success=True)
+        log_generation_attempt('barcode', text, barcode_type, image_format, success=True)
         
         # Return the image file
-        file_ext = image_format.lower()
-        if file_ext == 'jpeg':
-            file_ext = 'jpg'
-        mimetype = f'image/{file_ext}'
-        
-        return send_file(
-            buffer,
-            as_attachment=False,
-            download_name=f'{barcode_type}_barcode.{file_ext}',
-            mimetype=mimetype
-        )
+        return image_response(image_data, image_format, f'{barcode_type}_barcode.{file_extension(image_format)}', etag, cache_status,
+                              negotiated)
+    
+    except (RenderQueueFull, RenderTimeout) as e:
+        log_generation_attempt('barcode', text, barcode_type, image_format, success=False, error_message=f'Barcode generation failed: {str(e)}')
+        return render_unavailable_response(e)
     
     except Exception as e:
         error_msg = f'Barcode generation failed: {str(e)}'
@@ -608,169 +857,519 @@ def api_generate_qr():
     else:
         data = request.form.to_dict()
     
-    # Extract parameters
-    text = data.get('text', '').strip()
-    error_correction = data.get('error_correction', 'M')
-    image_format = data.get('image_format', 'PNG')
-    fill_color = data.get('fill_color', '#000000')
-    back_color = data.get('back_color', '#ffffff')
+    try:
+        with stage_timing.stage('parse'):
+            params = parse_qr_params(data, request.accept_mimetypes)
+    except ParameterError as e:
+        log_validation_failure('qrcode', e)
+        return e.to_dict(), 400
+    
+    text, image_format = params['text'], params['image_format']
+    negotiated = wants_negotiation(data)
+    qr_options = qr_log_options(params)
+    etag = make_cache_key('qrcode', params)
+    if request.if_none_match.contains(etag):
+        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=True)
+        return not_modified_response(etag, negotiated)
     
-    # Validate and parse numeric parameters
     try:
-        box_size = int(data.get('box_size', '10'))
-        border = int(data.get('border', '4'))
-    except (ValueError, TypeError):
-        error_msg = 'Invalid numeric parameter'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': data.get('box_size'), 'border': data.get('border')}
-        log_generation_attempt('qrcode', text or '[empty]', None, image_format, qr_options, success=False, error_message=error_msg)
-        return {
-            'error': error_msg,
-            'message': 'box_size and border must be valid integers'
-        }, 400
+        # Generate QR code (or reuse a cached rendering)
+        image_data, cache_status = cached_render('qrcode', params)
+        
+        # Log successful generation to database
+        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=True)
+        
+        # Return the image file
+        return image_response(image_data, image_format, f'qrcode.{file_extension(image_format)}', etag, cache_status,
+                              negotiated)
     
-    # Validate required parameters
-    if not text:
-        error_msg = 'Missing required parameter: text'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text or '[empty]', None, image_format, qr_options, success=False, error_message=error_msg)
-        return {
-            'error': error_msg,
-            'message': 'The text parameter is required and cannot be empty'
-        }, 400
+    except (RenderQueueFull, RenderTimeout) as e:
+        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'QR code generation failed: {str(e)}')
+        return render_unavailable_response(e)
     
-    # Validate error correction level
-    valid_error_corrections = ['L', 'M', 'Q', 'H']
-    if error_correction not in valid_error_corrections:
-        error_msg = 'Invalid error_correction'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'{error_msg}: {error_correction}')
+    except Exception as e:
+        error_msg = f'QR code generation failed: {str(e)}'
+        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=error_msg)
         return {
-            'error': error_msg,
-            'message': f'error_correction must be one of: {", ".join(valid_error_corrections)}',
-            'provided': error_correction
-        }, 400
-    
-    # Validate image format
-    valid_image_formats = ['PNG', 'JPEG', 'WEBP']
-    if image_format.upper() not in valid_image_formats:
-        error_msg = 'Invalid image_format'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'{error_msg}: {image_format}')
+            'error': 'QR code generation failed',
+            'message': f'Error generating QR code in {image_format} format: {str(e)}',
+            'parameters': dict(params)
+        }, 500
+
+@app.route('/api/qrcode/matrix', methods=['POST'])
+def api_qrcode_matrix():
+    """API endpoint returning a QR code's module matrix, for clients that draw it themselves"""
+    if request.is_json:
+        data = request.get_json()
+    else:
+        data = request.form.to_dict()
+
+    try:
+        with stage_timing.stage('parse'):
+            params, output = parse_qr_matrix_params(data, request.accept_mimetypes)
+    except ParameterError as e:
+        log_validation_failure('qrcode', e)
+        return e.to_dict(), 400
+
+    log_args = (params['text'], None, QR_MATRIX_FORMAT, qr_log_options(params))
+    # Both outputs carry the same symbol, but each needs its own strong ETag
+    etag = make_cache_key('qrmatrix', dict(params, output=output))
+    if request.if_none_match.contains(etag):
+        log_generation_attempt('qrcode', *log_args, success=True)
+        response = not_modified_response(etag)
+        response.vary.add('Accept')
+        return response
+
+    try:
+        symbol, cache_status = cached_render('qrmatrix', params)
+    except (RenderQueueFull, RenderTimeout) as e:
+        log_generation_attempt('qrcode', *log_args, success=False, error_message=f'QR code encoding failed: {str(e)}')
+        return render_unavailable_response(e)
+    except Exception as e:
+        error_msg = f'QR code encoding failed: {str(e)}'
+        log_generation_attempt('qrcode', *log_args, success=False, error_message=error_msg)
+        return {'error': 'QR code encoding failed', 'message': str(e), 'parameters': params}, 500
+
+    log_generation_attempt('qrcode', *log_args, success=True)
+    if output == 'binary':
+        response = app.response_class(symbol, mimetype=QR_MATRIX_OUTPUTS['binary'])
+    else:
+        response = jsonify({
+            'version': symbol[0],
+            'size': symbol[1],
+            'error_correction': params['error_correction'],
+            'modules': base64.b64encode(symbol[2:]).decode('ascii')
+        })
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    response.headers['X-Cache'] = cache_status
+    timings = stage_timing.current()
+    if timings:
+        response.headers['Server-Timing'] = stage_timing.server_timing_header(timings)
+    return response
+
+def canonical_url(code_type, params):
+    """Path and query string of the GET URL of an image"""
+    text, image_format = params['text'], params['image_format']
+    if code_type == 'barcode':
+        path = url_for('api_barcode_url', symbology=params['barcode_type'],
+                       filename=f'{text}.{file_extension(image_format)}')
+    else:
+        path = url_for('api_qrcode_url', error_correction=params['error_correction'],
+                       filename=f'{encode_url_text(text)}.{file_extension(image_format)}')
+    return path, urlencode(url_query(code_type, params))
+
+def is_canonical_request(path, query):
+    """Whether the current request spells its image's GET URL exactly as ``path`` and ``query``"""
+    return unquote(path) == request.script_root + request.path and request.query_string.decode('latin-1') == query
+
+def url_image_response(code_type, params, log_args, failure):
+    """Serve a GET endpoint image for HTTP caches and CDNs.
+
+    Requests that spell the image differently from its canonical URL are
+    redirected there, so every image is cached at the edge under one key. The
+    ETag is a hash of the image bytes.
+    """
+    path, query = canonical_url(code_type, params)
+    if not is_canonical_request(path, query):
+        response = redirect(f'{path}?{query}' if query else path, 301)
+        response.headers['Cache-Control'] = f'public, max-age={URL_REDIRECT_MAX_AGE}'
+        return response
+
+    try:
+        image_data, cache_status = cached_render(code_type, params)
+    except (RenderQueueFull, RenderTimeout) as e:
+        log_generation_attempt(code_type, *log_args, success=False, error_message=f'{failure}: {str(e)}')
+        return render_unavailable_response(e)
+    except Exception as e:
+        log_generation_attempt(code_type, *log_args, success=False, error_message=f'{failure}: {str(e)}')
+        return {'error': failure, 'message': str(e), 'parameters': dict(params)}, 500
+
+    log_generation_attempt(code_type, *log_args, success=True)
+    etag = hashlib.blake2b(image_data, digest_size=16).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = not_modified_response(etag)
+    else:
+        image_format = params['image_format']
+        response = image_response(image_data, image_format, request.path.rpartition('/')[2], etag, cache_status)
+    response.headers['Cache-Control'] = f'public, max-age={URL_CACHE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/api/barcode/<symbology>/<path:filename>')
+def api_barcode_url(symbology, filename):
+    """Cacheable GET variant of /api/barcode: /api/barcode/<symbology>/<text>.<ext>"""
+    try:
+        with stage_timing.stage('parse'):
+            params = parse_barcode_params(barcode_url_data(symbology, filename, request.args))
+    except ParameterError as e:
+        log_validation_failure('barcode', e)
+        return e.to_dict(), 400
+
+    log_args = (params['text'], params['barcode_type'], params['image_format'])
+    return url_image_response('barcode', params, log_args, 'Barcode generation failed')
+
+@app.route('/api/qrcode/<error_correction>/<filename>')
+def api_qrcode_url(error_correction, filename):
+    """Cacheable GET variant of /api/qrcode: /api/qrcode/<ecc>/<base64url text>.<ext>?box_size=&border=&fill=&back="""
+    try:
+        with stage_timing.stage('parse'):
+            params = parse_qr_params(qr_url_data(error_correction, filename, request.args))
+    except ParameterError as e:
+        log_validation_failure('qrcode', e)
+        return e.to_dict(), 400
+
+    log_args = (params['text'], None, params['image_format'], qr_log_options(params))
+    return url_image_response('qrcode', params, log_args, 'QR code generation failed')
+
+@app.route('/api/batch', methods=['POST'])
+def api_generate_batch():
+    """API endpoint for rendering many barcodes and QR codes into one streamed ZIP archive"""
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get('items')
+    if not isinstance(items, list) or not items:
         return {
-            'error': error_msg,
-            'message': f'image_format must be one of: {", ".join(valid_image_formats)}',
-            'provided': image_format
+            'error': 'Invalid batch',
+            'message': 'The request body must be a non-empty JSON array of barcode and QR code specs'
         }, 400
-    
-    # Validate numeric ranges
-    if not (1 <= box_size <= 50):
-        error_msg = 'Invalid box_size'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'{error_msg}: {box_size}')
+    if len(items) > BATCH_MAX_ITEMS:
         return {
-            'error': error_msg,
-            'message': 'box_size must be between 1 and 50',
-            'provided': box_size
+            'error': 'Batch too large',
+            'message': f'A batch may contain at most {BATCH_MAX_ITEMS} items',
+            'provided': len(items)
         }, 400
     
-    if not (0 <= border <= 20):
-        error_msg = 'Invalid border'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'{error_msg}: {border}')
-        return {
-            'error': error_msg,
-            'message': 'border must be between 0 and 20',
-            'provided': border
-        }, 400
+    # Validate every item up front; invalid items are reported in the manifest
+    jobs = []
+    failures = []
+    for index, item in enumerate(items):
+        code_type = item.get('type', 'barcode') if isinstance(item, dict) else None
+        if code_type not in SPEC_PARSERS:
+            failures.append({'index': index, 'status': 'error', 'error': 'Invalid type',
+                             'message': 'type must be one of: barcode, qrcode'})
+            continue
+        try:
+            params = SPEC_PARSERS[code_type](item)
+        except ParameterError as e:
+            log_validation_failure(code_type, e)
+            failures.append({'index': index, 'type': code_type, 'status': 'error', **e.to_dict()})
+            continue
+        jobs.append((index, code_type, params))
     
-    # Validate color format (basic hex color validation)
-    import re
-    color_pattern = re.compile(r'^#[0-9A-Fa-f]{6}$')
-    if not color_pattern.match(fill_color):
-        error_msg = 'Invalid fill_color'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'{error_msg}: {fill_color}')
+    def render_job(job):
+        index, code_type, params = job
+        try:
+            return job, cached_render(code_type, params, wait=render_engine.timeout), None
+        except Exception as e:
+            return job, (None, None), e
+    
+    def generate():
+        manifest = list(failures)
+        for job, (image_data, cache_status), error in iter_parallel(render_job, jobs, BATCH_WORKERS):
+            index, code_type, params = job
+            if error is not None:
+                failure = 'Barcode generation failed' if code_type == 'barcode' else 'QR code generation failed'
+                log_batch_item(code_type, params, success=False, error_message=f'{failure}: {error}')
+                manifest.append({'index': index, 'type': code_type, 'status': 'error',
+                                 'error': failure, 'message': str(error)})
+                continue
+            name = batch_entry_name(index, code_type, params)
+            log_batch_item(code_type, params, success=True)
+            manifest.append({'index': index, 'type': code_type, 'status': 'ok', 'filename': name,
+                             'bytes': len(image_data), 'cache': cache_status})
+            yield name, image_data
+        manifest.sort(key=lambda entry: entry['index'])
+        yield 'manifest.json', json.dumps({'count': len(items), 'items': manifest}, indent=2).encode('utf-8')
+    
+    return app.response_class(
+        stream_with_context(iter_zip(generate())),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=batch.zip'}
+    )
+
+def batch_entry_name(index, code_type, params):
+    """Archive member name for a rendered batch item"""
+    label = params['barcode_type'] if code_type == 'barcode' else 'qrcode'
+    return f'{index:05d}_{label}.{file_extension(params["image_format"])}'
+
+def log_batch_item(code_type, params, success, error_message=None):
+    if code_type == 'barcode':
+        log_generation_attempt('barcode', params['text'], params['barcode_type'], params['image_format'],
+                               success=success, error_message=error_message)
+    else:
+        log_generation_attempt('qrcode', params['text'], None, params['image_format'], qr_log_options(params),
+                               success=success, error_message=error_message)
+
+@app.route('/api/sheet', methods=['POST'])
+def api_generate_sheet():
+    """API endpoint for laying out many labels on printable pages, streamed as PDF or PNG"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
         return {
-            'error': error_msg,
-            'message': 'fill_color must be a valid hex color (e.g., #000000)',
-            'provided': fill_color
+            'error': 'Invalid sheet',
+            'message': 'The request body must be a JSON object with a non-empty items array'
         }, 400
-    
-    if not color_pattern.match(back_color):
-        error_msg = 'Invalid back_color'
-        qr_options = {'error_correction': error_correction, 'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=f'{error_msg}: {back_color}')
+    items = data['items']
+    if len(items) > SHEET_MAX_LABELS:
         return {
-            'error': error_msg,
-            'message': 'back_color must be a valid hex color (e.g., #ffffff)',
-            'provided': back_color
+            'error': 'Sheet too large',
+            'message': f'A sheet may contain at most {SHEET_MAX_LABELS} labels',
+            'provided': len(items)
         }, 400
-    
+    defaults = data.get('defaults') or {}
+    if not isinstance(defaults, dict):
+        return {'error': 'Invalid defaults', 'message': 'defaults must be an object of label parameters'}, 400
+
     try:
-        # Map error correction levels
-        error_correction_map = {
-            'L': qrcode.constants.ERROR_CORRECT_L,
-            'M': qrcode.constants.ERROR_CORRECT_M,
-            'Q': qrcode.constants.ERROR_CORRECT_Q,
-            'H': qrcode.constants.ERROR_CORRECT_H
-        }
-        
-        # Create QR code instance with advanced options
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=error_correction_map.get(error_correction, qrcode.constants.ERROR_CORRECT_M),
-            box_size=box_size,
-            border=border,
-        )
-        qr.add_data(text)
-        qr.make(fit=True)
+        layout = parse_sheet_layout(data)
+    except ParameterError as e:
+        metrics.VALIDATION_FAILURES.labels('sheet', e.error).inc()
+        return e.to_dict(), 400
 
-        # Create image with custom colors
-        img = qr.make_image(fill_color=fill_color, back_color=back_color)
-        
-        # Convert to desired format
-        buffer = io.BytesIO()
-        if image_format.upper() == 'JPEG':
-            # Convert to RGB for JPEG (remove alpha channel)
-            img = img.convert('RGB')
-        img.save(buffer, format=image_format.upper())
-        buffer.seek(0)
-        
-        # Log successful generation to database
-        qr_options = {'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border, 'error_correction': error_correction}
-        log_generation_attempt('qrcode', text, None, image_format.upper(), qr_options, success=True)
-        
-        # Return the image file
-        file_ext = image_format.lower()
-        if file_ext == 'jpeg':
-            file_ext = 'jpg'
-        mimetype = f'image/{file_ext}'
-        
-        return send_file(
-            buffer,
-            as_attachment=False,
-            download_name=f'qrcode.{file_ext}',
-            mimetype=mimetype
-        )
-    
+    # Every label is validated before anything is rendered; identical labels share one key
+    labels = []
+    specs = {}
+    for index, item in enumerate(items):
+        spec = dict(defaults, **(item if isinstance(item, dict) else {'text': item}))
+        spec['image_format'] = 'PNG'
+        code_type = spec.get('type', 'barcode')
+        if code_type not in SPEC_PARSERS:
+            return {'error': 'Invalid type', 'message': 'type must be one of: barcode, qrcode', 'item': index}, 400
+        try:
+            params = SPEC_PARSERS[code_type](spec)
+        except ParameterError as e:
+            log_validation_failure(code_type, e)
+            return {**e.to_dict(), 'item': index}, 400
+        key = make_cache_key(code_type, params)
+        specs.setdefault(key, (code_type, params))
+        labels.append(key)
+    color = any(code_type == 'qrcode' and (params['fill_color'], params['back_color']) != ('#000000', '#ffffff')
+                for code_type, params in specs.values())
+
+    def render_label(key):
+        code_type, params = specs[key]
+        try:
+            return key, cached_render(code_type, params, wait=render_engine.timeout)[0], None
+        except Exception as e:
+            return key, None, e
+
+    def render_many(keys):
+        # Each distinct label is rendered once, the first time a page needs it
+        for key, image_data, error in iter_parallel(render_label, keys, BATCH_WORKERS):
+            code_type, params = specs[key]
+            if error is not None:
+                failure = 'Barcode generation failed' if code_type == 'barcode' else 'QR code generation failed'
+                log_batch_item(code_type, params, success=False, error_message=f'{failure}: {error}')
+            else:
+                log_batch_item(code_type, params, success=True)
+            yield key, image_data
+
+    from label_sheet import iter_pages, iter_pdf, page_png, page_count
+    dpi = layout['dpi']
+    pages = iter_pages(layout, labels, render_many, color)
+    if layout['output'] == 'PDF':
+        body, mimetype, filename = iter_pdf(pages, dpi), 'application/pdf', 'labels.pdf'
+    elif page_count(layout, len(labels)) == 1:
+        body, mimetype, filename = (page_png(page, dpi) for page in pages), 'image/png', 'labels.png'
+    else:
+        # One PNG per page, zipped
+        entries = ((f'page-{number:03d}.png', page_png(page, dpi)) for number, page in enumerate(pages, 1))
+        body, mimetype, filename = iter_zip(entries), 'application/zip', 'labels.zip'
+
+    return app.response_class(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/stats')
+def api_stats():
+    """API endpoint for usage over a time range, served from the hourly rollups"""
+    try:
+        params = parse_stats_params(request.args)
+    except ParameterError as e:
+        return e.to_dict(), 400
+    rollup_compactor.start()
+    try:
+        stats = query_stats(db, GenerationRollup, params['start'], params['end'], params['granularity'],
+                            params['group_by'], params['filters'])
     except Exception as e:
-        error_msg = f'QR code generation failed: {str(e)}'
-        qr_options = {'fill_color': fill_color, 'back_color': back_color, 'box_size': box_size, 'border': border, 'error_correction': error_correction}
-        log_generation_attempt('qrcode', text, None, image_format, qr_options, success=False, error_message=error_msg)
+        db.session.rollback()
+        return {'error': 'Stats unavailable', 'message': f'Usage stats could not be read: {e}'}, 503
+    return {
+        'start': params['start'].isoformat() + 'Z',
+        'end': params['end'].isoformat() + 'Z',
+        'granularity': params['granularity'],
+        'group_by': params['group_by'],
+        'filters': params['filters'],
+        **stats
+    }
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    """API endpoint for queueing a bulk job from an uploaded CSV or NDJSON file"""
+    upload = request.files.get('file')
+    filename = upload.filename if upload else None
+    mimetype = upload.mimetype if upload else request.mimetype
+    source_format = detect_format(request.values.get('format'), filename, mimetype)
+    if source_format not in JOB_FORMATS:
         return {
-            'error': 'QR code generation failed',
-            'message': f'Error generating QR code in {image_format} format: {str(e)}',
-            'parameters': {
-                'text': text,
-                'error_correction': error_correction,
-                'image_format': image_format,
-                'fill_color': fill_color,
-                'back_color': back_color,
-                'box_size': box_size,
-                'border': border
-            }
-        }, 500
+            'error': 'Invalid format',
+            'message': f'format must be one of: {", ".join(JOB_FORMATS)} (or use a .csv/.ndjson file name)',
+            'provided': source_format
+        }, 400
+
+    job_id = uuid.uuid4().hex
+    path = upload_path(JOBS_DIR, job_id, source_format)
+    os.makedirs(job_dir(JOBS_DIR, job_id))
+    try:
+        if upload:
+            upload.save(path)
+        else:
+            with open(path, 'wb') as target:
+                shutil.copyfileobj(request.stream, target)
+        total_items = count_specs(path, source_format)
+        if not total_items:
+            raise ParameterError('Empty upload', 'The upload must contain at least one barcode or QR code spec')
+        if total_items > JOBS_MAX_ITEMS:
+            raise ParameterError('Job too large', f'A job may contain at most {JOBS_MAX_ITEMS} items', total_items)
+    except ParameterError as e:
+        shutil.rmtree(job_dir(JOBS_DIR, job_id), ignore_errors=True)
+        return e.to_dict(), 400
+
+    job = BulkJob(id=job_id, source_format=source_format, total_items=total_items,
+                  chunk_size=JOBS_CHUNK_SIZE, ip_address=get_real_ip())
+    db.session.add(job)
+    db.session.commit()
+    return job_status(job), 202, {'Location': url_for('api_job_status', job_id=job_id)}
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """API endpoint for the status, progress and finished chunks of a bulk job"""
+    job = db.session.get(BulkJob, job_id)
+    if job is None:
+        return {'error': 'Job not found', 'message': f'No bulk job with id {job_id}'}, 404
+    return job_status(job)
+
+@app.route('/api/jobs/<job_id>/chunks/<int:chunk_index>')
+def api_job_chunk(job_id, chunk_index):
+    """API endpoint for downloading a finished chunk archive; supports Range requests for resuming"""
+    job = db.session.get(BulkJob, job_id)
+    if job is None or chunk_index >= finished_chunks(job):
+        return {'error': 'Chunk not found', 'message': f'Chunk {chunk_index} of job {job_id} is not available'}, 404
+    return send_file(
+        chunk_path(JOBS_DIR, job_id, chunk_index),
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=f'{job_id}-{chunk_index:05d}.zip',
+        conditional=True
+    )
+
+def finished_chunks(job):
+    """Number of chunk archives of a job that are complete on disk"""
+    if job.completed_items >= job.total_items:
+        return -(-job.total_items // job.chunk_size)
+    return job.completed_items // job.chunk_size
+
+def job_status(job):
+    """JSON body describing a bulk job"""
+    chunks = []
+    for index in range(finished_chunks(job)):
+        first = index * job.chunk_size
+        chunks.append({
+            'index': index,
+            'first_item': first,
+            'items': min(job.chunk_size, job.total_items - first),
+            'url': url_for('api_job_chunk', job_id=job.id, chunk_index=index)
+        })
+    return {
+        'id': job.id,
+        'status': job.status,
+        'format': job.source_format,
+        'total_items': job.total_items,
+        'completed_items': job.completed_items,
+        'failed_items': job.failed_items,
+        'progress': round(job.completed_items / job.total_items, 4) if job.total_items else 0.0,
+        'items_per_second': round(job.completed_items / job.processing_seconds, 1) if job.processing_seconds else 0.0,
+        'chunk_size': job.chunk_size,
+        'chunks': chunks,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'error_message': job.error_message
+    }
+
+# Cold start timings of this process, in seconds since its first import
+startup_report = {
+    'pid': os.getpid(),
+    'import_seconds': round(time.perf_counter() - STARTUP_BEGAN, 4),
+    'worker_ready_seconds': None,  # Set by gunicorn's post_worker_init once the worker is warm
+    'warmup_seconds': None,
+    'prefilled_values': 0
+}
+print(f"⏱️  App imported in {startup_report['import_seconds'] * 1000:.0f} ms")
+
+def mark_worker_ready():
+    """Record the time until this worker could accept requests"""
+    startup_report['worker_ready_seconds'] = round(time.perf_counter() - STARTUP_BEGAN, 4)
+    print(f"⏱️  Worker {os.getpid()} ready in {startup_report['worker_ready_seconds'] * 1000:.0f} ms")
+
+_warmup_lock = threading.Lock()
+
+def warm_up():
+    """Prepare this worker for traffic: rendering stack, render processes and hot values.
+
+    Runs once per process, from gunicorn's post_worker_init or App Engine's
+    /_ah/warmup request, whichever comes first.
+    """
+    with _warmup_lock:
+        if startup_report['warmup_seconds'] is not None:
+            return
+        started = time.perf_counter()
+        rollup_compactor.start()
+        import rendering
+        # With a pool the samples are rendered there; this process still decodes and composes images
+        rendering.warm_up(samples=not render_engine.enabled)
+        render_engine.start()
+        startup_report['prefilled_values'] = prefill_hot_values()
+        startup_report['warmup_seconds'] = round(time.perf_counter() - started, 4)
+        print(f"🔥 Worker {os.getpid()} warmed up in {startup_report['warmup_seconds'] * 1000:.0f} ms "
+              f"({startup_report['prefilled_values']} hot values cached)")
+
+def prefill_hot_values():
+    """Render the most requested recent values into the render cache"""
+    if WARMUP_HOT_VALUES <= 0:
+        return 0
+    since = datetime.utcnow() - timedelta(hours=WARMUP_HOT_WINDOW_HOURS)
+    qr_options = db.cast(GenerationRecord.qr_options, db.Text)
+    columns = (GenerationRecord.code_type, GenerationRecord.barcode_symbology, GenerationRecord.code_value,
+               GenerationRecord.image_format, qr_options)
+    try:
+        with app.app_context():
+            rows = db.session.query(*columns).filter(
+                GenerationRecord.success.is_(True),
+                GenerationRecord.created_at >= since
+            ).group_by(*columns).order_by(db.func.count().desc()).limit(WARMUP_HOT_VALUES).all()
+    except Exception as e:
+        print(f"❌ Hot value lookup failed: {e}")
+        return 0
+
+    prefilled = 0
+    for code_type, barcode_symbology, code_value, image_format, options in rows:
+        spec = {'text': code_value, 'image_format': image_format}
+        if code_type == 'barcode':
+            spec['barcode_type'] = barcode_symbology
+        elif options:
+            spec.update(json.loads(options))
+        try:
+            cached_render(code_type, SPEC_PARSERS[code_type](spec))
+        except Exception:
+            continue
+        prefilled += 1
+    return prefilled
 
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""Streaming archive helpers for multi-item responses"""
+
+import io
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable sink that collects bytes until drained.
+
+    Because it cannot seek, zipfile writes data descriptors after each member
+    instead of patching local headers, which is what makes streaming possible.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def iter_zip(entries):
+    """Yield a ZIP archive chunk by chunk from an iterable of (name, bytes) pairs.
+
+    Only the current member is held in memory. Image members are stored as-is
+    since PNG/JPEG/WEBP are already compressed; everything else is deflated.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w') as archive:
+        for name, data in entries:
+            compress_type = zipfile.ZIP_DEFLATED if name.endswith(('.json', '.txt', '.svg')) else zipfile.ZIP_STORED
+            archive.writestr(name, data, compress_type=compress_type)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+def iter_parallel(func, items, workers):
+    """Yield func(item) for every item in completion order.
+
+    At most ``2 * workers`` calls are in flight, so finished results are handed
+    to the consumer instead of accumulating in memory.
+    """
+    items = iter(items)
+    window = max(1, workers) * 2
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= window:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                for item in items:
+                    pending.add(executor.submit(func, item))
+                    break
@@ -0,0 +1,290 @@
+"""ASGI serving mode: the Flask app driven from an event loop.
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+The single-image endpoints (``POST /api/barcode``, ``POST /api/qrcode``,
+their GET URL variants and ``POST /api/qrcode/matrix``) are served from the
+event loop. The request is parsed and its image looked up in the render cache
+there. Requests answered without rendering (cache hits, validation errors,
+304s and redirects) run their Flask view on the loop, a cache hit being handed
+to the view so it cannot render; a cache miss runs its view in a bounded
+thread pool, which hands the render to the worker's render processes. The
+body is then streamed as fast as the client reads it. An idle or slowly
+downloading connection holds a coroutine rather than a thread, so a worker can
+keep thousands of them. Responses, logging and metrics are the views' own,
+exactly as under the sync workers.
+
+Every other route runs in a thread pool through a plain WSGI bridge.
+"""
+
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from tempfile import SpooledTemporaryFile
+
+# Waiting requests cost nothing here and rendering is bounded by RENDER_SLOTS,
+# so the concurrency gate is off unless the deployment sets it (gunicorn.conf.py
+# only sets a default for threaded workers)
+os.environ.setdefault('MAX_IN_FLIGHT', '0')
+
+from flask import request  # noqa: E402
+from werkzeug.exceptions import HTTPException  # noqa: E402
+from werkzeug.middleware.proxy_fix import ProxyFix  # noqa: E402
+from admission import rate_limiter, request_gate  # noqa: E402
+from app import (app, prerendered, preadmitted, check_admission, request_cost, startup_report, warm_up,  # noqa: E402
+                 mark_worker_ready, generation_log, rollup_compactor, canonical_url, is_canonical_request,
+                 TRUSTED_PROXY_HOPS)
+from render_cache import render_cache, make_cache_key  # noqa: E402
+from render_engine import render_engine, RenderQueueFull  # noqa: E402
+from validation import (parse_barcode_params, parse_qr_params, parse_qr_matrix_params, barcode_url_data,  # noqa: E402
+                        qr_url_data)
+
+# Renders running or waiting in the thread pool; a render that finds them all
+# taken for longer than RENDER_QUEUE_WAIT is answered with 503
+RENDER_SLOTS = int(os.environ.get('ASGI_RENDER_SLOTS', render_engine.pool_size + render_engine.max_pending
+                                  if render_engine.enabled else os.cpu_count() or 1))
+# Threads serving the routes that are not handled on the event loop
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 8))
+# Request bodies larger than this are spooled to a temporary file
+SPOOL_BYTES = 1024 * 1024
+
+print(f"⚙️  ASGI mode: MAX_IN_FLIGHT={request_gate.limit or 'off'}, {RENDER_SLOTS} render slots")
+
+def _request_data():
+    if request.is_json:
+        return request.get_json()
+    return request.form.to_dict()
+
+# Endpoints served from the event loop: their code type and how the view parses their render parameters
+LOOP_ENDPOINTS = {
+    'api_generate_barcode': ('barcode', lambda: parse_barcode_params(_request_data(), request.accept_mimetypes)),
+    'api_generate_qr': ('qrcode', lambda: parse_qr_params(_request_data(), request.accept_mimetypes)),
+    'api_barcode_url': ('barcode', lambda: parse_barcode_params(barcode_url_data(
+        request.view_args['symbology'], request.view_args['filename'], request.args))),
+    'api_qrcode_url': ('qrcode', lambda: parse_qr_params(qr_url_data(
+        request.view_args['error_correction'], request.view_args['filename'], request.args))),
+    'api_qrcode_matrix': ('qrmatrix', lambda: parse_qr_matrix_params(_request_data(), request.accept_mimetypes)[0])
+}
+# ETags of these are derived from the parameters, so If-None-Match is answered without an image
+PARAMETER_ETAG_ENDPOINTS = {'api_generate_barcode', 'api_generate_qr'}
+# GET URLs, which redirect to their canonical spelling without an image
+URL_ENDPOINTS = {'api_barcode_url', 'api_qrcode_url'}
+
+_render_executor = ThreadPoolExecutor(max_workers=max(1, RENDER_SLOTS), thread_name_prefix='asgi-render')
+_wsgi_executor = ThreadPoolExecutor(max_workers=max(1, WSGI_THREADS), thread_name_prefix='asgi-wsgi')
+# Rate limit file locks and concurrency slot waits block, so they are taken here rather than on the loop
+_admission_executor = ThreadPoolExecutor(max_workers=max(1, WSGI_THREADS), thread_name_prefix='asgi-admission')
+_render_slots = None
+# Requests served on the loop bypass app.wsgi_app, so its ProxyFix is applied to their environ here
+_proxy_fix = ProxyFix(lambda environ, start_response: environ, x_for=TRUSTED_PROXY_HOPS)
+
+def build_environ(scope, body):
+    """WSGI environ of an ASGI HTTP request whose body has been read into ``body``"""
+    script_name = scope.get('root_path', '').encode('utf-8').decode('latin-1')
+    path_info = scope['path'].encode('utf-8').decode('latin-1')
+    if script_name and path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+def _start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    }
+
+async def _read_body(receive, body):
+    """Read the request body into ``body``; False when the client went away first"""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return False
+        body.write(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    body.seek(0)
+    return True
+
+def _needs_render():
+    """Whether the request's view would render an image.
+
+    Parameters are parsed as the view parses them. When the image is in the
+    render cache it is handed to the view through ``prerendered``, so an
+    eviction before the view runs cannot make it render.
+    """
+    code_type, parse = LOOP_ENDPOINTS[request.endpoint]
+    try:
+        params = parse()
+    except Exception:
+        # The view reports it
+        return False
+    cache_key = make_cache_key(code_type, params)
+    data = render_cache.get(cache_key)
+    if data is not None:
+        prerendered.set((cache_key, data, None))
+        return False
+    if request.endpoint in PARAMETER_ETAG_ENDPOINTS and request.if_none_match.contains(cache_key):
+        return False
+    if request.endpoint in URL_ENDPOINTS and not is_canonical_request(*canonical_url(code_type, params)):
+        return False
+    return cache_key
+
+async def _admit():
+    """Run the request's admission checks in a thread, for admit_request to act on"""
+    cost = request_cost(request.endpoint)
+    if cost is not None and (rate_limiter.enabled or request_gate.enabled):
+        preadmitted.set(await asyncio.get_running_loop().run_in_executor(
+            _admission_executor, copy_context().run, check_admission, cost))
+
+async def _dispatch():
+    """Run the request's view on the event loop, or in the render thread pool when it renders"""
+    global _render_slots
+    await _admit()
+    cache_key = _needs_render()
+    if not cache_key:
+        return app.full_dispatch_request()
+
+    if _render_slots is None:
+        _render_slots = asyncio.Semaphore(max(1, RENDER_SLOTS))
+    try:
+        await asyncio.wait_for(_render_slots.acquire(), render_engine.queue_wait)
+    except asyncio.TimeoutError:
+        # The view answers with 503 instead of rendering
+        prerendered.set((cache_key, None, RenderQueueFull('Render queue is full')))
+        return app.full_dispatch_request()
+    try:
+        # The copied context carries the request context and its stage timings to the thread
+        return await asyncio.get_running_loop().run_in_executor(
+            _render_executor, copy_context().run, app.full_dispatch_request)
+    finally:
+        _render_slots.release()
+
+async def _serve_on_loop(environ, send):
+    if TRUSTED_PROXY_HOPS:
+        environ = _proxy_fix(environ, None)
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            response = await _dispatch()
+        except Exception as e:
+            error = e
+            response = app.handle_exception(e)
+        app_iter, status, headers = response.get_wsgi_response(environ)
+    finally:
+        if error is not None and app.should_ignore_error(error):
+            error = None
+        prerendered.set(None)
+        preadmitted.set(None)
+        ctx.pop(error)
+
+    await send(_start_message(status, headers))
+    try:
+        # Each send waits until the transport has room, so slow clients are
+        # paced by the event loop instead of occupying a thread
+        for chunk in app_iter:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    await send({'type': 'http.response.body'})
+
+async def _serve_in_thread(environ, send):
+    loop = asyncio.get_running_loop()
+
+    def run():
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [_start_message(status, headers)]
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        app_iter = app(environ, start_response)
+        try:
+            sent_start = False
+            for chunk in app_iter:
+                if not sent_start:
+                    send_from_thread(started[0])
+                    sent_start = True
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not sent_start:
+                send_from_thread(started[0])
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        send_from_thread({'type': 'http.response.body'})
+
+    await loop.run_in_executor(_wsgi_executor, copy_context().run, run)
+
+def _shut_down():
+    rollup_compactor.stop()
+    generation_log.close()
+    render_engine.shutdown()
+
+async def _lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Under gunicorn, post_worker_init has already done this
+            await loop.run_in_executor(None, warm_up)
+            if startup_report['worker_ready_seconds'] is None:
+                mark_worker_ready()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await loop.run_in_executor(None, _shut_down)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    with SpooledTemporaryFile(max_size=SPOOL_BYTES) as body:
+        if not await _read_body(receive, body):
+            return
+        environ = build_environ(scope, body)
+        try:
+            endpoint, _ = app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        if endpoint in LOOP_ENDPOINTS:
+            await _serve_on_loop(environ, send)
+        else:
+            await _serve_in_thread(environ, send)
@@ -0,0 +1,10 @@
+"""Benchmarks for the render path and generation logging.
+
+Run from the repository root (see "Benchmarks" in the README):
+
+    python -m benchmarks --save      # record benchmarks/baseline.json
+    python -m benchmarks             # compare with it; exits 1 on a regression
+    python -m benchmarks --suite qrcode --filter box_size
+
+Suites are defined in ``benchmarks.cases`` and timed by ``benchmarks.measure``.
+"""
@@ -0,0 +1,118 @@
+"""Run the benchmark suites and compare the results with a saved baseline.
+
+Images are rendered in-process (no render pool) with every cache emptied
+before each timed call, and API requests log to a throwaway SQLite database.
+A case regresses when its median latency or its output size grows by more
+than ``--threshold`` over the baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+# Set before the app is imported by the suites
+os.environ['RENDER_POOL_SIZE'] = '0'
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='barcodes-bench-'), 'records.db')
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+# Every API case comes from the same client, as fast as it can
+os.environ['RATE_LIMIT_RATE'] = '0'
+
+from benchmarks.cases import SUITES  # noqa: E402
+from benchmarks.measure import run_case, peak_rss_kb  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def environment():
+    """Where the numbers were taken; baselines only compare well on the same machine"""
+    return {
+        'python': platform.python_version(),
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+def compare(results, baseline, threshold):
+    """Return a description of every case that got slower or larger than the threshold allows"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            change = result['p50_ms'] / before['p50_ms'] - 1
+            regressions.append(f"{name}: p50 {before['p50_ms']:.3f} ms -> {result['p50_ms']:.3f} ms (+{change:.0%})")
+        if result['bytes'] > before['bytes'] * (1 + threshold):
+            regressions.append(f"{name}: output {before['bytes']} -> {result['bytes']} bytes")
+    return regressions
+
+def profile_savings(results):
+    """Output size and median time of the encoding profiles relative to 'default', per symbol and format"""
+    lines = []
+    for name, result in results.items():
+        prefix, _, profile = name.rpartition('/')
+        base = results.get(f'{prefix}/default')
+        if not name.startswith('profile/') or profile == 'default' or not base or not base['bytes']:
+            continue
+        lines.append(f"{prefix[len('profile/'):]:<36} {profile:<6} {result['bytes'] / base['bytes'] - 1:>+6.0%} bytes  "
+                     f"{result['p50_ms'] / base['p50_ms']:>5.2f}x time")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.splitlines()[0])
+    parser.add_argument('--suite', action='append', choices=list(SUITES),
+                        help='suite to run, may be repeated (default: all)')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--iterations', type=int, default=30, help='timed calls per case (default: 30)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='write the results to the baseline file')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='allowed growth of median latency and output size (default: 0.15 = 15%%)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for suite in args.suite or list(SUITES):
+        for name, func, reset in SUITES[suite]():
+            if args.filter not in name:
+                continue
+            result = results[name] = run_case(func, args.iterations, reset)
+            print(f"{name:<40} {result['ops_per_sec']:>9.1f} ops/s  p50 {result['p50_ms']:>8.3f} ms  "
+                  f"p99 {result['p99_ms']:>8.3f} ms  {result['bytes']:>8} B")
+    print(f"⏱️  {len(results)} cases, peak RSS {peak_rss_kb() / 1024:.1f} MiB")
+    savings = profile_savings(results)
+    if savings:
+        print("📦 Encoding profiles against 'default':")
+        for line in savings:
+            print(f"   {line}")
+
+    report = {'environment': environment(), 'iterations': args.iterations, 'cases': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.save:
+        with open(args.baseline, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print(f"✅ Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save to record one")
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('environment') != report['environment']:
+        print("⚠️  The baseline was recorded on a different machine or Python version")
+
+    regressions = compare(results, baseline['cases'], args.threshold)
+    for regression in regressions:
+        print(f"❌ {regression}")
+    if regressions:
+        return 1
+    print(f"✅ No regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
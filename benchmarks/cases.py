@@ -0,0 +1,235 @@
+"""Benchmark cases, grouped into suites.
+
+A suite is a function yielding ``(name, func, reset)``: ``func()`` does one
+unit of work and returns the number of output bytes, ``reset`` (or None) runs
+untimed before every call. The app and the rendering stack are imported
+inside the suites, after ``python -m benchmarks`` has set up the environment.
+"""
+
+import os
+import tempfile
+from datetime import datetime
+from validation import (VALID_BARCODE_TYPES, VALID_BARCODE_RENDERERS, VALID_ERROR_CORRECTIONS, QR_BOX_SIZE_RANGE,
+                        QR_BORDER_RANGE, VALID_ENCODING_PROFILES)
+
+RASTER_FORMATS = ['PNG', 'JPEG', 'WEBP']
+QR_TEXT = 'https://barcodes.dev/?utm_source=benchmark&utm_medium=qr'
+DB_BATCH_SIZES = [1, 50, 500]
+
+# Geometry of a small thermal printer label: 203 dpi, 0.254 mm (2 dot) modules, no text
+LABEL_GEOMETRY = {'module_width': 0.254, 'module_height': 8, 'quiet_zone': 1, 'dpi': 203, 'write_text': False}
+
+# Accept header of an <img> request from a current browser
+BROWSER_IMAGE_ACCEPT = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+
+# Marks the rows written by the logging benchmark so they can be removed again
+BENCHMARK_IP = 'benchmark'
+
+def qr_box_sizes():
+    low, high = QR_BOX_SIZE_RANGE
+    return sorted(size for size in {low, 2, 5, 10, 20, 35, high} if low <= size <= high)
+
+def qr_borders():
+    low, high = QR_BORDER_RANGE
+    return sorted(border for border in {low, 1, 4, 10, high} if low <= border <= high)
+
+def qr_params(**overrides):
+    """Render parameters of the reference QR code, as parse_qr_params returns them"""
+    params = {'text': QR_TEXT, 'error_correction': 'M', 'image_format': 'PNG', 'fill_color': '#000000',
+              'back_color': '#ffffff', 'box_size': 10, 'border': 4}
+    params.update(overrides)
+    return params
+
+def cold_caches():
+    """Drop cached images and symbols so every call renders from scratch"""
+    import rendering
+    from render_cache import render_cache
+    render_cache.clear()
+    rendering.symbol_cache.clear()
+
+def _render(func, **params):
+    return lambda: len(func(**params))
+
+def barcode_cases():
+    """render_barcode for every symbology, raster format and renderer, and at label geometry"""
+    import rendering
+    for barcode_type in VALID_BARCODE_TYPES:
+        text = rendering.WARMUP_SAMPLES[barcode_type]
+        for image_format in RASTER_FORMATS:
+            for renderer in VALID_BARCODE_RENDERERS:
+                func = _render(rendering.render_barcode, text=text, barcode_type=barcode_type,
+                               image_format=image_format, renderer=renderer)
+                yield f'barcode/{barcode_type}/{image_format}/{renderer}', func, cold_caches
+    for barcode_type in ('code128', 'ean13'):
+        for renderer in VALID_BARCODE_RENDERERS:
+            func = _render(rendering.render_barcode, text=rendering.WARMUP_SAMPLES[barcode_type],
+                           barcode_type=barcode_type, image_format='PNG', renderer=renderer, **LABEL_GEOMETRY)
+            yield f'barcode/{barcode_type}/label/{renderer}', func, cold_caches
+
+def qrcode_cases():
+    """render_qr for every error correction level and raster format, and box_size and border sweeps"""
+    import rendering
+    for error_correction in VALID_ERROR_CORRECTIONS:
+        for image_format in RASTER_FORMATS:
+            func = _render(rendering.render_qr, **qr_params(error_correction=error_correction, image_format=image_format))
+            yield f'qrcode/ecc={error_correction}/{image_format}', func, cold_caches
+    for box_size in qr_box_sizes():
+        yield f'qrcode/box_size={box_size}', _render(rendering.render_qr, **qr_params(box_size=box_size)), cold_caches
+    for border in qr_borders():
+        yield f'qrcode/border={border}', _render(rendering.render_qr, **qr_params(border=border)), cold_caches
+
+def profile_cases():
+    """Every raster format in every encoding profile, for a few typical symbols.
+
+    Symbols stay cached, so the time is drawing and image encoding.
+    """
+    import rendering
+    subjects = {
+        'code128/writer': (rendering.render_barcode, {'text': rendering.WARMUP_SAMPLES['code128'],
+                                                      'barcode_type': 'code128', 'renderer': 'writer'}),
+        'code128/fast': (rendering.render_barcode, {'text': rendering.WARMUP_SAMPLES['code128'],
+                                                    'barcode_type': 'code128', 'renderer': 'fast'}),
+        'ean13/writer': (rendering.render_barcode, {'text': rendering.WARMUP_SAMPLES['ean13'],
+                                                    'barcode_type': 'ean13', 'renderer': 'writer'}),
+        'qrcode/ecc=M': (rendering.render_qr, qr_params()),
+        'qrcode/ecc=H/box_size=20': (rendering.render_qr, qr_params(error_correction='H', box_size=20))
+    }
+    for subject, (func, params) in subjects.items():
+        for image_format in RASTER_FORMATS:
+            for profile in VALID_ENCODING_PROFILES:
+                func_params = dict(params, image_format=image_format, profile=profile)
+                yield f'profile/{subject}/{image_format}/{profile}', _render(func, **func_params), None
+
+def api_cases():
+    """The JSON API through the Flask test client: parsing, rendering, logging and the response"""
+    import rendering
+    from app import app, init_db
+    with app.app_context():
+        init_db()
+    client = app.test_client()
+
+    def post(path, payload, headers=None):
+        def call():
+            response = client.post(path, json=payload, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f'{path} returned {response.status_code}: {response.get_data(as_text=True)}')
+            return len(response.data)
+        return call
+
+    for barcode_type in VALID_BARCODE_TYPES:
+        for image_format in RASTER_FORMATS:
+            payload = {'text': rendering.WARMUP_SAMPLES[barcode_type], 'barcode_type': barcode_type,
+                       'image_format': image_format}
+            yield f'api/barcode/{barcode_type}/{image_format}', post('/api/barcode', payload), cold_caches
+    for error_correction in VALID_ERROR_CORRECTIONS:
+        for image_format in RASTER_FORMATS:
+            payload = {'text': QR_TEXT, 'error_correction': error_correction, 'image_format': image_format}
+            yield f'api/qrcode/ecc={error_correction}/{image_format}', post('/api/qrcode', payload), cold_caches
+    for box_size in qr_box_sizes():
+        yield f'api/qrcode/box_size={box_size}', post('/api/qrcode', {'text': QR_TEXT, 'box_size': box_size}), cold_caches
+    for border in qr_borders():
+        yield f'api/qrcode/border={border}', post('/api/qrcode', {'text': QR_TEXT, 'border': border}), cold_caches
+    # image_format=auto as a browser asks for it
+    browser = {'Accept': BROWSER_IMAGE_ACCEPT}
+    payload = {'text': rendering.WARMUP_SAMPLES['code128'], 'image_format': 'auto'}
+    yield 'api/barcode/code128/auto', post('/api/barcode', payload, browser), cold_caches
+    yield 'api/qrcode/auto', post('/api/qrcode', {'text': QR_TEXT, 'image_format': 'auto'}, browser), cold_caches
+
+def db_targets():
+    """(backend, database URL) pairs the logging benchmark writes to"""
+    directory = tempfile.mkdtemp(prefix='barcodes-bench-')
+    yield 'sqlite', 'sqlite:///' + os.path.join(directory, 'generation_records.db')
+    yield 'postgres', os.environ.get('BENCH_POSTGRES_URL', 'postgresql://postgres@localhost:5432/barcodes_bench')
+
+# Headers of a typical browser request, which is what most logged rows carry
+BENCHMARK_USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                        'Chrome/124.0.0.0 Safari/537.36')
+BENCHMARK_HEADERS = {
+    'Host': 'barcodes.dev',
+    'User-Agent': BENCHMARK_USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Origin': 'https://barcodes.dev',
+    'Referer': 'https://barcodes.dev/',
+    'X-Forwarded-For': '203.0.113.7',
+    'X-Forwarded-Proto': 'https',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin'
+}
+
+def benchmark_record(index):
+    """A generation_records row shaped like the ones log_generation_attempt queues"""
+    return {
+        'ip_address': BENCHMARK_IP,
+        'code_type': 'qrcode' if index % 2 else 'barcode',
+        'barcode_symbology': None if index % 2 else 'code128',
+        'code_value': f'BENCH-{index:06d}',
+        'image_format': 'PNG',
+        'qr_options': {'error_correction': 'M', 'box_size': 10, 'border': 4} if index % 2 else None,
+        'created_at': datetime.utcnow(),
+        'user_agent': BENCHMARK_USER_AGENT,
+        'debug_headers': str(BENCHMARK_HEADERS) + ' | remote_addr: 127.0.0.1',
+        'success': True,
+        'error_message': None
+    }
+
+def db_cases():
+    """Multi-row INSERTs of generation records, as the write-behind logger issues them, per backend.
+
+    The ``lookups`` cases first replace user agents and headers by lookup ids,
+    as the app does; the plain ones insert them inline.
+    """
+    from types import SimpleNamespace
+    from sqlalchemy import create_engine
+    from app import GenerationRecord, UserAgent, HeaderSet, engine_options
+    from storage_policy import LookupResolver, value_hash
+    table = GenerationRecord.__table__
+    lookup_tables = {'user_agent': (UserAgent.__table__, 'user_agent_id'),
+                     'debug_headers': (HeaderSet.__table__, 'headers_id')}
+    for backend, url in db_targets():
+        engine = create_engine(url, **engine_options(url))
+        try:
+            for created in [table] + [lookup_table for lookup_table, _ in lookup_tables.values()]:
+                created.create(engine, checkfirst=True)
+        except Exception as e:
+            print(f"⚠️  Skipping the {backend} logging benchmark, database unavailable: {e}")
+            engine.dispose()
+            continue
+
+        resolver = LookupResolver(SimpleNamespace(engine=engine), lookup_tables)
+
+        def insert(batch, prepare=None):
+            def call():
+                rows = prepare(batch) if prepare is not None else batch
+                with engine.begin() as connection:
+                    connection.execute(table.insert(), rows)
+                return 0
+            return call
+
+        def clear():
+            # Every call inserts into a table of the same size, so cases compare fairly
+            with engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.ip_address == BENCHMARK_IP))
+
+        for batch_size in DB_BATCH_SIZES:
+            batch = [benchmark_record(index) for index in range(batch_size)]
+            yield f'db/{backend}/batch={batch_size}', insert(batch), clear
+            yield f'db/{backend}/lookups/batch={batch_size}', insert(batch, resolver), clear
+
+        # Runs once the last case of this backend has been timed
+        clear()
+        record = benchmark_record(0)
+        with engine.begin() as connection:
+            for field, (lookup_table, _) in lookup_tables.items():
+                connection.execute(lookup_table.delete().where(lookup_table.c.value_hash == value_hash(record[field])))
+        engine.dispose()
+
+SUITES = {
+    'barcode': barcode_cases,
+    'qrcode': qrcode_cases,
+    'profiles': profile_cases,
+    'api': api_cases,
+    'db': db_cases
+}
@@ -0,0 +1,47 @@
+"""Timing, latency percentiles and memory use of one benchmark case"""
+
+import math
+import resource
+import sys
+import time
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, in KiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def run_case(func, iterations, reset=None, warmup=1):
+    """Time ``iterations`` calls of func(), which returns the number of output bytes.
+
+    ``reset`` runs before every call, outside the timed section, e.g. to empty
+    caches so each call does the full work.
+    """
+    for _ in range(warmup):
+        if reset is not None:
+            reset()
+        func()
+
+    durations = []
+    output_bytes = 0
+    for _ in range(iterations):
+        if reset is not None:
+            reset()
+        started = time.perf_counter()
+        output_bytes = func()
+        durations.append(time.perf_counter() - started)
+
+    durations.sort()
+    total = sum(durations)
+    return {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / total, 1) if total else 0.0,
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        'bytes': output_bytes,
+        'peak_rss_kb': peak_rss_kb()  # Of the whole run so far: RSS peaks cannot be reset per case
+    }
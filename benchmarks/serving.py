@@ -0,0 +1,276 @@
+"""Compare the sync and ASGI deployments under load at equal core counts.
+
+    python -m benchmarks.serving [--workers 2] [--pool 1] [--cpus 0-3] [--slow 200]
+
+Each deployment is started with gunicorn on a local port with the same number
+of workers and render processes per worker, pinned to the same CPUs:
+
+- ``sync``: ``gunicorn app:app``, threaded workers as configured by gunicorn.conf.py
+- ``asgi``: ``gunicorn -k uvicorn.workers.UvicornWorker asgi:application``
+
+While ``--clients`` keep-alive clients request barcodes as fast as they can,
+``--slow`` clients behave like phones on a poor connection: half of them
+upload a QR code request a few bytes at a time, the other half download
+large QR code JPEGs a kilobyte at a time. The report gives the fast clients'
+throughput and latency, the slow requests completed and the servers' memory.
+Rate limiting is turned off, since every client connects from 127.0.0.1.
+
+Downloads are usually absorbed by the kernel's socket send buffers (several
+megabytes on Linux), so a sync worker thread is held mostly while a request
+is still arriving.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from benchmarks.measure import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEPLOYMENTS = {
+    'sync': ['-m', 'gunicorn', 'app:app'],
+    'asgi': ['-m', 'gunicorn', '-k', 'uvicorn.workers.UvicornWorker', 'asgi:application']
+}
+
+# Distinct values cycled by the fast clients; all but the first round are render cache hits
+FAST_VALUES = 500
+# A QR code of about 500 kB as JPEG
+SLOW_PATH = '/api/qrcode/H/' + 'QkVOQ0hNQVJL' * 20 + '.jpg?box_size=50'
+SLOW_READ_BYTES = 1024
+SLOW_READ_INTERVAL = 0.05
+# A JSON request body of about 2 kB, sent in small pieces
+SLOW_UPLOAD_BODY = ('{"text": "' + 'BENCHMARK ' * 200 + '", "error_correction": "L"}').encode('ascii')
+SLOW_UPLOAD_BYTES = 64
+SLOW_UPLOAD_INTERVAL = 0.05
+
+def parse_cpus(text):
+    """CPU numbers of a list like '0-3,6'"""
+    cpus = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def tree_rss_kb(pid):
+    """Resident memory of a process and all of its descendants, in KiB (Linux only)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def start_server(deployment, args, port, database_url):
+    env = dict(os.environ, PORT=str(port), DATABASE_URL=database_url, RATE_LIMIT_RATE='0',
+               WEB_CONCURRENCY=str(args.workers), RENDER_POOL_SIZE=str(args.pool))
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    env.pop('RATE_LIMIT_DIR', None)
+    cpus = parse_cpus(args.cpus) if args.cpus else None
+    server = subprocess.Popen([sys.executable] + DEPLOYMENTS[deployment], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/startup-status', timeout=1).read()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.25)
+    server.kill()
+    raise RuntimeError(f'The {deployment} server did not start')
+
+async def read_response(reader, slow=False):
+    """Read one HTTP/1.1 response; returns (status, body bytes), status 0 when the server closed the connection"""
+    status_line = await reader.readline()
+    if not status_line:
+        return 0, 0
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    received = 0
+    while received < length:
+        chunk = await reader.read(min(SLOW_READ_BYTES if slow else 65536, length - received))
+        if not chunk:
+            return 0, received
+        received += len(chunk)
+        if slow:
+            await asyncio.sleep(SLOW_READ_INTERVAL)
+    return status, received
+
+async def connect(port, receive_buffer=None):
+    sock = socket.socket()
+    if receive_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return await asyncio.open_connection(sock=sock, limit=receive_buffer or 2 ** 16)
+
+async def fast_client(port, number, stop, measure_from, results):
+    reader = writer = None
+    request_number = number
+    while not stop.is_set():
+        if writer is None:
+            reader, writer = await connect(port)
+        path = f'/api/barcode/code128/BENCH-{request_number % FAST_VALUES:05d}.png'
+        request_number += 7
+        started = time.perf_counter()
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode('ascii'))
+        try:
+            await writer.drain()
+            status, _ = await read_response(reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            status = 0
+        if status == 0:
+            writer.close()
+            writer = None
+            continue
+        if started >= measure_from[0]:
+            results['latencies'].append(time.perf_counter() - started)
+            results['statuses'][status] = results['statuses'].get(status, 0) + 1
+    if writer is not None:
+        writer.close()
+
+async def send_slowly(writer, data):
+    for start in range(0, len(data), SLOW_UPLOAD_BYTES):
+        writer.write(data[start:start + SLOW_UPLOAD_BYTES])
+        await writer.drain()
+        await asyncio.sleep(SLOW_UPLOAD_INTERVAL)
+
+async def slow_request(port, upload):
+    if upload:
+        reader, writer = await connect(port)
+        writer.write(f'POST /api/qrcode HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(SLOW_UPLOAD_BODY)}\r\nConnection: close\r\n\r\n'.encode('ascii'))
+        await send_slowly(writer, SLOW_UPLOAD_BODY)
+    else:
+        reader, writer = await connect(port, receive_buffer=4096)
+        writer.write(f'GET {SLOW_PATH} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode('ascii'))
+        await writer.drain()
+    try:
+        status, _ = await read_response(reader, slow=not upload)
+        return status
+    finally:
+        writer.close()
+
+async def slow_client(port, upload, stop, results):
+    key = 'slow_uploads' if upload else 'slow_downloads'
+    while not stop.is_set():
+        request = asyncio.ensure_future(slow_request(port, upload))
+        stopped = asyncio.ensure_future(stop.wait())
+        await asyncio.wait({request, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if not request.done():
+            request.cancel()
+            return
+        try:
+            if request.result() == 200:
+                results[key] += 1
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            await asyncio.sleep(0.1)
+
+async def drive(port, args):
+    results = {'latencies': [], 'statuses': {}, 'slow_uploads': 0, 'slow_downloads': 0}
+    stop = asyncio.Event()
+    # Requests that start during the warm-up are not measured
+    measure_from = [float('inf')]
+    tasks = [asyncio.ensure_future(slow_client(port, number % 2 == 0, stop, results)) for number in range(args.slow)]
+    tasks += [asyncio.ensure_future(fast_client(port, number, stop, measure_from, results))
+              for number in range(args.clients)]
+    await asyncio.sleep(args.warmup)
+    measure_from[0] = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.wait(tasks, timeout=10)
+    return results
+
+def run(deployment, args):
+    data_dir = tempfile.mkdtemp(prefix='barcodes-serving-')
+    database_url = 'sqlite:///' + os.path.join(data_dir, 'records.db')
+    try:
+        subprocess.run([sys.executable, 'init_db.py'], cwd=ROOT, env=dict(os.environ, DATABASE_URL=database_url),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        port = free_port()
+        server = start_server(deployment, args, port, database_url)
+        try:
+            results = asyncio.run(drive(port, args))
+            rss_kb = tree_rss_kb(server.pid) if os.path.isdir('/proc') else 0
+        finally:
+            server.terminate()
+            server.wait(30)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    latencies = sorted(results['latencies'])
+    ok = results['statuses'].get(200, 0)
+    return {
+        'requests_per_sec': round(ok / args.duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'errors': {status: count for status, count in results['statuses'].items() if status != 200},
+        'slow_uploads': results['slow_uploads'],
+        'slow_downloads': results['slow_downloads'],
+        'rss_mib': round(rss_kb / 1024, 1)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.serving', description=__doc__.splitlines()[0])
+    parser.add_argument('--deployment', action='append', choices=list(DEPLOYMENTS),
+                        help='deployment to run, may be repeated (default: all)')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (default: 2)')
+    parser.add_argument('--pool', type=int, default=1, help='render processes per worker (default: 1)')
+    parser.add_argument('--cpus', help="CPUs to pin the servers to, e.g. '0-3' (default: no pinning)")
+    parser.add_argument('--clients', type=int, default=16, help='fast keep-alive clients (default: 16)')
+    parser.add_argument('--slow', type=int, default=100, help='slow uploading and downloading clients (default: 100)')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds before measuring (default: 3)')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds (default: 10)')
+    args = parser.parse_args(argv)
+
+    print(f"⏱️  {args.workers} workers x {args.pool} render processes, CPUs {args.cpus or 'all'}, "
+          f"{args.clients} fast and {args.slow} slow clients, {args.duration:g} s")
+    for deployment in args.deployment or list(DEPLOYMENTS):
+        result = run(deployment, args)
+        errors = ', '.join(f'{count}x {status or "closed"}' for status, count in sorted(result['errors'].items()))
+        print(f"{deployment:<6} {result['requests_per_sec']:>9.1f} req/s  p50 {result['p50_ms'] or 0:>8.2f} ms  "
+              f"p99 {result['p99_ms'] or 0:>8.2f} ms  slow uploads {result['slow_uploads']:>5}  "
+              f"downloads {result['slow_downloads']:>4}  "
+              f"{result['rss_mib']:>7.1f} MiB" + (f"  errors: {errors}" if errors else ''))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
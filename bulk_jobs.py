@@ -0,0 +1,276 @@
+"""Bulk generation jobs from uploaded CSV or NDJSON files.
+
+The API stores an upload under ``JOBS_DIR/<job id>/`` and inserts a
+``bulk_jobs`` row. A separate worker process (``python jobs_worker.py``)
+claims queued jobs and renders their items in fixed-size chunks through its
+own render pool, writing each chunk as a ZIP archive next to the upload.
+
+After every chunk the job row records how many leading items are finished, so
+whichever worker picks the job up next resumes at the first unfinished chunk.
+A worker that is stopped puts its job back in the queue; a running job whose
+worker stops sending heartbeats is taken over by another worker once its
+lease expires. Heartbeats are also sent while a chunk renders, and
+every update of the row is conditional on the worker still holding it, so a
+worker that lost its job stops instead of writing over the new holder.
+"""
+
+import csv
+import json
+import os
+import signal
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from archive_stream import iter_zip, iter_parallel
+from validation import ParameterError, SPEC_PARSERS, file_extension
+
+JOB_FORMATS = ['csv', 'ndjson']
+
+# Upload file extensions and content types that imply a format
+FORMAT_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+FORMAT_MIMETYPES = {'text/csv': 'csv', 'application/x-ndjson': 'ndjson', 'application/jsonl': 'ndjson'}
+
+class LeaseLost(Exception):
+    """Another worker has taken over the job"""
+
+def job_dir(jobs_dir, job_id):
+    return os.path.join(jobs_dir, job_id)
+
+def upload_path(jobs_dir, job_id, source_format):
+    return os.path.join(job_dir(jobs_dir, job_id), f'input.{source_format}')
+
+def chunk_path(jobs_dir, job_id, chunk_index):
+    return os.path.join(job_dir(jobs_dir, job_id), f'chunk-{chunk_index:05d}.zip')
+
+def detect_format(requested, filename, mimetype):
+    """Pick the upload format from an explicit parameter, the file name or its content type"""
+    if requested:
+        return requested.lower()
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[extension]
+    return FORMAT_MIMETYPES.get((mimetype or '').split(';')[0].strip().lower())
+
+def iter_specs(path, source_format):
+    """Yield (spec, error) for every item of an upload, in file order.
+
+    CSV rows become specs keyed by the header row, with empty cells left out so
+    the API defaults apply. Lines that cannot be read yield an error instead of
+    a spec so they are reported per item rather than failing the job.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as upload:
+        if source_format == 'csv':
+            for row in csv.DictReader(upload):
+                yield {key: value for key, value in row.items() if key and value not in (None, '')}, None
+            return
+        for line in upload:
+            if not line.strip():
+                continue
+            try:
+                spec = json.loads(line)
+            except ValueError as e:
+                yield None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(spec, dict):
+                yield None, 'Each line must be a JSON object'
+                continue
+            yield spec, None
+
+def count_specs(path, source_format):
+    """Check that an upload is readable and return its number of items"""
+    if source_format == 'csv':
+        with open(path, encoding='utf-8-sig', newline='') as upload:
+            header = next(csv.reader(upload), None)
+        if not header or 'text' not in header:
+            raise ParameterError('Invalid upload', 'CSV uploads need a header row with a text column')
+    try:
+        return sum(1 for _ in iter_specs(path, source_format))
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ParameterError('Invalid upload', f'The upload could not be read as {source_format.upper()}: {e}')
+
+def entry_name(index, code_type, params):
+    """Archive member name for a rendered job item"""
+    label = params['barcode_type'] if code_type == 'barcode' else 'qrcode'
+    return f'{index:07d}_{label}.{file_extension(params["image_format"])}'
+
+class JobWorker:
+    """Claims bulk jobs from the database and renders them chunk by chunk"""
+
+    def __init__(self, app, db, job_model, jobs_dir, engine, worker_id=None, lease=300.0, poll_interval=2.0):
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.jobs_dir = jobs_dir
+        self.engine = engine
+        # Unique per process: scaled workers share their configured name, and
+        # a lease only protects a job if no other worker can pass for its holder
+        self.worker_id = f'{(worker_id or socket.gethostname())[:80]}-{uuid.uuid4().hex[:12]}'
+        self.lease = lease
+        self.poll_interval = poll_interval
+        # Several heartbeats fit in a lease, so one late beat does not lose the job
+        self.heartbeat_interval = lease / 5
+        self._stopping = False
+        self._last_heartbeat = 0.0
+
+    def stop(self, *args):
+        """Finish the current chunk, then exit"""
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"🔄 Bulk job worker {self.worker_id} started")
+        with self.app.app_context():
+            while not self._stopping:
+                try:
+                    job = self.claim()
+                    if job is not None:
+                        self.process(job)
+                        continue
+                except Exception as e:
+                    # e.g. the database is unreachable; try again on the next poll
+                    self.db.session.rollback()
+                    print(f"❌ Bulk job worker error: {e}")
+                time.sleep(self.poll_interval)
+        self.engine.shutdown()
+        print(f"✅ Bulk job worker {self.worker_id} stopped")
+
+    def claim(self):
+        """Take the oldest queued job, or a running one that a dead worker left behind"""
+        Job = self.job_model
+        stale = datetime.utcnow() - timedelta(seconds=self.lease)
+        candidates = Job.query.filter(
+            (Job.status == 'queued') | ((Job.status == 'running') & (Job.heartbeat_at < stale))
+        ).order_by(Job.created_at).limit(5).all()
+        for job in candidates:
+            # Conditional update so two workers cannot claim the same job
+            claimed = Job.query.filter_by(id=job.id, status=job.status, worker_id=job.worker_id,
+                                          heartbeat_at=job.heartbeat_at).update({
+                'status': 'running',
+                'worker_id': self.worker_id,
+                'heartbeat_at': datetime.utcnow(),
+                'started_at': job.started_at or datetime.utcnow()
+            }, synchronize_session=False)
+            self.db.session.commit()
+            if claimed:
+                self.db.session.refresh(job)
+                return job
+        return None
+
+    def checkpoint(self, job, **values):
+        """Update the job row while this worker holds it, refreshing its heartbeat.
+
+        Raises LeaseLost when the job has been taken over, leaving the row alone.
+        """
+        Job = self.job_model
+        updated = Job.query.filter_by(id=job.id, worker_id=self.worker_id).update(
+            {'heartbeat_at': datetime.utcnow(), **values}, synchronize_session=False)
+        self.db.session.commit()
+        self._last_heartbeat = time.monotonic()
+        if not updated:
+            raise LeaseLost(f'Job {job.id} was taken over by another worker')
+
+    def heartbeat(self, job):
+        """Refresh the job's heartbeat if it is due"""
+        if time.monotonic() - self._last_heartbeat >= self.heartbeat_interval:
+            self.checkpoint(job)
+
+    def process(self, job):
+        """Render the unfinished chunks of a job, checkpointing after each one"""
+        if job.completed_items:
+            print(f"🔄 Resuming job {job.id} at item {job.completed_items}/{job.total_items}")
+        else:
+            print(f"🔄 Starting job {job.id} ({job.total_items} items)")
+        self._last_heartbeat = time.monotonic()
+        try:
+            specs = iter_specs(upload_path(self.jobs_dir, job.id, job.source_format), job.source_format)
+            # Items before the checkpoint are already in finished chunks
+            items = enumerate(specs)
+            for _ in islice(items, job.completed_items):
+                pass
+            while job.completed_items < job.total_items:
+                if self._stopping:
+                    # Hand the job back so the next worker need not wait for the lease
+                    self.checkpoint(job, status='queued', worker_id=None)
+                    print(f"⏸️  Job {job.id} returned to the queue at item {job.completed_items}")
+                    return
+                chunk = list(islice(items, job.chunk_size))
+                if not chunk:
+                    break
+                started = time.perf_counter()
+                failed = self.write_chunk(job, job.completed_items // job.chunk_size, chunk)
+                self.checkpoint(job, completed_items=job.completed_items + len(chunk),
+                                failed_items=job.failed_items + failed,
+                                processing_seconds=job.processing_seconds + time.perf_counter() - started)
+            self.checkpoint(job, status='completed', finished_at=datetime.utcnow())
+            print(f"✅ Job {job.id} completed: {job.completed_items} items, {job.failed_items} failed")
+        except LeaseLost as e:
+            print(f"⚠️  {e}; stopping")
+        except Exception as e:
+            self.db.session.rollback()
+            try:
+                self.checkpoint(job, status='failed', error_message=str(e), finished_at=datetime.utcnow())
+                print(f"❌ Job {job.id} failed: {e}")
+            except LeaseLost as lost:
+                print(f"⚠️  {lost}; stopping")
+
+    def render_item(self, item):
+        """Render one job item, returning its manifest entry and image bytes"""
+        # Imported here so the web app can use the upload helpers without the rendering stack
+        from rendering import render_barcode, render_qr
+        index, (spec, error) = item
+        if error is not None:
+            return {'index': index, 'status': 'error', 'error': 'Invalid item', 'message': error}, None
+        code_type = spec.get('type', 'barcode')
+        if code_type not in SPEC_PARSERS:
+            return {'index': index, 'status': 'error', 'error': 'Invalid type',
+                    'message': 'type must be one of: barcode, qrcode'}, None
+        try:
+            params = SPEC_PARSERS[code_type](spec)
+        except ParameterError as e:
+            return {'index': index, 'type': code_type, 'status': 'error', **e.to_dict()}, None
+        render_func = render_barcode if code_type == 'barcode' else render_qr
+        try:
+            data = self.engine.render(render_func, params, wait=self.engine.timeout)
+        except Exception as e:
+            failure = 'Barcode generation failed' if code_type == 'barcode' else 'QR code generation failed'
+            return {'index': index, 'type': code_type, 'status': 'error', 'error': failure, 'message': str(e)}, None
+        name = entry_name(index, code_type, params)
+        return {'index': index, 'type': code_type, 'status': 'ok', 'filename': name, 'bytes': len(data)}, data
+
+    def write_chunk(self, job, chunk_index, chunk):
+        """Render a chunk into its ZIP archive and return the number of failed items"""
+        manifest = []
+
+        def entries():
+            workers = max(1, self.engine.pool_size) * 2
+            for entry, data in iter_parallel(self.render_item, chunk, workers):
+                manifest.append(entry)
+                self.heartbeat(job)
+                if data is not None:
+                    yield entry['filename'], data
+            manifest.sort(key=lambda entry: entry['index'])
+            yield 'manifest.json', json.dumps({
+                'job': job.id,
+                'chunk': chunk_index,
+                'first_index': chunk[0][0],
+                'count': len(chunk),
+                'items': manifest
+            }, indent=2).encode('utf-8')
+
+        path = chunk_path(self.jobs_dir, job.id, chunk_index)
+        # Per worker, so a worker that lost the job cannot write into its successor's file
+        partial = f'{path}.{self.worker_id}.part'
+        try:
+            with open(partial, 'wb') as archive:
+                for data in iter_zip(entries()):
+                    archive.write(data)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        # A chunk only appears under its final name once it is complete
+        os.replace(partial, path)
+        return sum(1 for entry in manifest if entry['status'] != 'ok')
@@ -21,6 +21,8 @@ STATIC_IP_ADDRESS="34.61.233.111"
 
 # Load balancer configuration  
 LOAD_BALANCER_IP="34.49.2.152"
+# Google's load balancer appends the client and its own address to X-Forwarded-For
+TRUSTED_PROXY_HOPS=2
 
 echo "Building and deploying Barcode Generator to Google Cloud Compute Engine..."
 
@@ -45,7 +47,7 @@ gcloud compute instances create-with-container $INSTANCE_NAME \
     --machine-type=$MACHINE_TYPE \
     --container-image=gcr.io/$PROJECT_ID/barcode-generator \
     --container-restart-policy=always \
-    --container-env=DATABASE_URL="$DATABASE_URL" \
+    --container-env=DATABASE_URL="$DATABASE_URL",TRUSTED_PROXY_HOPS=$TRUSTED_PROXY_HOPS \
     --address=$STATIC_IP_ADDRESS \
     --tags=http-server,https-server \
     --project=$PROJECT_ID
@@ -0,0 +1,181 @@
+"""Write-behind logging of generation attempts.
+
+Request threads only build a row and put it on a bounded in-memory queue. A
+background thread drains the queue and writes rows with one multi-row INSERT
+per batch, either when ``batch_size`` rows are waiting or ``flush_interval``
+seconds have passed. When the database keeps failing a circuit breaker stops
+write attempts for ``breaker_cooldown`` seconds; rows that do not fit in the
+queue meanwhile are dropped and counted rather than blocking requests.
+
+An optional ``prepare`` callable turns a batch into the rows to insert (the
+app uses it to replace user agents and headers by lookup ids); it must
+return new rows, since a failed batch is retried as it was queued.
+"""
+
+import os
+import queue
+import threading
+import time
+from metrics import LOG_FLUSH_SECONDS
+
+_STOP = object()
+
+class GenerationLogWriter:
+    def __init__(self, app, db, table, max_queue=10000, batch_size=500, flush_interval=2.0,
+                 breaker_threshold=3, breaker_cooldown=30.0, prepare=None):
+        self.app = app
+        self.db = db
+        self.table = table
+        self.prepare = prepare
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
+
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self._retry = []
+        self._closed = False
+        self._stopping = None
+
+    def _ensure_started(self):
+        # (Re)start the flush thread lazily and after a fork, since neither the
+        # thread nor the queue's locks survive into a child process.
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._retry = []
+            self._closed = False
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='generation-log-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, row):
+        """Queue a generation_records row without touching the database"""
+        self._ensure_started()
+        if self._closed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    @property
+    def breaker_open(self):
+        return time.monotonic() < self.breaker_open_until
+
+    def _collect(self):
+        batch, self._retry = self._retry, []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                break
+            batch.append(item)
+        return batch
+
+    def _drain(self):
+        batch, self._retry = self._retry, []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return batch
+            if item is not _STOP:
+                batch.append(item)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self.breaker_open:
+                self._stopping.wait(self.breaker_open_until - time.monotonic())
+                continue
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+        # Final flush at shutdown: one last attempt regardless of the breaker
+        batch = self._drain()
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                rows = self.prepare(batch) if self.prepare is not None else batch
+                with self.db.engine.begin() as connection:
+                    connection.execute(self.table.insert(), rows)
+        except Exception as db_error:
+            self.failed_flushes += 1
+            self.consecutive_failures += 1
+            # Keep the batch for the next attempt, bounded by the queue size
+            self._retry = batch[-self.max_queue:]
+            if self.consecutive_failures >= self.breaker_threshold:
+                if not self.breaker_open:
+                    print(f"❌ Database logging failing, pausing writes for {self.breaker_cooldown}s: {db_error}")
+                self.breaker_open_until = time.monotonic() + self.breaker_cooldown
+            else:
+                print(f"❌ Database logging error: {db_error}")
+            return False
+
+        if self.consecutive_failures:
+            # Successful flushes are counted in stats() rather than printed
+            print(f"✅ Database logging recovered after {self.consecutive_failures} failed flushes")
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
+        self.flushed += len(batch)
+        self.batches += 1
+        self.last_flush_seconds = time.perf_counter() - started
+        LOG_FLUSH_SECONDS.observe(self.last_flush_seconds)
+        return True
+
+    def close(self, timeout=5.0):
+        """Stop accepting rows and flush whatever is still queued"""
+        if self._pid != os.getpid() or self._closed:
+            return
+        self._closed = True
+        self._stopping.set()
+        try:
+            # Wake the flush thread if it is waiting on an empty queue
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize() + len(self._retry) if self._queue is not None else 0,
+            'max_queue': self.max_queue,
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_seconds': round(self.last_flush_seconds, 4),
+            'breaker': 'open' if self.breaker_open else 'closed'
+        }
@@ -0,0 +1,50 @@
+"""Gunicorn configuration, loaded automatically from the working directory"""
+
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# Rendering runs in each worker's process pool (RENDER_POOL_SIZE, one process
+# per core by default), so a couple of threaded workers are enough to keep
+# every core busy; the threads mostly wait on the pool and on slow clients.
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Workers write their metrics to files in a directory shared with the other
+# workers, so /metrics reports all of them whichever worker answers a scrape
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='barcodes-metrics-'))
+
+# Rate limit buckets are shared by the workers the same way, so a client's
+# allowance holds whichever worker answers
+os.environ.setdefault('RATE_LIMIT_DIR', tempfile.mkdtemp(prefix='barcodes-ratelimit-'))
+
+# Imported up front: child_exit runs in the master's signal handler
+from prometheus_client import multiprocess  # noqa: E402
+
+def post_fork(server, worker):
+    # A threaded worker serves at most MAX_IN_FLIGHT generation requests at
+    # once, leaving threads free to answer status checks and to refuse excess
+    # requests quickly. ASGI workers hold no thread per request (asgi.py).
+    # Set before the worker imports the app, which reads it
+    if not type(worker).__module__.startswith('uvicorn'):
+        os.environ.setdefault('MAX_IN_FLIGHT', str(max(1, worker.cfg.threads - 2)))
+
+def post_worker_init(worker):
+    # Load the rendering stack, start the render pool and pre-render hot
+    # values before the worker accepts requests
+    from app import warm_up, mark_worker_ready
+    warm_up()
+    mark_worker_ready()
+
+def worker_exit(server, worker):
+    # Flush queued generation records before the worker process goes away
+    from app import generation_log, rollup_compactor
+    from render_engine import render_engine
+    rollup_compactor.stop()
+    generation_log.close()
+    render_engine.shutdown()
+
+def child_exit(server, worker):
+    # Stop counting a dead worker's in-flight renders and cache in the gauges
+    multiprocess.mark_process_dead(worker.pid)
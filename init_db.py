@@ -60,7 +60,9 @@ def apply_migrations():
 
 if __name__ == "__main__":
     # Import app after setting up the path
-    from app import app, db
+    from app import app, db, init_db, rollup_compactor
+    if 'migrate' not in app.extensions:
+        Migrate(app, db)
     
     with app.app_context():
         database_url = app.config['SQLALCHEMY_DATABASE_URI']
@@ -79,10 +81,21 @@ if __name__ == "__main__":
             # Apply migrations
             apply_migrations()
             
+            # Create any tables or columns the migrations do not cover
+            init_db()
+            
         else:
             print("📁 Using SQLite database")
-            # For SQLite, just create tables
-            db.create_all()
+            # For SQLite, just create tables and add missing columns
+            init_db()
             print("✅ SQLite tables created")
+
+        # Catch the usage rollups up with existing records (two passes: see usage_stats)
+        try:
+            folded = sum(rollup_compactor.compact() for _ in range(2))
+            print(f"✅ Usage rollups up to date ({folded} records folded)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Usage rollup catch-up failed: {e}")
         
         print("🎉 Database setup complete!")
\ No newline at end of file
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""Bulk job worker: renders jobs uploaded to /api/jobs.
+
+Run next to the web app with access to the same database and JOBS_DIR:
+
+    python jobs_worker.py
+"""
+
+import os
+
+# Render processes re-import this module, so everything happens under the main guard
+if __name__ == '__main__':
+    from app import app, db, BulkJob, JOBS_DIR
+    from bulk_jobs import JobWorker
+    from render_engine import RenderEngine
+
+    engine = RenderEngine(
+        pool_size=int(os.environ.get('JOBS_RENDER_PROCESSES', os.cpu_count() or 1)),
+        timeout=float(os.environ.get('RENDER_TIMEOUT', 10.0)),
+        start_method=os.environ.get('RENDER_POOL_START_METHOD', 'forkserver')
+    )
+    worker = JobWorker(
+        app, db, BulkJob, JOBS_DIR, engine,
+        worker_id=os.environ.get('JOBS_WORKER_ID'),
+        lease=float(os.environ.get('JOBS_LEASE_SECONDS', 300.0)),
+        poll_interval=float(os.environ.get('JOBS_POLL_INTERVAL', 2.0))
+    )
+    worker.run()
@@ -0,0 +1,156 @@
+"""Label sheet composition: many rendered codes laid out on printable pages.
+
+Labels fill a grid of ``columns`` x ``rows`` cells, row by row, page after
+page. Pages are composed one at a time and handed straight to an encoder
+(PNG or a minimal streaming PDF writer), so memory stays at one page canvas
+plus a bounded set of scaled label images however long the sheet is.
+"""
+
+import io
+import zlib
+from collections import OrderedDict
+from PIL import Image
+from validation import SHEET_PAGE_SIZES
+
+MM_PER_INCH = 25.4
+
+# Scaled label images kept across pages, so repeated values are scaled once
+FITTED_LABEL_CACHE_SIZE = 256
+
+def mm_to_px(mm, dpi):
+    return int(round(mm * dpi / MM_PER_INCH))
+
+def labels_per_page(layout):
+    return layout['columns'] * layout['rows']
+
+def page_count(layout, label_count):
+    return -(-label_count // labels_per_page(layout))
+
+def page_size_px(layout):
+    width, height = SHEET_PAGE_SIZES[layout['page']]
+    return mm_to_px(width, layout['dpi']), mm_to_px(height, layout['dpi'])
+
+def cell_boxes(layout):
+    """(x, y, width, height) in pixels of the printable area of every cell, row by row"""
+    dpi = layout['dpi']
+    width, height = SHEET_PAGE_SIZES[layout['page']]
+    columns, rows = layout['columns'], layout['rows']
+    margin, gap, padding = layout['margin'], layout['gap'], layout['padding']
+    cell_width = (width - 2 * margin - (columns - 1) * gap) / columns
+    cell_height = (height - 2 * margin - (rows - 1) * gap) / rows
+
+    boxes = []
+    for row in range(rows):
+        for column in range(columns):
+            # Positions are computed in millimetres and rounded once, so cells do not drift
+            left = mm_to_px(margin + column * (cell_width + gap) + padding, dpi)
+            top = mm_to_px(margin + row * (cell_height + gap) + padding, dpi)
+            right = mm_to_px(margin + column * (cell_width + gap) + cell_width - padding, dpi)
+            bottom = mm_to_px(margin + row * (cell_height + gap) + cell_height - padding, dpi)
+            boxes.append((left, top, right - left, bottom - top))
+    return boxes
+
+def fit_label(image, width, height, mode):
+    """Scale a label image to fit a cell, keeping its aspect ratio.
+
+    Enlarging uses nearest-neighbour so bars and modules keep hard edges.
+    """
+    image = image.convert(mode)
+    scale = min(width / image.width, height / image.height)
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    if size == image.size:
+        return image
+    resample = Image.Resampling.NEAREST if scale >= 1 else Image.Resampling.BOX
+    return image.resize(size, resample)
+
+def iter_pages(layout, labels, render_many, color=False):
+    """Yield one composed page image at a time.
+
+    ``labels`` is the sequence of label keys in sheet order and
+    ``render_many(keys)`` yields (key, image bytes or None) for the distinct
+    keys of a page that are not already scaled. A label that failed to render
+    leaves its cell empty.
+    """
+    mode = 'RGB' if color else 'L'
+    boxes = cell_boxes(layout)
+    per_page = len(boxes)
+    page_width, page_height = page_size_px(layout)
+    cell_width, cell_height = boxes[0][2], boxes[0][3]
+    fitted = OrderedDict()
+
+    for start in range(0, len(labels), per_page):
+        page_labels = labels[start:start + per_page]
+        missing = [key for key in dict.fromkeys(page_labels) if key not in fitted]
+        for key, data in render_many(missing):
+            fitted[key] = fit_label(Image.open(io.BytesIO(data)), cell_width, cell_height, mode) if data else None
+
+        canvas = Image.new(mode, (page_width, page_height), 'white')
+        for key, (left, top, width, height) in zip(page_labels, boxes):
+            fitted.move_to_end(key)
+            label = fitted[key]
+            if label is not None:
+                canvas.paste(label, (left + (width - label.width) // 2, top + (height - label.height) // 2))
+        while len(fitted) > max(FITTED_LABEL_CACHE_SIZE, per_page):
+            fitted.popitem(last=False)
+        yield canvas
+
+def page_png(page, dpi):
+    buffer = io.BytesIO()
+    page.save(buffer, format='PNG', dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+def iter_pdf(pages, dpi):
+    """Yield a PDF document chunk by chunk, one page image at a time.
+
+    Each page is a single Flate-compressed image XObject drawn over the whole
+    MediaBox. The page tree and catalog are written after the last page, since
+    the cross-reference table lets objects appear in any order.
+    """
+    offsets = {}
+    position = 0
+
+    def write_object(number, body, stream=None):
+        nonlocal position
+        offsets[number] = position
+        data = f'{number} 0 obj\n'.encode('ascii') + body
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        data += b'\nendobj\n'
+        position += len(data)
+        return data
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    yield header
+
+    # Objects 1 and 2 are the catalog and page tree; each page takes three more
+    kids = []
+    for index, page in enumerate(pages):
+        page_id, content_id, image_id = 3 + 3 * index, 4 + 3 * index, 5 + 3 * index
+        width_pt = page.width * 72 / dpi
+        height_pt = page.height * 72 / dpi
+        color_space = '/DeviceRGB' if page.mode == 'RGB' else '/DeviceGray'
+
+        pixels = zlib.compress(page.tobytes(), 6)
+        yield write_object(image_id, (
+            f'<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} '
+            f'/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode /Length {len(pixels)} >>'
+        ).encode('ascii'), pixels)
+
+        content = f'q {width_pt:.2f} 0 0 {height_pt:.2f} 0 0 cm /Im0 Do Q'.encode('ascii')
+        yield write_object(content_id, f'<< /Length {len(content)} >>'.encode('ascii'), content)
+
+        yield write_object(page_id, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt:.2f} {height_pt:.2f}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>'
+        ).encode('ascii'))
+        kids.append(f'{page_id} 0 R')
+
+    yield write_object(2, f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode('ascii'))
+    yield write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    size = max(offsets) + 1
+    xref = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+    xref.extend(f'{offsets[number]:010d} 00000 n \n' for number in range(1, size))
+    xref.append(f'trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n')
+    yield ''.join(xref).encode('ascii')
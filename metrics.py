@@ -0,0 +1,85 @@
+"""Prometheus metrics for the generation pipeline, served at ``/metrics``.
+
+Requests are timed as a whole and per render stage (the ``stage_timing``
+stages: parse, render, encode, draw, save and log), labelled by code type,
+symbology and image format. When ``PROMETHEUS_MULTIPROC_DIR`` is set, as
+``gunicorn.conf.py`` does, every worker writes its samples to memory-mapped
+files in that directory and a scrape of any worker reports all of them;
+otherwise the metrics cover the current process only.
+"""
+
+import os
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from validation import VALID_BARCODE_TYPES, VALID_IMAGE_FORMATS, QR_MATRIX_FORMAT
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+CODE_LABELS = ('code_type', 'symbology', 'image_format')
+
+# From half a millisecond (cache hits) up to the render time limit
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_SECONDS = Histogram(
+    'barcodes_request_duration_seconds', 'Time spent serving generation requests, streamed bodies included',
+    ('route',) + CODE_LABELS, buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram(
+    'barcodes_stage_duration_seconds', 'Time spent in each generation stage per request',
+    ('stage',) + CODE_LABELS, buckets=LATENCY_BUCKETS)
+VALIDATION_FAILURES = Counter(
+    'barcodes_validation_failures_total', 'Requests and items rejected by parameter validation',
+    ('code_type', 'reason'))
+RENDER_CACHE_LOOKUPS = Counter(
+    'barcodes_render_cache_lookups_total', 'Render cache lookups', ('result',))
+THROTTLED_REQUESTS = Counter(
+    'barcodes_throttled_requests_total', 'Requests refused with 429 by the per-client rate limit', ('route',))
+SHED_REQUESTS = Counter(
+    'barcodes_shed_requests_total', 'Requests refused with 503 because the worker was at its concurrency limit',
+    ('route',))
+LOG_FLUSH_SECONDS = Histogram(
+    'barcodes_log_flush_duration_seconds', 'Time spent writing one batch of generation records',
+    buckets=LATENCY_BUCKETS)
+
+# Gauges are summed over the live workers
+RENDERS_IN_FLIGHT = Gauge(
+    'barcodes_renders_in_flight', 'Renders waiting for or running in a render process', multiprocess_mode='livesum')
+REQUESTS_IN_FLIGHT = Gauge(
+    'barcodes_requests_in_flight', 'Generation requests holding a concurrency slot', multiprocess_mode='livesum')
+RENDER_CACHE_ENTRIES = Gauge(
+    'barcodes_render_cache_entries', 'Images held in the render caches', multiprocess_mode='livesum')
+RENDER_CACHE_BYTES = Gauge(
+    'barcodes_render_cache_bytes', 'Bytes held in the render caches', multiprocess_mode='livesum')
+
+def code_labels(code_type, symbology, image_format):
+    """Label values for a generation, with anything outside the known sets folded into 'other'"""
+    if code_type == 'qrcode':
+        symbology = 'qrcode'
+    elif symbology not in VALID_BARCODE_TYPES:
+        symbology = 'other'
+    image_format = str(image_format or 'PNG').upper()
+    if image_format not in VALID_IMAGE_FORMATS and image_format != QR_MATRIX_FORMAT:
+        image_format = 'other'
+    return code_type, symbology, image_format
+
+def merge_labels(current, labels):
+    """Combine the labels of several generations in one request; fields that differ become 'mixed'"""
+    if current is None or current == labels:
+        return labels
+    return tuple(value if value == other else 'mixed' for value, other in zip(current, labels))
+
+def observe_request(route, labels, seconds, timings):
+    REQUEST_SECONDS.labels(route, *labels).observe(seconds)
+    for name, stage_seconds in timings.items():
+        STAGE_SECONDS.labels(name, *labels).observe(stage_seconds)
+
+def set_cache_occupancy(stats):
+    RENDER_CACHE_ENTRIES.set(stats['entries'])
+    RENDER_CACHE_BYTES.set(stats['bytes'])
+
+def exposition():
+    """Return the metrics page body and its content type"""
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,210 @@
+"""ZPL and EPL label commands for barcodes and QR codes.
+
+Symbologies the printer languages support are sent as native commands: the
+printer encodes and draws them itself, so a label is a few hundred bytes of
+text and no image is drawn here. Everything else (and QR codes in EPL, or in
+ZPL beyond its largest magnification) is rasterized to a 1-bit image and sent
+as a graphic field: ``^GF`` with ZPL's ASCII compression, or EPL's ``GW``.
+
+Sizes are converted from millimetres to printer dots at ``dpi``, 203 unless
+the request sets it, the resolution of most desktop label printers.
+"""
+
+import os
+from PIL import Image
+from rendering import BARCODE_GEOMETRY, encode_barcode, encode_qr, bar_modules, qr_matrix, rasterize_barcode
+
+PRINTER_DPI = int(os.environ.get('PRINTER_DPI', 203))
+
+# Native ZPL commands per symbology and their arguments, filled with the bar
+# height in dots, the human readable text flag and, for Codabar, the start and
+# stop characters; and the wide to narrow bar ratio
+ZPL_BARCODES = {
+    'code128': ('^BC', 'N,{height},{text},N,N,A', 3.0),
+    'gs1_128': ('^BC', 'N,{height},{text},N,N,D', 3.0),  # mode D takes the AIs in parentheses
+    'code39': ('^B3', 'N,N,{height},{text},N', 2.0),  # the check character is already in the data
+    'ean': ('^BE', 'N,{height},{text},N', 3.0),
+    'ean13': ('^BE', 'N,{height},{text},N', 3.0),
+    'jan': ('^BE', 'N,{height},{text},N', 3.0),
+    'isbn': ('^BE', 'N,{height},{text},N', 3.0),
+    'isbn13': ('^BE', 'N,{height},{text},N', 3.0),
+    'gs1': ('^BE', 'N,{height},{text},N', 3.0),
+    'ean8': ('^B8', 'N,{height},{text},N', 3.0),
+    'upc': ('^BU', 'N,{height},{text},N,Y', 3.0),
+    'upca': ('^BU', 'N,{height},{text},N,Y', 3.0),
+    'itf': ('^B2', 'N,{height},{text},N,N', 2.5),
+    'codabar': ('^BK', 'N,N,{height},{text},N,{start},{stop}', 3.0)
+}
+
+# Native EPL bar code selections per symbology
+EPL_BARCODES = {
+    'code128': '1', 'code39': '3', 'ean': 'E30', 'ean13': 'E30', 'jan': 'E30', 'isbn': 'E30', 'isbn13': 'E30',
+    'gs1': 'E30', 'ean8': 'E80', 'upc': 'UA0', 'upca': 'UA0', 'itf': '2'
+}
+
+# Digits the printer is given for symbologies whose check digit it computes
+CHECK_DIGIT_DATA_LENGTHS = {'^BE': 12, 'E30': 12, '^B8': 7, 'E80': 7, '^BU': 11, 'UA0': 11}
+
+# ZPL magnifies QR modules by 1 to 10 dots
+ZPL_QR_MAX_MAGNIFICATION = 10
+
+# ZPL ASCII compression: repeat counts 1-19 and multiples of 20 up to 400
+_ZPL_COUNTS = 'GHIJKLMNOPQRSTUVWXY'
+_ZPL_TWENTIES = 'ghijklmnopqrstuvwxyz'
+
+def mm_to_dots(mm, dpi):
+    return int(round(mm * dpi / 25.4))
+
+def zpl_field_data(text):
+    """^FH^FD field data with the characters ZPL treats as commands hex-escaped"""
+    escaped = ''.join(f'_{ord(char):02X}' if char in '_^~' or ord(char) < 32 else char for char in text)
+    return f'^FH^FD{escaped}^FS'
+
+def epl_string(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def native_data(symbol, command):
+    """The data a native printer command takes, or None when the value cannot be sent natively"""
+    # The symbol's human readable text is the full code, check digits included
+    code = symbol.text or ''
+    if command in CHECK_DIGIT_DATA_LENGTHS:
+        length = CHECK_DIGIT_DATA_LENGTHS[command]
+        return code[:length] if len(code) == length + 1 and code.isdigit() else None
+    if command == '^BK' and not (len(code) > 2 and code[0] in 'ABCD' and code[-1] in 'ABCD'):
+        return None
+    return code or None
+
+def zpl_repeat(count, char):
+    """A run of one hex digit in ZPL's ASCII compression"""
+    parts = []
+    while count:
+        # One run covers at most 419 digits: 'z' (400) and 'Y' (19)
+        run = min(count, 419)
+        twenties, ones = divmod(run, 20)
+        parts.append((_ZPL_TWENTIES[twenties - 1] if twenties else '') + (_ZPL_COUNTS[ones - 1] if ones else ''))
+        parts.append(char)
+        count -= run
+    return ''.join(parts)
+
+def zpl_compress(rows):
+    """Hex rows of a graphic field in ZPL's ASCII compression.
+
+    Each row is run-length encoded, a row ending in white is cut short with
+    ',' and a row equal to the one before is sent as ':', so the bars of a
+    barcode cost about one row each.
+    """
+    out = []
+    previous = None
+    for row in rows:
+        if row == previous:
+            out.append(':')
+            continue
+        previous = row
+        stripped = row.rstrip('0')
+        encoded = []
+        index = 0
+        while index < len(stripped):
+            char = stripped[index]
+            end = index
+            while end < len(stripped) and stripped[end] == char:
+                end += 1
+            encoded.append(zpl_repeat(end - index, char) if end - index > 1 else char)
+            index = end
+        out.append(''.join(encoded) + (',' if len(stripped) < len(row) else ''))
+    return ''.join(out)
+
+def _padded(img):
+    """A 1-bit image widened to whole bytes with white, so row padding never prints"""
+    img = img.convert('1')
+    width = (img.width + 7) // 8 * 8
+    if width != img.width:
+        padded = Image.new('1', (width, img.height), 1)
+        padded.paste(img, (0, 0))
+        img = padded
+    return img
+
+def zpl_graphic(img, x, y):
+    """^GF graphic field of a 1-bit image, where a set bit prints a dot"""
+    img = _padded(img)
+    row_bytes = img.width // 8
+    # PIL stores white as 1; ZPL prints 1
+    data = bytes(byte ^ 0xFF for byte in img.tobytes())
+    rows = [data[start:start + row_bytes].hex().upper() for start in range(0, len(data), row_bytes)]
+    return f'^FO{x},{y}^GFA,{len(data)},{len(data)},{row_bytes},{zpl_compress(rows)}^FS'
+
+def epl_graphic(img, x, y):
+    """GW graphic of a 1-bit image; EPL prints 0 bits, as PIL stores black"""
+    img = _padded(img)
+    return f'GW{x},{y},{img.width // 8},{img.height},'.encode('ascii') + img.tobytes() + b'\n'
+
+def zpl_label(*fields):
+    return ('^XA^CI28' + ''.join(fields) + '^XZ\n').encode('utf-8')
+
+def epl_label(*commands):
+    return b'\nN\n' + b''.join(commands) + b'P1\n'
+
+def barcode_bitmap(symbol, module_width, module_height, quiet_zone, dpi, write_text):
+    """A barcode rendered by the fast rasterizer at printer resolution, for a graphic field"""
+    return rasterize_barcode(bar_modules(symbol), text=symbol.text if write_text else None,
+                             module_width=module_width, module_height=module_height, quiet_zone=quiet_zone, dpi=dpi,
+                             whole_modules=True)
+
+def barcode_label(text, barcode_type, image_format, module_width=None, module_height=None, quiet_zone=None, dpi=None,
+                  write_text=True):
+    """ZPL or EPL label of a barcode, as bytes"""
+    dpi = dpi or PRINTER_DPI
+    symbol = encode_barcode(barcode_type, text)
+    module_width = symbol.module_width if module_width is None else module_width
+    quiet_zone = symbol.quiet_zone if quiet_zone is None else quiet_zone
+    module_dots = max(1, mm_to_dots(module_width, dpi))
+    height = max(1, mm_to_dots(module_height or BARCODE_GEOMETRY['module_height'], dpi))
+    x = mm_to_dots(quiet_zone, dpi)
+    y = mm_to_dots(BARCODE_GEOMETRY['margin'], dpi)
+
+    if image_format == 'ZPL':
+        native = ZPL_BARCODES.get(barcode_type)
+        # ^BY takes narrow bars of 1 to 10 dots
+        data = native_data(symbol, native[0]) if native and module_dots <= 10 else None
+        if data is None:
+            img = barcode_bitmap(symbol, module_width, module_height, quiet_zone, dpi, write_text)
+            return zpl_label(zpl_graphic(img, 0, 0))
+        command, arguments, ratio = native
+        start = stop = None
+        if command == '^BK':
+            data, start, stop = data[1:-1], data[0], data[-1]
+        arguments = arguments.format(height=height, text='Y' if write_text else 'N', start=start, stop=stop)
+        return zpl_label(f'^BY{module_dots},{ratio:.1f},{height}', f'^FO{x},{y}{command}{arguments}',
+                         zpl_field_data(data))
+
+    selection = EPL_BARCODES.get(barcode_type)
+    data = native_data(symbol, selection) if selection else None
+    if data is None:
+        img = barcode_bitmap(symbol, module_width, module_height, quiet_zone, dpi, write_text)
+        return epl_label(epl_graphic(img, 0, 0))
+    # Narrow and wide bar widths in dots; the wide width only matters for Code 39 and ITF
+    wide = module_dots * 5 // 2 if selection == '2' else module_dots * 2
+    readable = 'B' if write_text else 'N'
+    return epl_label(f'B{x},{y},0,{selection},{module_dots},{wide},{height},{readable},{epl_string(data)}\n'
+                     .encode('utf-8'))
+
+def qr_bitmap(text, error_correction, box_size, border, mask):
+    """1-bit image of a QR code with box_size dots per module"""
+    modules = qr_matrix(encode_qr(text, error_correction, mask))
+    count = len(modules)
+    core = Image.new('1', (count, count))
+    core.putdata([0 if dark else 1 for row in modules for dark in row])
+    img = Image.new('1', (count + 2 * border, count + 2 * border), 1)
+    img.paste(core, (border, border))
+    return img.resize((img.width * box_size, img.height * box_size), Image.NEAREST)
+
+def qr_label(text, error_correction, image_format, box_size, border, mask=None):
+    """ZPL or EPL label of a QR code, as bytes; colors do not apply to label printers"""
+    if image_format == 'ZPL' and box_size <= ZPL_QR_MAX_MAGNIFICATION:
+        offset = border * box_size
+        mask_argument = f',{mask}' if mask is not None else ''
+        return zpl_label(f'^FO{offset},{offset}^BQN,2,{box_size},{error_correction}{mask_argument}',
+                         zpl_field_data(f'{error_correction}A,{text}'))
+    img = qr_bitmap(text, error_correction, box_size, border, mask)
+    if image_format == 'ZPL':
+        return zpl_label(zpl_graphic(img, 0, 0))
+    return epl_label(epl_graphic(img, 0, 0))
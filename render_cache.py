@@ -0,0 +1,100 @@
+"""Bounded in-process cache for rendered barcode and QR code images"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+def make_cache_key(code_type, params):
+    """Build a content-addressed key from normalized render parameters"""
+    # Imported here because rendering keeps its symbol cache in a RenderCache
+    from rendering import RENDER_VERSION
+    payload = json.dumps([RENDER_VERSION, code_type, params], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """Thread-safe LRU cache with a total byte cap and per-entry TTL.
+
+    Values are the encoded image bytes, or any other object when its size is
+    passed to ``put``. Entries larger than ``max_entry_bytes`` are never stored
+    so a single huge symbol cannot flush the whole cache.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self._entries = OrderedDict()  # key -> (data, expires_at, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        """Whether key has an unexpired entry, without counting a lookup"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss or expired entry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, expires_at, _ = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data, size=None):
+        """Store bytes under key, evicting least recently used entries as needed"""
+        size = len(data) if size is None else size
+        if self.max_bytes <= 0 or size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (data, time.monotonic() + self.ttl, size)
+            self._size += size
+            while self._size > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+render_cache = RenderCache(
+    max_bytes=int(os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=int(os.environ.get('RENDER_CACHE_TTL', 3600))
+)
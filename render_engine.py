@@ -0,0 +1,171 @@
+"""Process-pool rendering engine.
+
+Symbol construction and image encoding are CPU-bound and hold the GIL, so a
+gunicorn worker rendering in-process only ever uses one core. The engine hands
+render jobs (a function from ``rendering`` plus its keyword arguments) to a
+pool of pre-started processes and returns the encoded bytes.
+
+Each job runs under an interval timer in the pool process, so a pathological
+input is interrupted after ``timeout`` seconds and the process is reused. If a
+job does not come back at all (e.g. stuck inside C code), the parent gives up
+after a grace period and replaces the whole pool.
+"""
+
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import stage_timing
+
+class RenderTimeout(Exception):
+    """A render job exceeded the per-job time limit"""
+
+class RenderQueueFull(Exception):
+    """Too many render jobs are already running or waiting"""
+
+def _raise_timeout(signum, frame):
+    raise RenderTimeout('Rendering exceeded the time limit')
+
+def _run_job(func, params, timeout):
+    """Run a render job inside a pool process under an interval timer.
+
+    Returns the job's result with the stage timings it recorded.
+    """
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    stage_timing.collect()
+    try:
+        return func(**params), stage_timing.collect()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _warm_up():
+    """Import and warm the rendering stack in a new pool process before real jobs arrive"""
+    import rendering
+    try:
+        rendering.warm_up()
+    except Exception as e:
+        # A failed warm-up only costs speed; an initializer error would break the pool
+        print(f"❌ Render process warm-up failed: {e}")
+
+class RenderEngine:
+    def __init__(self, pool_size, max_pending=None, timeout=10.0, queue_wait=0.5, start_method='forkserver'):
+        self.pool_size = pool_size
+        self.max_pending = max_pending if max_pending is not None else pool_size * 4
+        self.timeout = timeout
+        self.queue_wait = queue_wait
+        self.start_method = start_method
+
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.recycles = 0
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max(1, pool_size + self.max_pending))
+
+    @property
+    def enabled(self):
+        return self.pool_size > 0
+
+    def start(self):
+        """Start the pool processes now rather than on the first render"""
+        if self.enabled:
+            self._get_executor()
+
+    def _get_executor(self):
+        # Pools do not survive a fork, so each gunicorn worker owns its own
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    context.set_forkserver_preload(['render_engine', 'rendering'])
+                # Processes warm up as they start, including replacements after a recycle
+                executor = ProcessPoolExecutor(max_workers=self.pool_size, mp_context=context, initializer=_warm_up)
+                # Touch every process so none is spawned on a request's time
+                for future in [executor.submit(os.getpid) for _ in range(self.pool_size)]:
+                    future.result()
+                self._executor = executor
+                self._pid = os.getpid()
+            return self._executor
+
+    def _recycle(self, executor):
+        """Kill the processes of a pool that has a stuck job and start over"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            else:
+                return
+        self.recycles += 1
+        for process in list((getattr(executor, '_processes', None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, func, params, wait=None):
+        """Render func(**params) in the pool and return its result.
+
+        Raises RenderQueueFull when no slot frees up within ``wait`` seconds
+        and RenderTimeout when the job runs longer than the time limit.
+        """
+        if not self.enabled:
+            return func(**params)
+
+        if not self._slots.acquire(timeout=self.queue_wait if wait is None else wait):
+            self.rejected += 1
+            raise RenderQueueFull('Render queue is full')
+        try:
+            for attempt in range(2):
+                executor = self._get_executor()
+                try:
+                    future = executor.submit(_run_job, func, params, self.timeout)
+                    # Allow for queueing behind other jobs before declaring the pool stuck
+                    result, timings = future.result(timeout=self.timeout * 2 + 1)
+                except FutureTimeoutError:
+                    self.timeouts += 1
+                    self._recycle(executor)
+                    raise RenderTimeout('Rendering exceeded the time limit')
+                except RenderTimeout:
+                    self.timeouts += 1
+                    raise
+                except BrokenProcessPool:
+                    # Another job's timeout recycled the pool under us; retry once
+                    self._recycle(executor)
+                    if attempt:
+                        raise
+                    continue
+                self.completed += 1
+                stage_timing.record(timings)
+                return result
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        return {
+            'pool_size': self.pool_size,
+            'max_pending': self.max_pending,
+            'timeout': self.timeout,
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'recycles': self.recycles
+        }
+
+render_engine = RenderEngine(
+    pool_size=int(os.environ.get('RENDER_POOL_SIZE', os.cpu_count() or 1)),
+    max_pending=int(os.environ['RENDER_QUEUE_DEPTH']) if 'RENDER_QUEUE_DEPTH' in os.environ else None,
+    timeout=float(os.environ.get('RENDER_TIMEOUT', 10.0)),
+    queue_wait=float(os.environ.get('RENDER_QUEUE_WAIT', 0.5)),
+    start_method=os.environ.get('RENDER_POOL_START_METHOD', 'forkserver')
+)
@@ -0,0 +1,580 @@
+"""Barcode and QR code rendering helpers shared by the web and API routes"""
+
+import io
+import os
+import re
+import string
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from html import escape
+from itertools import groupby
+import barcode
+from barcode.base import Barcode
+from barcode.writer import BaseWriter, ImageWriter, SVGWriter, mm2px, pt2mm
+import qrcode
+from qrcode.image.pil import PilImage
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+from render_cache import RenderCache
+from stage_timing import stage
+from validation import VALID_BARCODE_TYPES, VALID_BARCODE_RENDERERS, PRINTER_FORMATS
+
+try:
+    import numpy
+except ImportError:  # Fall back to qrcode's per-module PIL drawing
+    numpy = None
+
+# Bump whenever a change alters the bytes produced for the same parameters,
+# so cache keys and ETags derived from the parameters are invalidated.
+RENDER_VERSION = '3'
+
+# 'numpy' rasterizes the QR module matrix in one step, 'pil' draws each module
+QR_RASTERIZER = os.environ.get('QR_RASTERIZER', 'numpy' if numpy is not None else 'pil')
+
+HEX_COLOR_PATTERN = re.compile(r'^#[0-9A-Fa-f]{6}$')
+
+# Geometry shared with ImageWriter so both renderers produce the same layout
+BARCODE_GEOMETRY = {
+    'module_width': 0.2,   # mm
+    'module_height': 15.0,  # mm
+    'quiet_zone': 6.5,     # mm
+    'font_size': 10,       # pt
+    'text_distance': 5.0,  # mm
+    'margin': 1.0,         # mm, above the bars and below the text
+    'dpi': 300
+}
+
+# Encoded symbols, bit-packed, so a value re-requested in another format,
+# size or color skips data encoding and only redoes the drawing. Each render
+# process keeps its own.
+symbol_cache = RenderCache(
+    max_bytes=int(os.environ.get('SYMBOL_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+    ttl=int(os.environ.get('SYMBOL_CACHE_TTL', 86400))
+)
+
+# Rough per-entry overhead of the tuple, key and bookkeeping, counted towards the cap
+SYMBOL_OVERHEAD_BYTES = 200
+
+QRSymbol = namedtuple('QRSymbol', ['version', 'size', 'bits'])
+BarSymbol = namedtuple('BarSymbol', ['length', 'line_length', 'bits', 'text', 'module_width', 'quiet_zone'])
+
+# QR versions sharing the same segment length header widths
+QR_VERSION_BANDS = ((1, 9), (10, 26), (27, 40))
+
+# A valid value per symbology, rendered when a process warms up
+WARMUP_SAMPLES = {
+    'code128': 'WARMUP-128', 'code39': 'WARMUP39', 'ean': '5901234123457', 'ean13': '5901234123457',
+    'ean8': '96385074', 'upc': '036000291452', 'upca': '036000291452', 'isbn': '9780306406157',
+    'isbn10': '0306406152', 'isbn13': '9780306406157', 'issn': '03178471', 'itf': '12345678',
+    'gs1': '9780306406157',  # python-barcode registers 'gs1' as ISBN-13
+    'gs1_128': '(01)09501101530003', 'codabar': 'A12345B', 'pzn': '123456', 'jan': '4901234567894',
+    'ean14': '12345678901231', 'gtin': '12345678901231'
+}
+
+# Encoder options of the image encoding profiles, per format. 'fast' and
+# 'small' encode PNG and WEBP losslessly and differ in compression effort; the
+# 'default' profile keeps the encoders' defaults (lossy WEBP included). WEBP
+# method 6 is left out: it takes hundreds of milliseconds for a few bytes.
+ENCODING_OPTIONS = {
+    'default': {},
+    'fast': {
+        'PNG': {'compress_level': 3},
+        'WEBP': {'lossless': True, 'quality': 25, 'method': 1},
+        'JPEG': {}
+    },
+    'small': {
+        'PNG': {'optimize': True},
+        'WEBP': {'lossless': True, 'quality': 100, 'method': 4},
+        'JPEG': {'optimize': True}
+    }
+}
+
+# Map error correction levels
+ERROR_CORRECTION_MAP = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H
+}
+
+def pack_bits(bits):
+    """Pack a string of '0'/'1' into bytes, most significant bit first (like numpy.packbits)"""
+    if not bits:
+        return b''
+    nbytes = (len(bits) + 7) // 8
+    return int(bits.ljust(nbytes * 8, '0'), 2).to_bytes(nbytes, 'big')
+
+def unpack_bits(data, length):
+    """Inverse of pack_bits: return the first ``length`` bits as a '0'/'1' string"""
+    if not length:
+        return ''
+    return bin(int.from_bytes(data, 'big'))[2:].zfill(len(data) * 8)[:length]
+
+def encode_barcode(barcode_type, text):
+    """Return the bar pattern and geometry for a value, from the symbol cache when possible"""
+    key = ('barcode', barcode_type, text)
+    symbol = symbol_cache.get(key)
+    if symbol is not None:
+        return symbol
+
+    spec = barcode.get_barcode_class(barcode_type)(text, writer=PatternWriter()).render(None)
+    pattern = ''.join(spec['modules'])
+    # Patterns are plain '0'/'1' unless a symbology draws guard bars ('G'), which are kept as text
+    bits = pack_bits(pattern) if not pattern.strip('01') else pattern
+    symbol = BarSymbol(len(pattern), len(spec['modules'][0]) if spec['modules'] else 0, bits,
+                       spec['text'], spec['module_width'], spec['quiet_zone'])
+    symbol_cache.put(key, symbol, size=len(bits) + len(text) + SYMBOL_OVERHEAD_BYTES)
+    return symbol
+
+def warm_up(samples=True):
+    """Load fonts and image codecs, and render a sample of every symbology.
+
+    Run when a process starts so the first real request does not pay for
+    font loading, codec initialization or first-call overhead in the encoders.
+    """
+    font_px = int(mm2px(pt2mm(BARCODE_GEOMETRY['font_size']), BARCODE_GEOMETRY['dpi']))
+    for char in string.digits + string.ascii_uppercase + '-()':
+        _glyph(char, font_px)
+    for image_format in ('PNG', 'WEBP', 'JPEG'):
+        Image.new('RGB', (8, 8), 'white').save(io.BytesIO(), format=image_format)
+    if not samples:
+        return
+    for barcode_type in VALID_BARCODE_TYPES:
+        for renderer in VALID_BARCODE_RENDERERS:
+            render_barcode(WARMUP_SAMPLES[barcode_type], barcode_type, 'PNG', renderer)
+    render_qr('https://barcodes.dev', 'M', 'PNG', '#000000', '#ffffff', 10, 4)
+
+def render_process_stats():
+    """Symbol cache and writer pool counters of the process this runs in"""
+    return {'symbols': symbol_cache.stats(), 'writers': writer_pool.stats()}
+
+def bar_modules(symbol):
+    """Module strings of a cached bar pattern, one per line as ``build()`` returns them"""
+    bits = symbol.bits
+    pattern = bits if isinstance(bits, str) else unpack_bits(bits, symbol.length)
+    step = symbol.line_length or len(pattern) or 1
+    return [pattern[start:start + step] for start in range(0, len(pattern), step)]
+
+def render_barcode(text, barcode_type, image_format, renderer='writer', profile='default', module_width=None,
+                   module_height=None, quiet_zone=None, dpi=None, write_text=True):
+    """Render a barcode and return the encoded image bytes.
+
+    Geometry options left as None keep the symbology's defaults, in millimetres
+    and dots per inch like python-barcode's writer options.
+    """
+    if image_format in PRINTER_FORMATS:
+        # Imported here because printer_labels builds on this module
+        from printer_labels import barcode_label
+        with stage('draw'):
+            return barcode_label(text, barcode_type, image_format, module_width, module_height, quiet_zone, dpi,
+                                 write_text)
+
+    with stage('encode'):
+        symbol = encode_barcode(barcode_type, text)
+    module_width = symbol.module_width if module_width is None else module_width
+    quiet_zone = symbol.quiet_zone if quiet_zone is None else quiet_zone
+    label = symbol.text if write_text else None
+
+    if image_format != 'SVG' and renderer == 'fast':
+        with stage('draw'):
+            img = rasterize_barcode(bar_modules(symbol), text=label, module_width=module_width,
+                                    module_height=module_height, quiet_zone=quiet_zone, dpi=dpi)
+        with stage('save'):
+            return save_image(img, image_format, profile)
+
+    geometry = {
+        'module_width': module_width,
+        'module_height': module_height or BARCODE_GEOMETRY['module_height'],
+        'quiet_zone': quiet_zone
+    }
+    if image_format != 'SVG':
+        # Vector output is laid out in millimetres and has no resolution
+        geometry['dpi'] = dpi or BARCODE_GEOMETRY['dpi']
+    buffer = io.BytesIO()
+    with writer_pool.writer(image_format, geometry) as writer:
+        writer.text = label or ''
+        with stage('draw'):
+            output = writer.render(bar_modules(symbol))
+        with stage('save'):
+            if image_format != 'SVG' and profile != 'default':
+                return save_image(output, image_format, profile)
+            writer.write(output, buffer)
+    return buffer.getvalue()
+
+class FontCachingImageWriter(ImageWriter):
+    """ImageWriter that draws text with a cached font instead of loading it from disk for every barcode"""
+
+    def _paint_text(self, xpos, ypos):
+        font = _barcode_font(int(mm2px(pt2mm(self.font_size), self.dpi)))
+        for subtext in self.text.split('\n'):
+            pos = (mm2px(xpos, self.dpi), mm2px(ypos, self.dpi))
+            self._draw.text(pos, subtext, font=font, fill=self.foreground, anchor='md')
+            ypos += pt2mm(self.font_size) / 2 + self.text_line_distance
+
+class WriterPool:
+    """Configured python-barcode writers kept for reuse, per output format and geometry.
+
+    A writer taken from the pool already has every option but the text set,
+    and draws with a cached font. Up to ``max_idle`` writers are kept per
+    geometry; the geometries used longest ago are dropped beyond ``max_geometries``.
+    """
+
+    def __init__(self, max_idle=4, max_geometries=64):
+        self.max_idle = max_idle
+        self.max_geometries = max_geometries
+        self._idle = OrderedDict()  # (format, geometry) -> idle writers
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def writer(self, image_format, geometry):
+        key = (image_format, tuple(sorted(geometry.items())))
+        with self._lock:
+            idle = self._idle.get(key)
+            writer = idle.pop() if idle else None
+            if writer is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if writer is None:
+            writer = SVGWriter() if image_format == 'SVG' else FontCachingImageWriter(format=image_format)
+            writer.set_options(dict(Barcode.default_writer_options, **geometry))
+        try:
+            yield writer
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                self._idle.move_to_end(key)
+                if len(idle) < self.max_idle:
+                    idle.append(writer)
+                while len(self._idle) > self.max_geometries:
+                    self._idle.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(writers) for writers in self._idle.values())
+            return {'geometries': len(self._idle), 'idle': idle, 'created': self.created, 'reused': self.reused}
+
+writer_pool = WriterPool()
+
+class PatternWriter(BaseWriter):
+    """Writer that draws nothing and returns what a barcode asked to be drawn.
+
+    Each symbology applies its own defaults (module width, quiet zone, human
+    readable text) in ``render()`` before calling the writer, so capturing them
+    here keeps the fast renderer's geometry in line with ImageWriter's.
+    """
+
+    def __init__(self):
+        BaseWriter.__init__(self)
+        self.write_text = True
+
+    def render(self, code):
+        return {
+            'modules': code,
+            'text': self.text if self.write_text else None,
+            'module_width': self.module_width,
+            'quiet_zone': self.quiet_zone
+        }
+
+@lru_cache(maxsize=8)
+def _barcode_font(size):
+    return ImageFont.truetype(ImageWriter().font_path, size)
+
+@lru_cache(maxsize=512)
+def _glyph(char, size):
+    """Rendered mask, left offset and advance of one character, cached across renders"""
+    font = _barcode_font(size)
+    left, top, right, bottom = font.getbbox(char, anchor='ls')
+    mask = Image.new('L', (max(1, right - left), max(1, bottom - top)), 0)
+    ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255, anchor='ls')
+    return mask, left, top, int(round(font.getlength(char)))
+
+def _paste_text(canvas, text, center_x, baseline_y, size):
+    glyphs = [_glyph(char, size) for char in text]
+    x = center_x - sum(advance for _, _, _, advance in glyphs) // 2
+    for mask, left, top, advance in glyphs:
+        canvas.paste(0, (x + left, baseline_y + top), mask)
+        x += advance
+
+def _bar_row(pattern, module_width, quiet_zone, dpi, width):
+    """One pixel row of a bar pattern, laid out like ImageWriter.
+
+    ImageWriter draws each run of modules from its left edge in millimetres
+    and truncates both edges to pixels, so at most resolutions modules are not
+    all the same number of pixels wide. Columns are filled the same way here,
+    one slice per run.
+    """
+    row = bytearray(b'\xff') * width
+    xpos = quiet_zone
+    for dark, run in groupby(pattern):
+        start = int(mm2px(xpos, dpi))
+        xpos += module_width * len(list(run))
+        end = min(int(mm2px(xpos, dpi)), width)
+        if dark != '0' and end > start:
+            row[start:end] = b'\x00' * (end - start)
+    return bytes(row)
+
+def rasterize_barcode(modules, text=None, module_width=None, module_height=None, quiet_zone=None,
+                      dpi=None, write_text=True, whole_modules=False):
+    """Rasterize a 1D bar pattern from ``build()`` into a 1-bit image.
+
+    Bars and the image size are laid out like ImageWriter's, in millimetres
+    truncated to pixels, so both renderers produce images of the same size
+    with the same bars. One pixel row is built from the bar runs and repeated
+    for the bar height, so the cost is proportional to the number of runs
+    rather than pixels drawn.
+
+    ``whole_modules`` makes every module the same whole number of pixels wide
+    instead, as label printers need; it also applies when a bar or space would
+    be narrower than a pixel, which ImageWriter cannot draw.
+    """
+    geometry = BARCODE_GEOMETRY
+    dpi = dpi or geometry['dpi']
+    module_width = module_width or geometry['module_width']
+    module_height = module_height or geometry['module_height']
+    quiet_zone = geometry['quiet_zone'] if quiet_zone is None else quiet_zone
+    margin = geometry['margin']
+    pattern = ''.join(modules)
+    narrowest_run = min((len(list(run)) for _, run in groupby(pattern)), default=1)
+
+    if whole_modules or mm2px(module_width * narrowest_run, dpi) < 1:
+        module_px = max(1, round(mm2px(module_width, dpi)))
+        quiet_px = round(mm2px(quiet_zone, dpi))
+        row = b''.join(
+            (b'\x00' if dark != '0' else b'\xff') * (len(list(run)) * module_px)
+            for dark, run in groupby(pattern)
+        )
+        row = b'\xff' * quiet_px + row + b'\xff' * quiet_px
+    else:
+        row = _bar_row(pattern, module_width, quiet_zone, dpi,
+                       int(mm2px(2 * quiet_zone + len(pattern) * module_width, dpi)))
+    width = len(row)
+
+    # ImageWriter's bar rectangles include both their top and bottom rows
+    bar_top = int(mm2px(margin, dpi))
+    bar_px = int(mm2px(margin + module_height, dpi)) - bar_top + 1
+    height_mm = 2 * margin + module_height
+    font_px = int(mm2px(pt2mm(geometry['font_size']), dpi))
+    draw_text = bool(write_text and text)
+    if draw_text:
+        height_mm += pt2mm(geometry['font_size']) / 2 + geometry['text_distance']
+    height = max(int(mm2px(height_mm, dpi)), bar_top + bar_px)
+
+    canvas = Image.new('L', (width, height), 255)
+    bar_px = min(bar_px, height - bar_top)
+    canvas.paste(Image.frombytes('L', (width, bar_px), row * bar_px), (0, bar_top))
+    if draw_text:
+        # ImageWriter anchors text at its descender line, text_distance below the bars
+        descent = _barcode_font(font_px).getmetrics()[1]
+        baseline = int(mm2px(margin + module_height + geometry['text_distance'], dpi)) - descent
+        _paste_text(canvas, text, width // 2, baseline, font_px)
+    return canvas.convert('1', dither=Image.Dither.NONE)
+
+def _qr_data_bits(data):
+    """Bits a QR data segment takes after its mode and length headers"""
+    length = len(data)
+    if data.mode == qrcode.util.MODE_NUMBER:
+        return 10 * (length // 3) + (0, 4, 7)[length % 3]
+    if data.mode == qrcode.util.MODE_ALPHA_NUM:
+        return 11 * (length // 2) + 6 * (length % 2)
+    return 8 * length
+
+def qr_version_for(data_list, error_correction):
+    """Smallest QR version that holds the data segments at an error correction level.
+
+    Data capacity per version comes from qrcode's precomputed BIT_LIMIT_TABLE.
+    The segment length headers only change width at versions 10 and 27, so the
+    required bits are computed once per band and looked up with a bisection,
+    instead of ``make(fit=True)`` encoding the data into a bit buffer to measure it.
+    """
+    limits = qrcode.util.BIT_LIMIT_TABLE[error_correction]
+    payload = sum(4 + _qr_data_bits(data) for data in data_list)
+    for first, last in QR_VERSION_BANDS:
+        length_bits = qrcode.util.mode_sizes_for_version(first)
+        needed = payload + sum(length_bits[data.mode] for data in data_list)
+        version = bisect_left(limits, needed, first, last + 1)
+        if version <= last:
+            return version
+    raise qrcode.exceptions.DataOverflowError()
+
+def encode_qr(text, error_correction, mask=None):
+    """Return the QR module matrix for a value, from the symbol cache when possible.
+
+    With ``mask`` set the mask pattern is pinned, which skips scoring all
+    eight masks; otherwise the lowest-penalty mask is chosen as usual.
+    """
+    key = ('qrcode', text, error_correction, mask)
+    symbol = symbol_cache.get(key)
+    if symbol is not None:
+        return symbol
+
+    qr = qrcode.QRCode(
+        error_correction=ERROR_CORRECTION_MAP.get(error_correction, qrcode.constants.ERROR_CORRECT_M),
+        box_size=1,
+        border=0,
+        mask_pattern=mask,
+    )
+    qr.add_data(text)
+    qr.version = qr_version_for(qr.data_list, qr.error_correction)
+    qr.make(fit=False)
+    bits = pack_bits(''.join('1' if module else '0' for row in qr.modules for module in row))
+    symbol = QRSymbol(qr.version, qr.modules_count, bits)
+    symbol_cache.put(key, symbol, size=len(bits) + len(text) + SYMBOL_OVERHEAD_BYTES)
+    return symbol
+
+def qr_matrix(symbol):
+    """Module matrix of a cached QR symbol as rows of booleans"""
+    bits = unpack_bits(symbol.bits, symbol.size * symbol.size)
+    size = symbol.size
+    return [[bit == '1' for bit in bits[start:start + size]] for start in range(0, len(bits), size)]
+
+def qr_array(symbol):
+    """Module matrix of a cached QR symbol as a NumPy uint8 array"""
+    packed = numpy.frombuffer(symbol.bits, dtype=numpy.uint8)
+    return numpy.unpackbits(packed, count=symbol.size * symbol.size).reshape(symbol.size, symbol.size)
+
+def render_qr_matrix(text, error_correction, mask=None):
+    """Encode a QR code without drawing it.
+
+    Returns the version and size in modules as one byte each, followed by the
+    module matrix row by row, one bit per module (dark is 1), most significant
+    bit first and padded to a whole byte at the end.
+    """
+    with stage('encode'):
+        symbol = encode_qr(text, error_correction, mask)
+    return bytes((symbol.version, symbol.size)) + symbol.bits
+
+def render_qr(text, error_correction, image_format, fill_color='#000000', back_color='#ffffff', box_size=10, border=4,
+              mask=None, profile='default'):
+    """Render a QR code and return the encoded image bytes"""
+    if image_format in PRINTER_FORMATS:
+        from printer_labels import qr_label
+        with stage('draw'):
+            return qr_label(text, error_correction, image_format, box_size, border, mask)
+
+    with stage('encode'):
+        symbol = encode_qr(text, error_correction, mask)
+
+    if image_format == 'SVG':
+        with stage('draw'):
+            return qr_svg(qr_matrix(symbol), box_size, border, fill_color, back_color)
+
+    with stage('draw'):
+        if QR_RASTERIZER == 'numpy' and numpy is not None and HEX_COLOR_PATTERN.match(fill_color) \
+                and HEX_COLOR_PATTERN.match(back_color):
+            img = rasterize_qr(qr_array(symbol), box_size, border, fill_color, back_color)
+        else:
+            # Create image with custom colors
+            img = draw_qr(qr_matrix(symbol), box_size, border, fill_color, back_color)
+
+    with stage('save'):
+        if image_format == 'JPEG' and profile == 'default':
+            # Convert to RGB for JPEG (remove alpha channel)
+            img = img.convert('RGB')
+        return save_image(img, image_format, profile)
+
+def save_image(img, image_format, profile='default'):
+    """Encode a rendered image with the options of an encoding profile and return the bytes"""
+    if profile != 'default' and image_format != 'WEBP':
+        # Lossless WEBP finds its own palette; PNG and JPEG need the smaller mode handed to them
+        img = compact_image(img, image_format)
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, **ENCODING_OPTIONS[profile].get(image_format, {}))
+    return buffer.getvalue()
+
+def compact_image(img, image_format):
+    """The same pixels in the smallest mode a format can store.
+
+    Black and white images become 1-bit, other images with few gray levels or
+    colors a palette image (which PNG stores at 1, 2, 4 or 8 bits per pixel).
+    JPEG has neither, so it gets grayscale whenever the image is gray.
+    """
+    if img.mode == '1' or (img.mode == 'P' and image_format != 'JPEG'):
+        return img
+    if img.mode == 'P':
+        # Gray when every palette entry in use is
+        palette = img.getpalette()
+        gray = all(palette[3 * index] == palette[3 * index + 1] == palette[3 * index + 2]
+                   for _, index in img.getcolors(256))
+        return img.convert('L' if gray else 'RGB')
+    rgb = img if img.mode in ('RGB', 'L') else img.convert('RGB')
+    colors = rgb.getcolors(256)
+    gray = colors is not None and (rgb.mode == 'L' or all(r == g == b for _, (r, g, b) in colors))
+    if image_format == 'JPEG':
+        return rgb.convert('L') if gray else rgb
+    if colors is None:
+        return img
+    if not gray:
+        # At most 256 colors: the adaptive palette holds every one of them exactly
+        return rgb.convert('P', palette=Image.Palette.ADAPTIVE, colors=len(colors))
+    gray_img = rgb.convert('L')
+    levels = sorted(level for _, level in gray_img.getcolors(256))
+    if set(levels) <= {0, 255}:
+        return gray_img.convert('1', dither=Image.Dither.NONE)
+    indexes = [0] * 256
+    for index, level in enumerate(levels):
+        indexes[level] = index
+    palette_img = Image.frombytes('P', img.size, gray_img.point(indexes).tobytes())
+    palette_img.putpalette([channel for level in levels for channel in (level, level, level)])
+    return palette_img
+
+def draw_qr(modules, box_size, border, fill_color, back_color):
+    """Draw a QR module matrix module by module, as ``QRCode.make_image()`` does"""
+    img = PilImage(border, len(modules), box_size, qrcode_modules=modules,
+                   fill_color=fill_color, back_color=back_color)
+    for r, row in enumerate(modules):
+        for c, module in enumerate(row):
+            if module:
+                img.drawrect(r, c)
+    return img
+
+def rasterize_qr(modules, box_size, border, fill_color, back_color):
+    """Rasterize a QR module matrix into a two-color palette image.
+
+    The matrix is padded with the border and block-expanded to box_size pixels
+    per module with NumPy, so no per-module drawing happens. Pixels are identical
+    to qrcode's PIL image for the same options; the palette lets PNG store the
+    result at 1 bit per pixel.
+    """
+    matrix = numpy.asarray(modules, dtype=numpy.uint8)
+    if border:
+        matrix = numpy.pad(matrix, border)
+    pixels = numpy.repeat(numpy.repeat(matrix, box_size, axis=0), box_size, axis=1)
+    height, width = pixels.shape
+    img = Image.frombytes('P', (width, height), pixels.tobytes())
+    # Palette index 0 is the background, 1 a dark module
+    img.putpalette(ImageColor.getrgb(back_color) + ImageColor.getrgb(fill_color))
+    return img
+
+def qr_svg(modules, box_size, border, fill_color, back_color):
+    """Render a QR module matrix as a compact SVG document.
+
+    Dark modules are emitted as one path with a subpath per horizontal run, in
+    module units scaled by the viewBox, so output size tracks the number of
+    runs rather than the number of modules and is identical for identical input.
+    """
+    size = len(modules) + 2 * border
+    runs = []
+    for y, row in enumerate(modules):
+        x = 0
+        count = len(row)
+        while x < count:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < count and row[x]:
+                x += 1
+            runs.append(f'M{start + border} {y + border}h{x - start}v1h-{x - start}z')
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="{escape(back_color)}"/>'
+        f'<path fill="{escape(fill_color)}" d="{"".join(runs)}"/>'
+        '</svg>\n'
+    ).encode('utf-8')
@@ -0,0 +1,52 @@
+"""Per-request timing of render stages, reported in ``Server-Timing`` headers.
+
+Rendering code wraps its stages in ``stage(name)``. Durations accumulate in a
+dict held in a context variable, so each thread, and each asyncio task of the
+ASGI server (``asgi.py``), has its own; the request reads it back with
+``collect()``. The render engine carries the timings of a job run in a pool
+process back to the thread that submitted it with ``record()``.
+Request metrics (``metrics.py``) read the same durations when a request ends.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_stages_var = ContextVar('stage_timings', default=None)
+
+def _stages():
+    stages = _stages_var.get()
+    if stages is None:
+        stages = {}
+        _stages_var.set(stages)
+    return stages
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block and add it to the current request's stages"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = _stages()
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+
+def record(timings):
+    """Add stage durations measured elsewhere (e.g. in a render process)"""
+    stages = _stages()
+    for name, seconds in timings.items():
+        stages[name] = stages.get(name, 0.0) + seconds
+
+def current():
+    """Return the current request's stage durations in seconds so far"""
+    return dict(_stages())
+
+def collect():
+    """Return the current request's stage durations in seconds and start over"""
+    stages = _stages()
+    _stages_var.set({})
+    return stages
+
+def server_timing_header(timings):
+    """Format stage durations as a Server-Timing header value (milliseconds)"""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items())
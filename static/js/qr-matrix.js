@@ -0,0 +1,71 @@
+/*
+ * Reference renderer for /api/qrcode/matrix: fetches a QR code's module
+ * matrix and draws it on a canvas, so only a few hundred bytes cross the
+ * network instead of an image.
+ *
+ *   QRMatrix.fetch('https://barcodes.dev', { error_correction: 'M' })
+ *       .then(matrix => QRMatrix.draw(canvas, matrix, { boxSize: 8, border: 4 }));
+ */
+(function (global) {
+    // Binary responses: version and size as one byte each, then the modules
+    // row by row, one bit per module (dark is 1), most significant bit first
+    function decode(buffer) {
+        const bytes = new Uint8Array(buffer);
+        const size = bytes[1];
+        return {
+            version: bytes[0],
+            size: size,
+            isDark: (row, col) => {
+                const index = row * size + col;
+                return (bytes[2 + (index >> 3)] >> (7 - (index & 7))) & 1;
+            }
+        };
+    }
+
+    function fetchMatrix(text, options) {
+        const body = Object.assign({}, options, { text: text, output: 'binary' });
+        return fetch('/api/qrcode/matrix', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        }).then(response => {
+            if (!response.ok) {
+                return response.json().then(error => { throw new Error(error.message || error.error); });
+            }
+            return response.arrayBuffer();
+        }).then(decode);
+    }
+
+    // Draws each horizontal run of dark modules as one rectangle
+    function draw(canvas, matrix, options) {
+        options = options || {};
+        const boxSize = options.boxSize || 10;
+        const border = options.border === undefined ? 4 : options.border;
+        const pixels = (matrix.size + 2 * border) * boxSize;
+        canvas.width = pixels;
+        canvas.height = pixels;
+
+        const context = canvas.getContext('2d');
+        context.fillStyle = options.back || '#ffffff';
+        context.fillRect(0, 0, pixels, pixels);
+        context.fillStyle = options.fill || '#000000';
+        for (let row = 0; row < matrix.size; row++) {
+            let col = 0;
+            while (col < matrix.size) {
+                if (!matrix.isDark(row, col)) {
+                    col++;
+                    continue;
+                }
+                const start = col;
+                while (col < matrix.size && matrix.isDark(row, col)) {
+                    col++;
+                }
+                context.fillRect((start + border) * boxSize, (row + border) * boxSize,
+                                 (col - start) * boxSize, boxSize);
+            }
+        }
+        return canvas;
+    }
+
+    global.QRMatrix = { fetch: fetchMatrix, decode: decode, draw: draw };
+})(window);
@@ -0,0 +1,494 @@
+"""Retention, partitioning and header dedupe for generation_records.
+
+User agents and request header blobs repeat across almost every row, so they
+are stored once in the ``user_agents`` and ``header_sets`` lookup tables,
+keyed by a hash of their value, and records only carry the lookup ids. The
+write-behind logger resolves them for a whole batch through a
+``LookupResolver`` before inserting it; rows written before the lookups
+existed are moved over by ``compact_lookups``.
+
+Records are kept per calendar month (UTC) in tables named
+``generation_records_YYYYMM``. On PostgreSQL these are declarative range
+partitions of ``generation_records``, created a few months ahead, with a
+default partition catching anything outside them; a table that existed
+before partitioning is attached whole as ``generation_records_legacy``.
+SQLite has no partitioning, so ``generation_records`` keeps the recent rows
+and earlier months are moved into dated tables.
+
+Months that ended more than the retention period ago are written to
+gzip-compressed NDJSON segments in the archive directory, one record per
+line with user agent and headers restored, and then dropped. The hourly
+rollups behind /api/stats are kept, so usage stats outlive the raw records.
+
+    python storage_policy.py maintain    # run daily, e.g. from cron
+    python storage_policy.py report
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, or_, select
+
+RECORDS_TABLE = 'generation_records'
+LEGACY_PARTITION = f'{RECORDS_TABLE}_legacy'
+DEFAULT_PARTITION = f'{RECORDS_TABLE}_default'
+
+# Monthly partitions created ahead of the current month on PostgreSQL
+PARTITIONS_AHEAD = 2
+
+# How long partition changes wait for their table locks; they give up rather
+# than hold up inserts queued behind them
+PARTITION_LOCK_TIMEOUT = '5s'
+
+# Lookup ids kept in memory per table, so repeated values skip the database
+LOOKUP_CACHE_SIZE = 10000
+
+# Request headers that differ on every request; leaving them out of the
+# stored header set lets requests from the same client share one lookup row
+VOLATILE_HEADERS = {'Content-Length', 'Traceparent', 'X-Cloud-Trace-Context', 'X-Request-Id',
+                    'X-Amzn-Trace-Id', 'X-Appengine-Request-Log-Id'}
+
+_MONTH_TABLE = re.compile(rf'^{RECORDS_TABLE}_(\d{{4}})(\d{{2}})$')
+_PARTITION_BOUNDS = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+def value_hash(value):
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def month_table(month):
+    return f'{RECORDS_TABLE}_{month:%Y%m}'
+
+def table_month(name):
+    """Start of the month a dated table holds, or None for any other table"""
+    match = _MONTH_TABLE.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+def insert_ignoring_duplicates(connection, table):
+    """INSERT that skips values already in a lookup table"""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table).on_conflict_do_nothing(index_elements=['value_hash'])
+
+class LookupResolver:
+    """Replaces user agent and header values in record rows by lookup table ids.
+
+    ``lookups`` maps a record field to its lookup table and the record field
+    that takes the id. New values are inserted in their own transaction, so a
+    failed record insert can be retried with the same rows.
+    """
+
+    def __init__(self, db, lookups, cache_size=LOOKUP_CACHE_SIZE):
+        self.db = db
+        self.lookups = lookups
+        self.cache_size = cache_size
+        self._caches = {field: OrderedDict() for field in lookups}
+
+    def __call__(self, rows):
+        rows = [dict(row) for row in rows]
+        for field, (table, id_field) in self.lookups.items():
+            ids = self.resolve(table, self._caches[field], {row[field] for row in rows if row.get(field)})
+            for row in rows:
+                row[id_field] = ids.get(row.get(field))
+                row[field] = None
+        return rows
+
+    def resolve(self, table, cache, values):
+        """Lookup ids of a set of values, inserting the ones the table does not have yet"""
+        ids = {}
+        missing = {}
+        for value in values:
+            key = value_hash(value)
+            if key in cache:
+                cache.move_to_end(key)
+                ids[value] = cache[key]
+            else:
+                missing[key] = value
+        if not missing:
+            return ids
+
+        with self.db.engine.begin() as connection:
+            connection.execute(insert_ignoring_duplicates(connection, table),
+                               [{'value_hash': key, 'value': value} for key, value in missing.items()])
+            found = connection.execute(
+                select(table.c.value_hash, table.c.id).where(table.c.value_hash.in_(list(missing)))).all()
+        for key, lookup_id in found:
+            ids[missing[key]] = lookup_id
+            cache[key] = lookup_id
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return ids
+
+class StoragePolicy:
+    """Partitions, rotates, compacts and archives generation_records"""
+
+    def __init__(self, db, record_table, resolver, archive_dir, retention_days=365, batch_size=5000):
+        self.db = db
+        self.record_table = record_table
+        self.resolver = resolver
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+
+    @property
+    def is_postgresql(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def _execute(self, connection, statement, **params):
+        return connection.execute(self.db.text(statement), params)
+
+    # PostgreSQL partitions
+
+    def is_partitioned(self):
+        if not self.is_postgresql:
+            return False
+        with self.db.engine.connect() as connection:
+            kind = self._execute(connection, "SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)",
+                                 name=RECORDS_TABLE).scalar()
+        return kind == 'p'
+
+    def partition_bounds(self, connection):
+        """{partition name: (lower, upper)} of generation_records; None stands for an open end"""
+        rows = self._execute(connection, """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(:name)
+        """, name=RECORDS_TABLE)
+
+        def bound(value):
+            value = value.strip("'")
+            return None if value in ('MINVALUE', 'MAXVALUE') else datetime.fromisoformat(value)
+
+        bounds = {}
+        for name, expression in rows:
+            match = _PARTITION_BOUNDS.search(expression)
+            bounds[name] = (bound(match.group(1)), bound(match.group(2))) if match else (None, None)
+        return bounds
+
+    def partition_records(self, now=None):
+        """Turn an unpartitioned generation_records into a partitioned table.
+
+        The existing table becomes the partition for everything before next
+        month, so no rows are copied; its indexes are reused as partitions of
+        the parent's indexes. Returns whether the table was converted.
+        """
+        if not self.is_postgresql:
+            return False
+        boundary = add_months(month_start(now or datetime.utcnow()), 1)
+        indexes = list(self.record_table.indexes)
+        with self.db.engine.begin() as connection:
+            kind = self._execute(connection, "SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)",
+                                 name=RECORDS_TABLE).scalar()
+            if kind != 'r':
+                return False
+            print(f"🔄 Partitioning {RECORDS_TABLE} by month...")
+            sequence = self._execute(connection, "SELECT pg_get_serial_sequence(:name, 'id')",
+                                     name=RECORDS_TABLE).scalar()
+            statements = [
+                f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'",
+                f"LOCK TABLE {RECORDS_TABLE} IN ACCESS EXCLUSIVE MODE",
+                # The partition key cannot be NULL
+                f"UPDATE {RECORDS_TABLE} SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL",
+                f"ALTER TABLE {RECORDS_TABLE} ALTER COLUMN created_at SET NOT NULL",
+                f"ALTER TABLE {RECORDS_TABLE} RENAME TO {LEGACY_PARTITION}",
+                # A primary key on a partitioned table has to include the partition key
+                f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT IF EXISTS {RECORDS_TABLE}_pkey",
+                f"ALTER TABLE {LEGACY_PARTITION} ADD PRIMARY KEY (id, created_at)",
+            ]
+            statements += [f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_legacy" for index in indexes]
+            statements += [
+                f"CREATE TABLE {RECORDS_TABLE} (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS) "
+                f"PARTITION BY RANGE (created_at)",
+                f"ALTER TABLE {RECORDS_TABLE} ADD PRIMARY KEY (id, created_at)",
+            ]
+            if sequence:
+                statements.append(f"ALTER SEQUENCE {sequence} OWNED BY {RECORDS_TABLE}.id")
+            statements += [
+                f"CREATE INDEX {index.name} ON {RECORDS_TABLE} ({', '.join(column.name for column in index.columns)})"
+                for index in indexes
+            ]
+            statements += [
+                f"ALTER TABLE {RECORDS_TABLE} ATTACH PARTITION {LEGACY_PARTITION} "
+                f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat(' ')}')",
+                f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {RECORDS_TABLE} DEFAULT",
+            ]
+            for statement in statements:
+                self._execute(connection, statement)
+        print(f"✅ {RECORDS_TABLE} partitioned; existing rows kept in {LEGACY_PARTITION}")
+        return True
+
+    def ensure_partitions(self, now=None):
+        """Create the partitions of the current month and the next few; returns the names created"""
+        if not self.is_partitioned():
+            return []
+        current = month_start(now or datetime.utcnow())
+        created = []
+        with self.db.engine.begin() as connection:
+            bounds = self.partition_bounds(connection)
+            if DEFAULT_PARTITION not in bounds:
+                self._execute(connection, f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {RECORDS_TABLE} DEFAULT")
+            covered_until = max((upper for lower, upper in bounds.values() if upper), default=None)
+
+        for offset in range(PARTITIONS_AHEAD + 1):
+            month = add_months(current, offset)
+            name = month_table(month)
+            if name in bounds or (covered_until and month < covered_until):
+                continue
+            self._create_partition(name, month, add_months(month, 1))
+            created.append(name)
+            print(f"✅ Partition {name} created")
+        return created
+
+    def _create_partition(self, name, lower, upper):
+        bound = f"FOR VALUES FROM ('{lower.isoformat(' ')}') TO ('{upper.isoformat(' ')}')"
+        where = "created_at >= :lower AND created_at < :upper"
+        with self.db.engine.begin() as connection:
+            self._execute(connection, f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'")
+            stray = self._execute(connection, f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE {where} LIMIT 1",
+                                  lower=lower, upper=upper).first()
+            if stray is None:
+                self._execute(connection, f"CREATE TABLE {name} PARTITION OF {RECORDS_TABLE} {bound}")
+                return
+            # Rows of this month landed in the default partition: move them into the new one
+            self._execute(connection, f"ALTER TABLE {RECORDS_TABLE} DETACH PARTITION {DEFAULT_PARTITION}")
+            self._execute(connection, f"CREATE TABLE {name} PARTITION OF {RECORDS_TABLE} {bound}")
+            self._execute(connection, f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {where}",
+                          lower=lower, upper=upper)
+            self._execute(connection, f"DELETE FROM {DEFAULT_PARTITION} WHERE {where}", lower=lower, upper=upper)
+            self._execute(connection, f"ALTER TABLE {RECORDS_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+
+    # SQLite dated tables
+
+    def rotate(self, now=None):
+        """Move rows of past months out of the live SQLite table into dated tables.
+
+        The month of the newest row always stays, since SQLite hands out the
+        next id from the largest one left in the table.
+        """
+        if self.is_postgresql:
+            return []
+        current = month_start(now or datetime.utcnow())
+        moved = []
+        with self.db.engine.connect() as connection:
+            newest = self._execute(connection, f"SELECT created_at FROM {RECORDS_TABLE} ORDER BY id DESC LIMIT 1"
+                                   ).scalar()
+            months = self._execute(connection, f"SELECT DISTINCT substr(created_at, 1, 7) FROM {RECORDS_TABLE} "
+                                               f"WHERE created_at < :current", current=str(current)).scalars().all()
+        if newest is None:
+            return moved
+        keep = month_start(datetime.fromisoformat(str(newest)))
+
+        for value in sorted(months):
+            month = datetime.strptime(value, '%Y-%m')
+            if month >= keep:
+                continue
+            name = month_table(month)
+            where = "created_at >= :lower AND created_at < :upper"
+            params = {'lower': str(month), 'upper': str(add_months(month, 1))}
+            with self.db.engine.begin() as connection:
+                self._execute(connection, f"CREATE TABLE IF NOT EXISTS {name} AS SELECT * FROM {RECORDS_TABLE} WHERE 0")
+                self._execute(connection, f"INSERT INTO {name} SELECT * FROM {RECORDS_TABLE} WHERE {where}", **params)
+                count = self._execute(connection, f"DELETE FROM {RECORDS_TABLE} WHERE {where}", **params).rowcount
+            moved.append(name)
+            print(f"✅ Moved {count} records to {name}")
+        return moved
+
+    # Lookup compaction
+
+    def compact_lookups(self):
+        """Move inline user agents and headers of older rows into the lookup tables; returns the rows updated"""
+        table = self.record_table
+        fields = list(self.resolver.lookups)
+        # Executed with many parameter sets, the update sets every column the rows carry
+        update = table.update().where(table.c.id == bindparam('record_id'))
+        updated = 0
+        after_id = 0
+        while True:
+            with self.db.engine.connect() as connection:
+                rows = connection.execute(
+                    select(table.c.id, *(table.c[field] for field in fields))
+                    .where(table.c.id > after_id)
+                    .where(or_(*(table.c[field].isnot(None) for field in fields)))
+                    .order_by(table.c.id).limit(self.batch_size)
+                ).mappings().all()
+            if not rows:
+                return updated
+            resolved = self.resolver(rows)
+            with self.db.engine.begin() as connection:
+                connection.execute(update, [dict(row, record_id=row.pop('id')) for row in resolved])
+            updated += len(rows)
+            after_id = rows[-1]['id']
+            print(f"🔄 Moved headers of {updated} records into the lookup tables")
+
+    # Archival
+
+    def monthly_tables(self):
+        """(table name, end of the rows it holds) for every table that can be archived"""
+        with self.db.engine.connect() as connection:
+            if self.is_postgresql:
+                return sorted((name, upper) for name, (lower, upper) in self.partition_bounds(connection).items()
+                              if upper is not None)
+            names = self._execute(connection, "SELECT name FROM sqlite_master WHERE type = 'table'").scalars()
+            return sorted((name, add_months(table_month(name), 1)) for name in names if table_month(name))
+
+    def archive(self, now=None):
+        """Write months past the retention period to NDJSON segments and drop them; returns the segments"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        segments = []
+        for name, upper in self.monthly_tables():
+            if upper > cutoff:
+                continue
+            os.makedirs(self.archive_dir, exist_ok=True)
+            path = os.path.join(self.archive_dir, f'{name}.ndjson.gz')
+            count = self.write_segment(name, path)
+            with self.db.engine.begin() as connection:
+                self._execute(connection, f"DROP TABLE {name}")
+            segments.append(path)
+            print(f"📦 Archived {count} records from {name} to {path}")
+        return segments
+
+    def write_segment(self, name, path):
+        """Write every row of a table to a gzip NDJSON file, with lookup values restored"""
+        columns = [column.name for column in self.record_table.columns]
+        lookups = {field: (table.name, id_field) for field, (table, id_field) in self.resolver.lookups.items()}
+        joins = ' '.join(f"LEFT JOIN {table} ON {table}.id = r.{id_field}" for table, id_field in lookups.values())
+        values = ', '.join(f"{table}.value AS {field}_value" for field, (table, _) in lookups.items())
+        query = f"SELECT r.*, {values} FROM {name} r {joins} ORDER BY r.id"
+
+        count = 0
+        partial = path + '.part'
+        with self.db.engine.connect().execution_options(stream_results=True) as connection, \
+                gzip.open(partial, 'wt', encoding='utf-8') as segment:
+            for row in self._execute(connection, query).mappings():
+                record = {column: row[column] for column in columns}
+                for field, (_, id_field) in lookups.items():
+                    record[field] = record[field] or row[f'{field}_value']
+                    record.pop(id_field, None)
+                if isinstance(record['qr_options'], str):
+                    record['qr_options'] = json.loads(record['qr_options'])
+                if isinstance(record['created_at'], str):
+                    record['created_at'] = datetime.fromisoformat(record['created_at'])
+                if record['success'] is not None:
+                    record['success'] = bool(record['success'])
+                segment.write(json.dumps(record, default=lambda value: value.isoformat() + 'Z') + '\n')
+                count += 1
+        # A segment only appears under its final name once it is complete
+        os.replace(partial, path)
+        return count
+
+    # Reporting
+
+    def report(self):
+        """[(table, rows, bytes)] for generation_records, its monthly tables and the lookups"""
+        like = f"{RECORDS_TABLE}%"
+        with self.db.engine.connect() as connection:
+            if self.is_postgresql:
+                rows = self._execute(connection, """
+                    SELECT c.relname, c.reltuples::bigint, pg_total_relation_size(c.oid)
+                    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = current_schema() AND c.relkind = 'r'
+                      AND (c.relname LIKE :like OR c.relname IN ('user_agents', 'header_sets'))
+                    ORDER BY c.relname
+                """, like=like).all()
+                tables = []
+                for name, count, size in rows:
+                    if count < 0:
+                        # Never analyzed: count it
+                        count = self._execute(connection, f"SELECT count(*) FROM {name}").scalar()
+                    tables.append((name, count, size))
+                return tables
+
+            names = self._execute(connection, """
+                SELECT name FROM sqlite_master
+                WHERE type = 'table' AND (name LIKE :like OR name IN ('user_agents', 'header_sets'))
+                ORDER BY name
+            """, like=like).scalars().all()
+            tables = []
+            for name in names:
+                count = self._execute(connection, f"SELECT count(*) FROM {name}").scalar()
+                try:
+                    # Pages of the table and its indexes
+                    size = self._execute(connection, """
+                        SELECT sum(pgsize) FROM dbstat
+                        WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = :name)
+                    """, name=name).scalar() or 0
+                except Exception:
+                    # SQLite built without the dbstat table
+                    size = None
+                tables.append((name, count, size))
+            return tables
+
+    def database_size(self):
+        with self.db.engine.connect() as connection:
+            if self.is_postgresql:
+                return self._execute(connection, "SELECT pg_database_size(current_database())").scalar()
+            page_count = self._execute(connection, "PRAGMA page_count").scalar()
+            page_size = self._execute(connection, "PRAGMA page_size").scalar()
+            return page_count * page_size
+
+    def print_report(self, title):
+        tables = self.report()
+        print(f"📁 {title}")
+        for name, count, size in tables:
+            per_row = f" ({size / count:.0f} B/record)" if size and count and name.startswith(RECORDS_TABLE) else ''
+            print(f"   {name:<32} {count:>12,} rows  {format_bytes(size) if size is not None else '?':>10}{per_row}")
+        print(f"   {'database':<32} {'':>17}  {format_bytes(self.database_size()):>10}")
+        return tables
+
+    def maintain(self, now=None):
+        """Everything a daily run does: partitions, rotation, lookup compaction and archival"""
+        now = now or datetime.utcnow()
+        before = self.print_report('Before maintenance')
+        if self.is_postgresql:
+            self.partition_records(now)
+            self.ensure_partitions(now)
+        self.compact_lookups()
+        self.rotate(now)
+        segments = self.archive(now)
+        if not self.is_postgresql:
+            # Give the pages of dropped tables and moved headers back to the file system
+            with self.db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                self._execute(connection, "VACUUM")
+        after = self.print_report('After maintenance')
+
+        def total(tables):
+            return sum(size or 0 for name, count, size in tables)
+        print(f"✅ Maintenance complete: {len(segments)} months archived, "
+              f"{format_bytes(total(before))} -> {format_bytes(total(after))}")
+        return segments
+
+def main():
+    parser = argparse.ArgumentParser(description='Retention and storage maintenance for generation_records')
+    parser.add_argument('command', choices=['maintain', 'report'])
+    args = parser.parse_args()
+
+    from app import app, rollup_compactor, storage_policy
+    with app.app_context():
+        if args.command == 'report':
+            storage_policy.print_report('Storage report')
+            return
+        # Rows must be in the hourly rollups before they leave the live table
+        rollup_compactor.compact()
+        rollup_compactor.compact()
+        storage_policy.maintain()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The application modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set before app is imported, so tests never touch a developer's instance/ database
+_database_dir = tempfile.mkdtemp(prefix='barcode-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_database_dir, 'records.db')}"
+# Registered before app's own handlers, so it runs after the log writer's last flush
+atexit.register(shutil.rmtree, _database_dir, True)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """The app module, with the tables of the test database created"""
+    import app
+    with app.app.app_context():
+        app.init_db()
+    return app
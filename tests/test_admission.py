@@ -0,0 +1,38 @@
+"""Token bucket slots and the address rate limits are keyed on."""
+
+from admission import TokenBuckets, client_key
+
+
+def _crowd(buckets, count):
+    """Clients whose keys all probe from the same slot"""
+    clients = []
+    index = 0
+    while len(clients) < count:
+        client = f'10.0.0.{index}'
+        if client_key(client) % buckets.slots == 0:
+            clients.append(client)
+        index += 1
+    return clients
+
+
+def test_busy_slot_is_not_taken_over():
+    buckets = TokenBuckets(rate=1, burst=10, slots=16)
+    *holders, newcomer = _crowd(buckets, 9)
+    for client in holders:
+        assert buckets.take(client, 10, now=0) == 0
+    # Every probed slot is still paying back, so the newcomer waits for the first to refill
+    assert buckets.take(newcomer, 1, now=4) == 6
+    # and the holders keep their empty buckets
+    assert buckets.take(holders[0], 10, now=4) == 6
+    # Once refilled, a slot goes to the newcomer
+    assert buckets.take(newcomer, 1, now=10) == 0
+
+
+def test_rate_limit_ignores_client_forwarded_for(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'rate_limiter', TokenBuckets(rate=1, burst=1))
+    client = app_module.app.test_client()
+    statuses = [
+        client.post('/api/barcode', json={'text': 'A'}, headers={'X-Forwarded-For': f'192.0.2.{index}'}).status_code
+        for index in range(2)
+    ]
+    assert statuses == [200, 429]
@@ -0,0 +1,81 @@
+"""The fast barcode renderer against python-barcode's ImageWriter.
+
+Both renderers must produce images of the same size whose bars and spaces
+agree at every module centre, for every symbology the API accepts.
+"""
+
+import io
+
+import pytest
+from barcode.writer import mm2px
+from PIL import Image
+
+import rendering
+from validation import VALID_BARCODE_TYPES
+
+GEOMETRIES = [
+    {},
+    {'dpi': 203},
+    {'dpi': 600},
+    {'module_width': 0.254, 'module_height': 8.0, 'quiet_zone': 2.0, 'dpi': 203},
+    {'module_width': 0.33, 'dpi': 150}
+]
+
+def _render(barcode_type, renderer, geometry, write_text=True):
+    data = rendering.render_barcode(rendering.WARMUP_SAMPLES[barcode_type], barcode_type, 'PNG', renderer,
+                                    write_text=write_text, **geometry)
+    return Image.open(io.BytesIO(data)).convert('L')
+
+def _module_centres(barcode_type, geometry):
+    """(x pixel, dark) at the centre of every module of the sample value"""
+    symbol = rendering.encode_barcode(barcode_type, rendering.WARMUP_SAMPLES[barcode_type])
+    module_width = geometry.get('module_width', symbol.module_width)
+    quiet_zone = geometry.get('quiet_zone', symbol.quiet_zone)
+    dpi = geometry.get('dpi', rendering.BARCODE_GEOMETRY['dpi'])
+    pattern = ''.join(rendering.bar_modules(symbol))
+    centres = []
+    for index, module in enumerate(pattern):
+        # The middle of the pixels the module covers once its edges are
+        # truncated; modules narrower than a pixel may cover none
+        start = int(mm2px(quiet_zone + index * module_width, dpi))
+        end = int(mm2px(quiet_zone + (index + 1) * module_width, dpi))
+        if end > start:
+            centres.append(((start + end - 1) // 2, module != '0'))
+    return centres
+
+def _bar_row(geometry):
+    """A pixel row halfway down the bars"""
+    dpi = geometry.get('dpi', rendering.BARCODE_GEOMETRY['dpi'])
+    margin = rendering.BARCODE_GEOMETRY['margin']
+    module_height = geometry.get('module_height', rendering.BARCODE_GEOMETRY['module_height'])
+    return int(mm2px(margin + module_height / 2, dpi))
+
+@pytest.mark.parametrize('geometry', GEOMETRIES, ids=lambda geometry: ','.join(f'{k}={v}' for k, v in geometry.items()))
+@pytest.mark.parametrize('barcode_type', VALID_BARCODE_TYPES)
+def test_same_size_and_modules_as_image_writer(barcode_type, geometry):
+    fast = _render(barcode_type, 'fast', geometry)
+    writer = _render(barcode_type, 'writer', geometry)
+    assert fast.size == writer.size
+
+    y = _bar_row(geometry)
+    for x, dark in _module_centres(barcode_type, geometry):
+        assert (fast.getpixel((x, y)) < 128) == dark, f'module at x={x}'
+        assert (writer.getpixel((x, y)) < 128) == dark, f'module at x={x}'
+
+@pytest.mark.parametrize('barcode_type', VALID_BARCODE_TYPES)
+def test_bar_rows_match_image_writer(barcode_type):
+    fast = _render(barcode_type, 'fast', {}, write_text=False)
+    writer = _render(barcode_type, 'writer', {}, write_text=False)
+    assert fast.size == writer.size
+    for y in range(writer.height):
+        fast_row = [fast.getpixel((x, y)) < 128 for x in range(fast.width)]
+        writer_row = [writer.getpixel((x, y)) < 128 for x in range(writer.width)]
+        assert fast_row == writer_row, f'row {y}'
+
+def test_whole_modules_for_printers():
+    symbol = rendering.encode_barcode('code128', 'ABC')
+    img = rendering.rasterize_barcode(rendering.bar_modules(symbol), module_width=0.2, quiet_zone=0, dpi=203,
+                                      whole_modules=True)
+    pattern = ''.join(rendering.bar_modules(symbol))
+    # 0.2 mm is 1.6 dots at 203 dpi, rounded to 2 for every module
+    assert img.width == 2 * len(pattern)
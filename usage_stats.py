@@ -0,0 +1,227 @@
+"""Hourly usage rollups of generation_records and the queries behind /api/stats.
+
+A compactor folds new ``generation_records`` rows into one rollup row per
+hour, code type, symbology and image format: the number of attempts, the
+number of failures and a HyperLogLog sketch of the client IPs. Sketches merge
+by taking the larger register, so distinct IPs over any range and grouping are
+estimated from the rollups alone (about 3% error) and stats queries never
+touch the raw table.
+
+Rows are read by id after a watermark kept in ``generation_rollup_state``.
+Every batch first moves the watermark with a conditional update in the same
+transaction as its rollup changes, so compactors in several workers take turns
+instead of counting a row twice. Ids are handed out before the inserting
+transaction commits, so each run only reads up to the highest id the previous
+run saw; a row shows up in the rollups within two compaction intervals.
+"""
+
+import hashlib
+import math
+import os
+import threading
+from datetime import datetime
+from validation import STATS_FIELDS
+
+SKETCH_PRECISION = 10
+SKETCH_REGISTERS = 1 << SKETCH_PRECISION
+_HASH_BITS = 64 - SKETCH_PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / SKETCH_REGISTERS)
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(_HASH_BITS + 2)]
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def ip_sketch(ips):
+    """HyperLogLog registers of a set of IP addresses"""
+    registers = bytearray(SKETCH_REGISTERS)
+    for ip in ips:
+        hashed = int.from_bytes(hashlib.blake2b((ip or '').encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> _HASH_BITS
+        rank = _HASH_BITS - (hashed & ((1 << _HASH_BITS) - 1)).bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+    return bytes(registers)
+
+def merge_sketches(sketches):
+    """Union of several sketches: the largest value of every register"""
+    sketches = list(sketches)
+    if len(sketches) <= 1:
+        return sketches[0] if sketches else None
+    # Imported here so that importing the app does not load NumPy
+    try:
+        import numpy
+    except ImportError:  # Merged in pure Python instead
+        return bytes(map(max, *sketches))
+    registers = numpy.frombuffer(b''.join(sketches), dtype=numpy.uint8).reshape(len(sketches), SKETCH_REGISTERS)
+    return registers.max(axis=0).tobytes()
+
+def estimate_distinct(sketch):
+    if not sketch:
+        return 0
+    estimate = _ALPHA * SKETCH_REGISTERS * SKETCH_REGISTERS / sum(_INVERSE_POWERS[rank] for rank in sketch)
+    empty = sketch.count(0)
+    if estimate <= 2.5 * SKETCH_REGISTERS and empty:
+        # Small cardinalities: linear counting is more accurate
+        estimate = SKETCH_REGISTERS * math.log(SKETCH_REGISTERS / empty)
+    return int(round(estimate))
+
+class RollupCompactor:
+    """Folds new generation records into the hourly rollups from a background thread"""
+
+    def __init__(self, app, db, record_model, rollup_model, state_model, interval=60.0, batch_size=20000):
+        self.app = app
+        self.db = db
+        self.record_model = record_model
+        self.rollup_model = rollup_model
+        self.state_model = state_model
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.runs = 0
+        self.folded = 0
+        self.last_error = None
+
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._stopping = None
+
+    def start(self):
+        """Start the compaction thread of this process, if it is not running yet"""
+        if self._pid == os.getpid() or self.interval <= 0:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping = threading.Event()
+            threading.Thread(target=self._run, name='rollup-compactor', daemon=True).start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        if self._pid == os.getpid():
+            self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.compact()
+                except Exception as e:
+                    # e.g. the database is unreachable; try again on the next run
+                    self.db.session.rollback()
+                    self.last_error = str(e)
+                    print(f"❌ Rollup compaction failed: {e}")
+
+    def _state(self):
+        State = self.state_model
+        state = self.db.session.get(State, 1)
+        if state is None:
+            try:
+                self.db.session.add(State(id=1, last_id=0, seen_id=0, updated_at=datetime.utcnow()))
+                self.db.session.commit()
+            except Exception:
+                # Another worker created it first
+                self.db.session.rollback()
+            state = self.db.session.get(State, 1)
+        return state
+
+    def compact(self):
+        """Fold every row up to the highest id seen by the previous run; returns the rows folded"""
+        State, Record = self.state_model, self.record_model
+        state = self._state()
+        last_id, target = state.last_id, state.seen_id
+        newest = self.db.session.query(self.db.func.max(Record.id)).scalar() or 0
+        self.db.session.commit()
+
+        folded = 0
+        while last_id < target:
+            upper = min(target, last_id + self.batch_size)
+            # Claim the batch first: a compactor that lost the race updates nothing and backs off
+            claimed = State.query.filter_by(id=1, last_id=last_id).update(
+                {'last_id': upper, 'updated_at': datetime.utcnow()}, synchronize_session=False)
+            if not claimed:
+                self.db.session.rollback()
+                return folded
+            folded += self._fold(last_id, upper)
+            self.db.session.commit()
+            last_id = upper
+
+        State.query.filter_by(id=1, seen_id=target).update({'seen_id': max(newest, target)},
+                                                           synchronize_session=False)
+        self.db.session.commit()
+        self.runs += 1
+        self.folded += folded
+        return folded
+
+    def _fold(self, after_id, upper_id):
+        """Add the records with after_id < id <= upper_id to their rollup rows"""
+        Record, Rollup = self.record_model, self.rollup_model
+        rows = self.db.session.query(
+            Record.created_at, Record.code_type, Record.barcode_symbology, Record.image_format,
+            Record.ip_address, Record.success
+        ).filter(Record.id > after_id, Record.id <= upper_id).all()
+
+        groups = {}
+        for created_at, code_type, symbology, image_format, ip_address, success in rows:
+            key = (floor_hour(created_at or datetime.utcnow()), code_type, symbology or '', image_format or 'PNG')
+            group = groups.setdefault(key, [0, 0, set()])
+            group[0] += 1
+            group[1] += 0 if success else 1
+            group[2].add(ip_address)
+
+        now = datetime.utcnow()
+        for (hour, code_type, symbology, image_format), (total, failures, ips) in groups.items():
+            rollup = self.db.session.get(Rollup, (hour, code_type, symbology, image_format))
+            if rollup is None:
+                self.db.session.add(Rollup(hour=hour, code_type=code_type, barcode_symbology=symbology,
+                                           image_format=image_format, total=total, failures=failures,
+                                           ip_sketch=ip_sketch(ips), updated_at=now))
+                continue
+            rollup.total += total
+            rollup.failures += failures
+            rollup.ip_sketch = merge_sketches([rollup.ip_sketch, ip_sketch(ips)])
+            rollup.updated_at = now
+        return len(rows)
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'folded': self.folded,
+            'last_error': self.last_error
+        }
+
+def query_stats(db, rollup_model, start, end, granularity='hour', group_by=(), filters=None):
+    """Usage between ``start`` and ``end`` (hour aligned) from the rollups, bucketed and grouped"""
+    Rollup = rollup_model
+    columns = [Rollup.hour, Rollup.total, Rollup.failures, Rollup.ip_sketch]
+    columns += [getattr(Rollup, STATS_FIELDS[field]) for field in group_by]
+    query = db.session.query(*columns).filter(Rollup.hour >= start, Rollup.hour < end)
+    for field, value in (filters or {}).items():
+        query = query.filter(getattr(Rollup, STATS_FIELDS[field]) == value)
+
+    buckets = {}
+    totals = [0, 0, []]
+    for hour, total, failures, sketch, *values in query:
+        if granularity == 'hour':
+            bucket = hour
+        elif granularity == 'day':
+            bucket = hour.replace(hour=0)
+        else:
+            bucket = start
+        for entry in (buckets.setdefault((bucket, *values), [0, 0, []]), totals):
+            entry[0] += total
+            entry[1] += failures
+            entry[2].append(sketch)
+
+    def summary(entry):
+        total, failures, sketches = entry
+        return {'total': total, 'failures': failures, 'distinct_ips': estimate_distinct(merge_sketches(sketches))}
+
+    series = []
+    for (bucket, *values), entry in sorted(buckets.items()):
+        row = {'start': bucket.isoformat() + 'Z'}
+        # QR codes are stored without a symbology
+        row.update((field, value or None) for field, value in zip(group_by, values))
+        row.update(summary(entry))
+        series.append(row)
+    return {'totals': summary(totals), 'buckets': series}
@@ -0,0 +1,577 @@
+"""Parameter validation shared by the API endpoints and the index page forms"""
+
+import base64
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+VALID_BARCODE_TYPES = [
+    'code128', 'code39', 'ean', 'ean13', 'ean8', 'upc', 'upca',
+    'isbn', 'isbn10', 'isbn13', 'issn', 'itf', 'gs1', 'gs1_128',
+    'codabar', 'pzn', 'jan', 'ean14', 'gtin'
+]
+# ZPL and EPL are label printer commands rather than images
+PRINTER_FORMATS = ['ZPL', 'EPL']
+VALID_IMAGE_FORMATS = ['PNG', 'JPEG', 'WEBP', 'SVG'] + PRINTER_FORMATS
+# image_format=auto picks from these by the request's Accept header, smallest
+# first for two-color images encoded with the 'fast' or 'small' profile
+AUTO_IMAGE_FORMAT = 'AUTO'
+AUTO_IMAGE_FORMATS = [('WEBP', 'image/webp'), ('PNG', 'image/png'), ('JPEG', 'image/jpeg')]
+VALID_ERROR_CORRECTIONS = ['L', 'M', 'Q', 'H']
+# 'fast' rasterizes the bar pattern directly, 'writer' draws with python-barcode's ImageWriter
+VALID_BARCODE_RENDERERS = ['fast', 'writer']
+# Inclusive limits of the optional barcode geometry parameters: bar and module
+# sizes in millimetres, and resolution in dots per inch
+BARCODE_GEOMETRY_RANGES = {'module_width': (0.05, 1.0), 'module_height': (1.0, 50.0), 'quiet_zone': (0.0, 20.0),
+                           'dpi': (72, 600)}
+# Inclusive limits of the QR box_size and border parameters
+QR_BOX_SIZE_RANGE = (1, 50)
+QR_BORDER_RANGE = (0, 20)
+# Digits the largest QR code holds at each error correction level
+QR_MAX_DIGITS = {'L': 7089, 'M': 5596, 'Q': 3993, 'H': 3057}
+
+# Server-wide QR profile: 'fast' pins the mask pattern of requests that do not
+# choose one, skipping the scoring of all eight masks
+QR_PROFILE = os.environ.get('QR_PROFILE', 'default')
+QR_PROFILE_MASKS = {'default': None, 'fast': 0}
+QR_DEFAULT_MASK = QR_PROFILE_MASKS.get(QR_PROFILE)
+
+# Image encoding profiles: 'default' encodes images as drawn with the encoders'
+# default options; 'fast' and 'small' store the same pixels at the lowest bit
+# depth the format allows, losslessly for PNG and WEBP, with the least and the
+# most compression effort. IMAGE_PROFILE applies to requests that do not choose.
+VALID_ENCODING_PROFILES = ['default', 'fast', 'small']
+IMAGE_PROFILE = os.environ.get('IMAGE_PROFILE', 'default')
+
+# GET endpoint URLs: file extensions and the image formats they name, the
+# geometry query parameters of /api/barcode/<symbology>/<value>.<ext>, and the
+# query parameters of /api/qrcode/<ecc>/<value>.<ext> with the fields they set
+URL_EXTENSIONS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'svg': 'SVG', 'zpl': 'ZPL', 'epl': 'EPL'}
+BARCODE_URL_GEOMETRY = (*BARCODE_GEOMETRY_RANGES, 'write_text')
+QR_URL_PARAMS = {'box_size': 'box_size', 'border': 'border', 'fill': 'fill_color', 'back': 'back_color',
+                 'mask': 'mask', 'profile': 'profile'}
+
+# QR module matrices (/api/qrcode/matrix): response bodies by output, and the
+# image_format their generation records are logged with
+QR_MATRIX_OUTPUTS = {'json': 'application/json', 'binary': 'application/octet-stream'}
+QR_MATRIX_FORMAT = 'MATRIX'
+
+# Label sheets: page sizes in millimetres and output formats
+SHEET_PAGE_SIZES = {'A4': (210.0, 297.0), 'LETTER': (215.9, 279.4)}
+SHEET_OUTPUTS = ['PDF', 'PNG']
+
+# Usage stats: bucket sizes, the fields results can be filtered and grouped by
+# (and the rollup columns they read), and how far one query may reach
+STATS_GRANULARITIES = ['hour', 'day', 'total']
+STATS_FIELDS = {'code_type': 'code_type', 'symbology': 'barcode_symbology', 'image_format': 'image_format'}
+STATS_MAX_DAYS = 366
+STATS_MAX_HOURLY_DAYS = 31
+
+# Basic hex color validation
+COLOR_PATTERN = re.compile(r'^#[0-9A-Fa-f]{6}$')
+
+_NOT_PROVIDED = object()
+
+def file_extension(image_format):
+    """Return the file extension used for an image format"""
+    file_ext = image_format.lower()
+    if file_ext == 'jpeg':
+        file_ext = 'jpg'
+    return file_ext
+
+def mimetype_for(image_format):
+    """Return the response mimetype used for an image format"""
+    if image_format.upper() == 'SVG':
+        return 'image/svg+xml'
+    if image_format.upper() in PRINTER_FORMATS:
+        return f'application/x-{image_format.lower()}'
+    return f'image/{file_extension(image_format)}'
+
+def negotiate_image_format(accept):
+    """Smallest raster format among those the client prefers most.
+
+    ``accept`` holds the (mimetype, quality) pairs of an Accept header. PNG is
+    also accepted through a wildcard; other formats have to be named. Without
+    an Accept header the answer is PNG.
+    """
+    qualities = {}
+    for mimetype, quality in accept or ():
+        mimetype = mimetype.lower()
+        qualities[mimetype] = max(quality, qualities.get(mimetype, 0))
+    wildcard = max(qualities.get('image/*', 0), qualities.get('*/*', 0))
+    best, best_quality = 'PNG', 0
+    for image_format, mimetype in AUTO_IMAGE_FORMATS:
+        quality = qualities.get(mimetype, wildcard if image_format == 'PNG' else 0)
+        if quality > best_quality:
+            best, best_quality = image_format, quality
+    return best
+
+def has_encoding_profiles(image_format):
+    """Whether an output format is a raster image that encoding profiles apply to"""
+    return image_format != 'SVG' and image_format not in PRINTER_FORMATS
+
+def wants_negotiation(data):
+    """Whether a request asks for image_format=auto, so its response varies with Accept"""
+    return str(data.get('image_format', '')).upper() == AUTO_IMAGE_FORMAT
+
+class ParameterError(Exception):
+    """A request parameter failed validation.
+
+    ``context`` holds the keyword arguments used to log the failed attempt.
+    """
+
+    def __init__(self, error, message, provided=_NOT_PROVIDED, **context):
+        super().__init__(error)
+        self.error = error
+        self.message = message
+        self.provided = provided
+        self.context = context
+
+    @property
+    def log_message(self):
+        if self.provided is _NOT_PROVIDED:
+            return self.error
+        return f'{self.error}: {self.provided}'
+
+    def to_dict(self):
+        body = {'error': self.error, 'message': self.message}
+        if self.provided is not _NOT_PROVIDED:
+            body['provided'] = self.provided
+        return body
+
+def _text_param(data):
+    return str(data.get('text') or '').strip()
+
+def _negotiated(data, accept):
+    """Request data with image_format=auto resolved from the Accept header pairs"""
+    negotiated = dict(data, image_format=negotiate_image_format(accept))
+    if IMAGE_PROFILE == 'default' and not data.get('profile'):
+        # The size ranking of AUTO_IMAGE_FORMATS only holds for compact encodings
+        negotiated['profile'] = 'small'
+    return negotiated
+
+# Request schemas list the parameters of a generation request in the order they
+# are validated, as (name, default, check). The checks are built once, below:
+# each takes a value (the default when the parameter is missing or empty) and
+# the logging context of a failure, and returns the normalized value, or None
+# to leave an optional parameter out.
+
+def _required_text(value, context):
+    text = str(value).strip()
+    if not text:
+        raise ParameterError('Missing required parameter: text',
+                             'The text parameter is required and cannot be empty', **context)
+    return text
+
+def _choice(name, choices, normalize=None):
+    """Check for one of ``choices``, compared after ``normalize``"""
+    allowed = frozenset(choices)
+    error = f'Invalid {name}'
+    message = f'{name} must be one of: {", ".join(choices)}'
+
+    def check(value, context):
+        normalized = normalize(value) if normalize else value
+        if not isinstance(normalized, str) or normalized not in allowed:
+            raise ParameterError(error, message, value, **context)
+        return normalized
+    return check
+
+def _number(name, limits, cast=float, places=None, message=None, not_number=None):
+    """Check for a number within inclusive ``limits``, rounded to ``places`` decimals.
+
+    ``message`` replaces both default messages; ``not_number`` is the (error,
+    message) pair reported, without the value, when it is not a number.
+    """
+    minimum, maximum = limits
+    error = f'Invalid {name}'
+    range_message = message or f'{name} must be between {minimum} and {maximum}'
+    number_message = message or f'{name} must be a number between {minimum} and {maximum}'
+
+    def check(value, context):
+        try:
+            number = cast(value)
+        except (ValueError, TypeError):
+            if not_number:
+                raise ParameterError(*not_number, **context)
+            raise ParameterError(error, number_message, value, **context)
+        if not (minimum <= number <= maximum):
+            raise ParameterError(error, range_message, number, **context)
+        return number if places is None else round(number, places)
+    return check
+
+def _color(name, example):
+    message = f'{name} must be a valid hex color (e.g., {example})'
+
+    def check(value, context):
+        if not COLOR_PATTERN.match(str(value)):
+            raise ParameterError(f'Invalid {name}', message, value, **context)
+        return str(value).lower()
+    return check
+
+def _write_text(value, context):
+    flag = str(value).lower()
+    if flag not in ('true', 'false', '1', '0'):
+        raise ParameterError('Invalid write_text', 'write_text must be true or false', value, **context)
+    # Drawing the text is the default, so only False is kept
+    return False if flag in ('false', '0') else None
+
+BARCODE_SCHEMA = (
+    ('text', '', _required_text),
+    ('barcode_type', 'code128', _choice('barcode_type', VALID_BARCODE_TYPES)),
+    ('image_format', 'PNG', _choice('image_format', VALID_IMAGE_FORMATS, lambda value: str(value).upper())),
+    ('renderer', 'fast', _choice('renderer', VALID_BARCODE_RENDERERS)),
+    ('profile', IMAGE_PROFILE, _choice('profile', VALID_ENCODING_PROFILES)),
+    # Micrometres are the finest step that matters at 600 dpi
+    *((name, None, _number(name, limits, int, None) if name == 'dpi' else _number(name, limits, float, 3))
+      for name, limits in BARCODE_GEOMETRY_RANGES.items()),
+    ('write_text', None, _write_text)
+)
+
+QR_SCHEMA = (
+    ('text', '', _required_text),
+    ('error_correction', 'M', _choice('error_correction', VALID_ERROR_CORRECTIONS)),
+    ('image_format', 'PNG', _choice('image_format', VALID_IMAGE_FORMATS, lambda value: str(value).upper())),
+    ('box_size', 10, _number('box_size', QR_BOX_SIZE_RANGE, int,
+                             not_number=('Invalid numeric parameter', 'box_size and border must be valid integers'))),
+    ('border', 4, _number('border', QR_BORDER_RANGE, int,
+                          not_number=('Invalid numeric parameter', 'box_size and border must be valid integers'))),
+    ('fill_color', '#000000', _color('fill_color', '#000000')),
+    ('back_color', '#ffffff', _color('back_color', '#ffffff')),
+    ('mask', QR_DEFAULT_MASK, _number('mask', (0, 7), int, message='mask must be an integer between 0 and 7')),
+    ('profile', IMAGE_PROFILE, _choice('profile', VALID_ENCODING_PROFILES))
+)
+# QR parameters logged with a failed attempt
+QR_LOGGED_OPTIONS = ('error_correction', 'fill_color', 'back_color', 'box_size', 'border')
+
+def _param(data, name, default):
+    """A request parameter, or its default when it is missing or empty"""
+    value = data.get(name)
+    return default if value is None or value == '' else value
+
+def _validate(schema, data, context):
+    """Normalized values of the parameters a request sets; the first failing check raises ParameterError"""
+    values = {}
+    for name, default, check in schema:
+        value = _param(data, name, default)
+        if value is not None:
+            value = check(value, context)
+            if value is not None:
+                values[name] = value
+    return values
+
+def gs1_check_digit(digits):
+    """Mod 10 check digit of EAN, UPC and GTIN numbers"""
+    total = sum(int(digit) * (3 if index % 2 == 0 else 1) for index, digit in enumerate(reversed(digits)))
+    return str(-total % 10)
+
+def isbn10_check_digit(digits):
+    remainder = sum(weight * int(digit) for weight, digit in enumerate(digits, start=1)) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+def issn_check_digit(digits):
+    remainder = -sum(weight * int(digit) for weight, digit in zip(range(8, 1, -1), digits)) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+def pzn_check_digit(digits):
+    """PZN check digit, or None for the numbers that have none"""
+    remainder = sum(weight * int(digit) for weight, digit in enumerate(digits, start=2)) % 11
+    return None if remainder == 10 else str(remainder)
+
+# Values each symbology accepts, checked before a barcode is built: a pattern
+# the whole value must match, what it describes, and for numbers that may be
+# sent with their check digit, the function computing it. python-barcode
+# recomputes check digits and drops extra digits, so a wrong check digit would
+# otherwise change the number silently. ISBN and ISSN hyphens are ignored.
+_GS1_128_RULE = (r'[\x00-\x7f\xf1-\xf4]+', 'ASCII characters', None)
+_EAN13_RULE = (r'(\d{12})(\d)?', '12 digits, or 13 with the check digit', gs1_check_digit)
+_ISBN13_RULE = (r'(97(?:8\d|9[18])\d{8})(\d)?',
+                '12 digits starting with 978, 9791 or 9798, or 13 with the check digit', gs1_check_digit)
+_UPC_RULE = (r'(\d{11})(\d)?', '11 digits, or 12 with the check digit', gs1_check_digit)
+_GTIN_RULE = (r'(\d{13})(\d)?', '13 digits, or 14 with the check digit', gs1_check_digit)
+SYMBOLOGY_RULES = {
+    'code128': _GS1_128_RULE,
+    'gs1_128': _GS1_128_RULE,
+    'code39': (r'[0-9A-Za-z\-. $/+%]+', 'letters, digits, spaces and - . $ / + %', None),
+    'ean': _EAN13_RULE,
+    'ean13': _EAN13_RULE,
+    'jan': (r'(4[59]\d{10})(\d)?', '12 digits starting with 45 or 49, or 13 with the check digit', gs1_check_digit),
+    'isbn': _ISBN13_RULE,
+    'isbn13': _ISBN13_RULE,
+    'gs1': _ISBN13_RULE,  # python-barcode registers 'gs1' as ISBN-13
+    'ean8': (r'(\d{7})(\d)?', '7 digits, or 8 with the check digit', gs1_check_digit),
+    'upc': _UPC_RULE,
+    'upca': _UPC_RULE,
+    'ean14': _GTIN_RULE,
+    'gtin': _GTIN_RULE,
+    'isbn10': (r'(\d{9})([\dXx])?', '9 digits, or 10 with the check digit (0-9 or X)', isbn10_check_digit),
+    'issn': (r'(\d{7})([\dXx])?', '7 digits, or 8 with the check digit (0-9 or X)', issn_check_digit),
+    'pzn': (r'(\d{6})(\d)?', '6 digits, or 7 with the check digit', pzn_check_digit),
+    'itf': (r'\d+', 'digits', None),
+    'codabar': (r'[A-D](?:[0-9\-$:/.+]*[A-D])?', 'digits and - $ : / . + between the start and stop characters A-D',
+                None)
+}
+HYPHENATED_SYMBOLOGIES = {'isbn', 'isbn13', 'gs1', 'isbn10', 'issn'}
+_SYMBOLOGY_PATTERNS = {barcode_type: (re.compile(pattern), description, check_digit)
+                       for barcode_type, (pattern, description, check_digit) in SYMBOLOGY_RULES.items()}
+
+def check_symbology(text, barcode_type, context):
+    """Reject values a symbology cannot encode as given; raises ParameterError"""
+    pattern, description, check_digit = _SYMBOLOGY_PATTERNS[barcode_type]
+    match = pattern.fullmatch(text.replace('-', '') if barcode_type in HYPHENATED_SYMBOLOGIES else text)
+    if match is None:
+        raise ParameterError('Invalid text', f'{barcode_type} values are {description}', text, **context)
+    if check_digit is None:
+        return
+    digits, given = match.groups()
+    expected = check_digit(digits)
+    if expected is None:
+        raise ParameterError('Invalid text', f'{digits} has no {barcode_type} check digit', text, **context)
+    if given is not None and given.upper() != expected:
+        raise ParameterError('Invalid check digit', f'The check digit of {digits} is {expected}, not {given}', text,
+                             **context)
+
+def parse_barcode_params(data, accept=None):
+    """Validate barcode API parameters and return the normalized render parameters.
+
+    ``accept`` holds the request's Accept header pairs, used by image_format=auto.
+    """
+    if wants_negotiation(data):
+        data = _negotiated(data, accept)
+    context = {'code_value': _text_param(data) or '[empty]', 'barcode_symbology': _param(data, 'barcode_type', 'code128'),
+               'image_format': _param(data, 'image_format', 'PNG')}
+    params = _validate(BARCODE_SCHEMA, data, context)
+    check_symbology(params['text'], params['barcode_type'], context)
+
+    image_format = params['image_format']
+    if image_format == 'SVG':
+        # Vector output always comes from python-barcode's SVGWriter
+        params['renderer'] = 'writer'
+        params.pop('dpi', None)
+    elif image_format in PRINTER_FORMATS:
+        # Printers draw their own bars; graphic fields come from the fast rasterizer
+        params['renderer'] = 'fast'
+    # Left out for the default profile, so its cache keys and ETags stay as they were
+    if params['profile'] == 'default' or not has_encoding_profiles(image_format):
+        del params['profile']
+    return params
+
+def parse_qr_params(data, accept=None):
+    """Validate QR code API parameters and return the normalized render parameters.
+
+    ``accept`` holds the request's Accept header pairs, used by image_format=auto.
+    """
+    if wants_negotiation(data):
+        data = _negotiated(data, accept)
+    qr_options = {name: _param(data, name, default) for name, default, _ in QR_SCHEMA if name in QR_LOGGED_OPTIONS}
+    context = {'code_value': _text_param(data) or '[empty]', 'image_format': _param(data, 'image_format', 'PNG'),
+               'qr_options': qr_options}
+    params = _validate(QR_SCHEMA, data, context)
+
+    # Digits are the densest mode, so longer values fit no QR code at all
+    max_digits = QR_MAX_DIGITS[params['error_correction']]
+    if len(params['text']) > max_digits:
+        raise ParameterError('Text too long', f'QR codes at error correction {params["error_correction"]} hold at '
+                             f'most {max_digits} characters', len(params['text']), **context)
+
+    # Left out for the default profile, so its cache keys and ETags stay as they were
+    if params['profile'] == 'default' or not has_encoding_profiles(params['image_format']):
+        del params['profile']
+    # Printers draw black on white, so colors would only split their cache keys and ETags
+    if params['image_format'] in PRINTER_FORMATS:
+        del params['fill_color'], params['back_color']
+    return params
+
+def barcode_form_data(form):
+    """API parameters of the barcode form on the index page, which draws with python-barcode's writer"""
+    data = form.to_dict()
+    data.setdefault('renderer', 'writer')
+    return data
+
+def qr_form_data(form):
+    """API parameters of the QR code form on the index page, whose fields are prefixed with qr_"""
+    return {name[3:]: value for name, value in form.items() if name.startswith('qr_')}
+
+def encode_url_text(text):
+    """Unpadded base64url form of a QR code value, as used in its GET URL"""
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _url_filename(filename, context):
+    """Split the '<value>.<ext>' last part of a GET URL into the value and its image format"""
+    value, dot, extension = filename.rpartition('.')
+    image_format = URL_EXTENSIONS.get(extension.lower()) if dot else None
+    if image_format is None:
+        raise ParameterError('Invalid image_format',
+                             f'The file extension must be one of: {", ".join(URL_EXTENSIONS)}',
+                             extension if dot else '', **context)
+    return value, image_format
+
+def barcode_url_data(symbology, filename, args):
+    """API parameters of /api/barcode/<symbology>/<text>.<ext>, for parse_barcode_params"""
+    context = {'code_value': filename, 'barcode_symbology': symbology}
+    text, image_format = _url_filename(filename, context)
+    data = {'text': text, 'barcode_type': symbology, 'image_format': image_format}
+    data.update((name, args[name]) for name in ('renderer', 'profile', *BARCODE_URL_GEOMETRY) if name in args)
+    return data
+
+def qr_url_data(error_correction, filename, args):
+    """API parameters of /api/qrcode/<ecc>/<base64url text>.<ext>, for parse_qr_params"""
+    context = {'code_value': filename, 'qr_options': {'error_correction': error_correction}}
+    encoded, image_format = _url_filename(filename, context)
+    try:
+        text = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode('utf-8')
+    except ValueError:
+        raise ParameterError('Invalid text', 'The value must be UTF-8 text encoded as base64url',
+                             encoded, image_format=image_format, **context)
+    data = {'text': text, 'error_correction': error_correction, 'image_format': image_format}
+    for name, field in QR_URL_PARAMS.items():
+        if name in args:
+            value = args[name]
+            if field.endswith('_color') and not value.startswith('#'):
+                value = '#' + value
+            data[field] = value
+    return data
+
+def url_query(code_type, params):
+    """Query parameters of the canonical GET URL for normalized render parameters.
+
+    Only values that differ from the defaults are kept, sorted by name, so every
+    image has exactly one URL.
+    """
+    query = {}
+    image_format = params['image_format']
+    profile = params.get('profile', 'default')
+    if has_encoding_profiles(image_format) and profile != IMAGE_PROFILE:
+        query['profile'] = profile
+    if code_type == 'barcode':
+        # SVG always uses the writer renderer
+        if params['renderer'] != 'fast' and image_format != 'SVG':
+            query['renderer'] = params['renderer']
+        for name in BARCODE_URL_GEOMETRY:
+            if name in params:
+                value = params[name]
+                query[name] = str(value).lower() if isinstance(value, bool) else f'{value:g}'
+    else:
+        if params['box_size'] != 10:
+            query['box_size'] = params['box_size']
+        if params['border'] != 4:
+            query['border'] = params['border']
+        if params.get('fill_color', '#000000') != '#000000':
+            query['fill'] = params['fill_color'][1:]
+        if params.get('back_color', '#ffffff') != '#ffffff':
+            query['back'] = params['back_color'][1:]
+        if params.get('mask') != QR_DEFAULT_MASK:
+            query['mask'] = params['mask']
+    return sorted((name, str(value)) for name, value in query.items())
+
+def parse_qr_matrix_params(data, accept=None):
+    """Validate /api/qrcode/matrix parameters and return (symbol parameters, output).
+
+    The request is validated exactly as by /api/qrcode, but only the text, error
+    correction level and mask determine the symbol. ``output`` is 'json' or
+    'binary', from the output field or else the Accept header pairs.
+    """
+    params = parse_qr_params(data, accept)
+    symbol_params = {key: params[key] for key in ('text', 'error_correction', 'mask') if key in params}
+
+    output = data.get('output')
+    if output is None or output == '':
+        qualities = dict((mimetype.lower(), quality) for mimetype, quality in accept or ())
+        binary = qualities.get(QR_MATRIX_OUTPUTS['binary'], 0)
+        output = 'binary' if binary > qualities.get(QR_MATRIX_OUTPUTS['json'], 0) else 'json'
+    elif output not in QR_MATRIX_OUTPUTS:
+        raise ParameterError('Invalid output', f'output must be one of: {", ".join(QR_MATRIX_OUTPUTS)}', output,
+                             code_value=params['text'], image_format=QR_MATRIX_FORMAT, qr_options=qr_log_options(params))
+    return symbol_params, output
+
+def qr_log_options(params):
+    """Return the qr_options stored with a generation record"""
+    keys = ('fill_color', 'back_color', 'box_size', 'border', 'error_correction', 'mask')
+    return {key: params[key] for key in keys if key in params}
+
+SHEET_LAYOUT_SCHEMA = (
+    ('page', 'A4', _choice('page', list(SHEET_PAGE_SIZES), lambda value: str(value).upper())),
+    ('output', 'PDF', _choice('output', SHEET_OUTPUTS, lambda value: str(value).upper())),
+    ('columns', 3, _number('columns', (1, 20), int)),
+    ('rows', 10, _number('rows', (1, 40), int)),
+    ('margin', 10, _number('margin', (0, 50))),   # mm around the grid
+    ('gap', 2, _number('gap', (0, 20))),          # mm between labels
+    ('padding', 1, _number('padding', (0, 10))),  # mm inside each label
+    ('dpi', 300, _number('dpi', (72, 600), int))
+)
+
+def parse_sheet_layout(data):
+    """Validate label sheet layout parameters and return the normalized layout"""
+    layout = _validate(SHEET_LAYOUT_SCHEMA, data, {})
+    width, height = SHEET_PAGE_SIZES[layout['page']]
+    cell_width = (width - 2 * layout['margin'] - (layout['columns'] - 1) * layout['gap']) / layout['columns']
+    cell_height = (height - 2 * layout['margin'] - (layout['rows'] - 1) * layout['gap']) / layout['rows']
+    if min(cell_width, cell_height) <= 2 * layout['padding']:
+        raise ParameterError('Invalid layout', 'margin, gap and padding leave no room for the labels on the page')
+    return layout
+
+def _datetime_param(data, name, default):
+    value = data.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ParameterError(f'Invalid {name}', f'{name} must be an ISO 8601 date or time, e.g. 2024-05-01T00:00:00Z',
+                             value)
+    if moment.tzinfo is not None:
+        # Generation records are stored in naive UTC
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def parse_stats_params(data, now=None):
+    """Validate usage stats parameters and return the hour-aligned range, granularity, grouping and filters"""
+    now = now or datetime.utcnow()
+    end = _datetime_param(data, 'end', now)
+    start = _datetime_param(data, 'start', end - timedelta(hours=24))
+
+    # Rollups are hourly: the range widens to whole hours
+    start = start.replace(minute=0, second=0, microsecond=0)
+    end_hour = end.replace(minute=0, second=0, microsecond=0)
+    end = end_hour if end == end_hour else end_hour + timedelta(hours=1)
+    if start >= end:
+        raise ParameterError('Invalid range', 'start must be before end', {'start': data.get('start'), 'end': data.get('end')})
+
+    granularity = data.get('granularity', 'hour')
+    if granularity not in STATS_GRANULARITIES:
+        raise ParameterError('Invalid granularity', f'granularity must be one of: {", ".join(STATS_GRANULARITIES)}',
+                             granularity)
+
+    max_days = STATS_MAX_HOURLY_DAYS if granularity == 'hour' else STATS_MAX_DAYS
+    if end - start > timedelta(days=max_days):
+        raise ParameterError('Invalid range', f'{granularity} stats cover at most {max_days} days',
+                             {'start': start.isoformat() + 'Z', 'end': end.isoformat() + 'Z'})
+
+    group_by = [field.strip() for field in str(data.get('group_by') or '').split(',') if field.strip()]
+    for field in group_by:
+        if field not in STATS_FIELDS:
+            raise ParameterError('Invalid group_by', f'group_by fields must be among: {", ".join(STATS_FIELDS)}',
+                                 data.get('group_by'))
+
+    filters = {}
+    code_type = data.get('code_type')
+    if code_type:
+        if code_type not in SPEC_PARSERS:
+            raise ParameterError('Invalid code_type', 'code_type must be one of: barcode, qrcode', code_type)
+        filters['code_type'] = code_type
+    symbology = data.get('symbology')
+    if symbology:
+        if symbology not in VALID_BARCODE_TYPES:
+            raise ParameterError('Invalid symbology', f'symbology must be one of: {", ".join(VALID_BARCODE_TYPES)}',
+                                 symbology)
+        filters['symbology'] = symbology
+    image_format = data.get('image_format')
+    if image_format:
+        if str(image_format).upper() not in VALID_IMAGE_FORMATS:
+            raise ParameterError('Invalid image_format',
+                                 f'image_format must be one of: {", ".join(VALID_IMAGE_FORMATS)}', image_format)
+        filters['image_format'] = image_format.upper()
+
+    return {'start': start, 'end': end, 'granularity': granularity, 'group_by': group_by, 'filters': filters}
+
+# Parsers for the item specs of batch and bulk job requests, by 'type'
+SPEC_PARSERS = {'barcode': parse_barcode_params, 'qrcode': parse_qr_params}